@@ -185,7 +185,7 @@ def gen_scan_observe(self: ra.Agent):
         if self.poll.Var is None:
             return_message = 'initiated'
             self.opt_found_count = 0
-            self.scan_cost_change_time = ra.timer()
+            self.scan_cost_change_time = ra.clock()
             self.scan_cost_decreasing = False
             self.scan_cost_is_flat = True
             r = {'optVal': detector_value
@@ -228,7 +228,7 @@ def gen_scan_observe(self: ra.Agent):
                           , 'optPosErrb': self.positioner.rbv_err_ag.poll.Var
                           })
                 # output the valid minima onto an external PV, purely for display reasons
-                self.scan_cost_change_time = ra.timer()
+                self.scan_cost_change_time = ra.clock()
                 self.out_PV.value = detector_value
 
     return r, return_message
@@ -256,7 +256,7 @@ def gen_scan_decide(self: ra.Agent):
             pass
 
     # CASE 2, timeout
-    lapsed_time = ra.timer() - self.scan_cost_change_time
+    lapsed_time = ra.clock() - self.scan_cost_change_time
     if (self.time_out is not None) and lapsed_time > self.time_out:
         self.positioner.move_to_ag.poll.force([self.poll.Var['optPos'], 0.05])
         self.act.hold(for_cycles=-1, reset_var=True)
@@ -76,10 +76,10 @@ class OL_RDB_Mlim(ra.Device):
         clearance_enc = tst["clearance_egu"] / enc_res
 
         self.test_ppmac = ppra.PPMAC(
-            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"]
+            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"], pooled=True
         )
-        # it is possible to use multiple gpascii channels,
-        # but we don't have a reason to do so, yet!
+        # the gpascii channels of the host are pooled,
+        # other devices on this ppmac share the ssh connection
 
         pp_glob_dict = ppra.load_pp_globals(tst["ppglobal_fname"])
         with open(tst["baseconfig_fname"]) as f:
@@ -413,7 +413,7 @@ class OL_Rdb_Lim2Lim(ra.Device):
         clearance_enc = self.set_test_params(tst)
 
         self.test_ppmac = ppra.PPMAC(
-            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"]
+            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"], pooled=True
         )
 
         pp_glob_dict = ppra.load_pp_globals(tst["ppglobal_fname"])
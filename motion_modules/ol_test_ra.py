@@ -28,7 +28,7 @@ class OLRdbLim2Lim(ra.Device):
         self.motor_id = motor_id
 
         self.test_ppmac = ppra.PPMAC(
-            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"]
+            tst["ppmac_hostname"], backward=tst["ppmac_is_backward"], pooled=True
         )
 
         pp_glob_dict = ppra.load_pp_globals(tst["ppglobal_fname"])
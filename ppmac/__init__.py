@@ -2,6 +2,7 @@
 __version__ = "0.0.0"
 
 from .gpascii import GpasciiClient
+from .pool import GpasciiPool, gpascii_pool
 from .ppmac_sg import PpmacToolMt
 
 __all__ = "ppmac"
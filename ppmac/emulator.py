@@ -0,0 +1,910 @@
+""" PowerPMAC emulator speaking gpascii, for tests and benchmarks without a brick
+
+PpmacModel keeps the elements and variables of an emulated ppmac and runs
+gpascii command lines on them. PpmacEmulator serves a model to the ppmac drivers,
+either as the ssh client of a host name, in place of paramiko:
+
+    emulator = PpmacEmulator(latency=0.001)
+    emulator.attach("emulated")
+    ppmac = PPMAC("emulated", pooled=True)
+    ppmac.connect()
+
+or on a local tcp port, one gpascii -2 session per connection:
+
+    host, port = emulator.serve()
+
+Only a small part of the brick is emulated: the element structures below,
+P, Q, L and M variables, arithmetic on the right side of assignments and the
+online jog, kill, enable and home commands of the motors. A motor moves at its
+JogSpeed, with no acceleration, and stops at its soft limits and at the limit
+switches set in PpmacModel.limit_switches.
+"""
+
+import argparse
+import ast
+import math
+import operator
+import re
+import select
+import socket
+import threading
+import time
+import paramiko  # ssh library
+from ppmac import util
+
+prompt = "ppmac# "
+banner = "STDIN Open for ASCII Input"
+
+# element structures: index range (None if not indexed), fields with their
+# power on values and sub structures of the same form.
+# Other fields of these structures read as ILLEGAL PARAMETER until they are set.
+channel_fields = {
+    "ServoCapt": 0,
+    "HomeCapt": 0,
+    "PhaseCapt": 0,
+    "CountError": 0,
+    "EncCtrl": 3,
+    "CaptCtrl": 0,
+    "CaptFlagSel": 0,
+    "OutputMode": 0,
+    "PackOutData": 0,
+    "PfmFormat": 0,
+    "TimerMode": 0,
+    "Status": 0,
+}
+gate_fields = {"PhaseFreq": 9035.69, "ServoClockDiv": 0, "PartNum": 603793}
+
+structures = {
+    "Motor": (
+        range(0, 33),
+        {
+            "ActPos": 0.0,
+            "DesPos": 0.0,
+            "ActVel": 0.0,
+            "DesVel": 0.0,
+            "JogSpeed": 32.0,
+            "JogTa": -0.5,
+            "JogTs": -0.5,
+            "HomeVel": 32.0,
+            "HomeOffset": 0,
+            "HomePos": 0.0,
+            "CapturedPos": 0.0,
+            "MaxPos": 0.0,
+            "MinPos": 0.0,
+            "PosSf": 1.0,
+            "Pos2Sf": 1.0,
+            "ServoCtrl": 1,
+            "ClosedLoop": 0,
+            "AmpEna": 0,
+            "AmpFault": 0,
+            "InPos": 1,
+            "PlusLimit": 0,
+            "MinusLimit": 0,
+            "HomeComplete": 0,
+            "FeFatal": 0,
+            "Status": 0,
+        },
+        {},
+    ),
+    "Coord": (range(0, 17), {"TimeBase": 100.0, "ProgRunning": 0}, {}),
+    "Plc": (range(0, 32), {"Active": 0, "Running": 0}, {}),
+    "Gate3": (range(0, 2), gate_fields, {"Chan": (range(0, 4), channel_fields, {})}),
+    "PowerBrick": (
+        range(0, 2),
+        gate_fields,
+        {"Chan": (range(0, 4), channel_fields, {})},
+    ),
+    "Sys": (
+        None,
+        {
+            "Time": 0.0,
+            "ServoCount": 0,
+            "ServoPeriod": 0.442,
+            "PhaseOverServoPeriod": 0.25,
+        },
+        {},
+    ),
+}
+
+# P, Q, L and M variables and their number
+variables = {"p": 65536, "q": 8192, "l": 8192, "m": 16384}
+
+# error numbers of the gpascii error messages
+error_codes = {
+    "MOTOR NOT ACTIVE": 3,
+    "NOT READY TO RUN": 9,
+    "OUT OF RANGE NUMBER": 16,
+    "ILLEGAL CMD": 20,
+    "ILLEGAL PARAMETER": 21,
+}
+
+element_part = r"[a-z]\w*(?:\[\d+\])?"
+element_pattern = re.compile(rf"{element_part}(?:\.{element_part})+", re.I)
+variable_pattern = re.compile(r"([pqlm])(?:(\d+)|\(([^()]*)\))", re.I)
+motor_pattern = re.compile(r"#(\d+(?:(?:,|\.\.)\d+)*)(.*)")
+# motor commands which go to the last addressed motor without a #N
+addressed_pattern = re.compile(r"j[+\-/=:^].*|j=|k|kill|\$|hmz?", re.I)
+# what may stand on the right side of an assignment
+reference_pattern = re.compile(
+    rf"#\d+[pvfdtg]|{element_part}(?:\.{element_part})+"
+    r"|\b[pqlm](?:\d+|\([^()]*\))",
+    re.I,
+)
+# a command ending with an operator continues in the next word, unless it is
+# a complete jog, as does a word starting with one
+jog_pattern = re.compile(r"(#[\d,.]+)?j[+\-/]$", re.I)
+continued_after = "=+-*/%:^&|(,"
+continued_before = "=+-*/%^|),"
+
+operators = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Mod: operator.mod,
+    ast.Pow: operator.pow,
+    ast.BitAnd: operator.and_,
+    ast.BitOr: operator.or_,
+    ast.BitXor: operator.xor,
+    ast.LShift: operator.lshift,
+    ast.RShift: operator.rshift,
+    ast.USub: operator.neg,
+    ast.UAdd: operator.pos,
+}
+functions = {
+    "abs": abs,
+    "int": int,
+    "rint": round,
+    "sqrt": math.sqrt,
+    "exp": math.exp,
+    "ln": math.log,
+    "sin": math.sin,
+    "cos": math.cos,
+    "tan": math.tan,
+    "atan": math.atan,
+    "atan2": math.atan2,
+}
+
+
+class PpmacError(Exception):
+    """ a command refused by the emulated ppmac, the message is the gpascii one """
+
+    def __init__(self, message="ILLEGAL CMD"):
+        super().__init__(message)
+        self.code = error_codes[message]
+
+
+def format_value(value):
+    """ a value as gpascii prints it, integral values without a decimal point """
+    if isinstance(value, float):
+        if value.is_integer():
+            return str(int(value))
+        return f"{value:.15g}"
+    return str(value)
+
+
+def evaluate_node(node):
+    if isinstance(node, ast.Expression):
+        return evaluate_node(node.body)
+    if isinstance(node, ast.Constant) and isinstance(node.value, (int, float)):
+        return node.value
+    if isinstance(node, ast.BinOp) and type(node.op) in operators:
+        left, right = evaluate_node(node.left), evaluate_node(node.right)
+        return operators[type(node.op)](left, right)
+    if isinstance(node, ast.UnaryOp) and type(node.op) in operators:
+        return operators[type(node.op)](evaluate_node(node.operand))
+    if (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id.lower() in functions
+        and not node.keywords
+    ):
+        args = [evaluate_node(arg) for arg in node.args]
+        return functions[node.func.id.lower()](*args)
+    raise PpmacError("ILLEGAL PARAMETER")
+
+
+def arithmetic(expr):
+    """ the value of an expression of numbers, $ for hex """
+    expr = re.sub(r"\$([0-9a-f]+)", lambda m: str(int(m[1], 16)), expr, flags=re.I)
+    try:
+        return evaluate_node(ast.parse(expr.strip(), mode="eval"))
+    except (SyntaxError, TypeError, ValueError, ArithmeticError):
+        raise PpmacError("ILLEGAL PARAMETER") from None
+
+
+def split_commands(line):
+    """ the commands of a line as (column, command), e.g.
+    "#1j+ #2p P1 = 2 * P2" has "#1j+", "#2p" and "P1=2*P2" """
+
+    commands = []
+    for match in re.finditer(r"\S+", line):
+        token = match.group()
+        if commands:
+            column, previous = commands[-1]
+            continued = previous[-1] in continued_after and not jog_pattern.match(
+                previous
+            )
+            if continued or token[0] in continued_before:
+                commands[-1] = (column, previous + token)
+                continue
+        commands.append((match.start() + 1, token))
+    return commands
+
+
+class PpmacModel:
+    """ the elements and variables of an emulated ppmac and its motors' jogs.
+    Thread safe, the sessions of all clients share one model.
+
+    limit_switches: motor number to (minus, plus) positions of its limit switches
+    home_switches: motor number to the position a home search stops at, 0 if not set
+    """
+
+    def __init__(self, n_motors=8):
+        self.n_motors = n_motors
+        self.lock = threading.RLock()
+        self.values = {}  # lowercased element or variable to value
+        self.names = {}  # lowercased element or variable to the name it reads back as
+        self.jogs = {}  # moving motor to its target, +/-inf for a continuous jog
+        self.homing = set()
+        self.limit_switches = {}
+        self.home_switches = {}
+        self.programs = {}
+        self.buffer = None  # lines of the open program buffer
+        self.start_time = time.monotonic()
+        self.last_advance = self.start_time
+        self.n_lines = 0
+        self.addressed = 1  # motor
+
+        for n in range(1, n_motors + 1):
+            self.set(f"Motor[{n}].ServoCtrl", 1)
+        for n in range(n_motors + 1, len(structures["Motor"][0])):
+            self.set(f"Motor[{n}].ServoCtrl", 0)
+
+    # elements and variables
+
+    def resolve(self, name):
+        """ the key, the canonical name and the power on value of an element
+        or variable, ILLEGAL PARAMETER if the ppmac has no such thing """
+
+        match = variable_pattern.fullmatch(name)
+        if match:
+            letter = match[1].lower()
+            index = int(match[2]) if match[2] else int(arithmetic(match[3]))
+            if not 0 <= index < variables[letter]:
+                raise PpmacError("OUT OF RANGE NUMBER")
+            return f"{letter}{index}", f"{letter.upper()}{index}", 0
+
+        if not element_pattern.fullmatch(name):
+            raise PpmacError("ILLEGAL CMD")
+
+        parts = [
+            re.fullmatch(r"(\w+)(?:\[(\d+)\])?", part).groups()
+            for part in name.split(".")
+        ]
+        *path, (field, field_index) = parts
+        names, table = [], structures
+        for part, index in path:
+            structure = self.lookup(table, part)
+            if structure is None:
+                raise PpmacError("ILLEGAL PARAMETER")
+            canonical, (indexed, fields, table) = structure
+            if (indexed is None) != (index is None) or (
+                index is not None and int(index) not in indexed
+            ):
+                raise PpmacError("ILLEGAL PARAMETER")
+            names.append(canonical + (f"[{int(index)}]" if index else ""))
+
+        canonical, default = self.lookup(fields, field) or (field, None)
+        names.append(canonical + (f"[{int(field_index)}]" if field_index else ""))
+
+        canonical_name = ".".join(names)
+        return canonical_name.lower(), canonical_name, default
+
+    @staticmethod
+    def lookup(table, name):
+        """ (name, entry) of table, whatever the case of name """
+        for key, entry in table.items():
+            if key.lower() == name.lower():
+                return key, entry
+        return None
+
+    def get(self, name):
+        key, canonical, default = self.resolve(name)
+        if key == "sys.time":
+            return time.monotonic() - self.start_time
+        if key == "sys.servocount":
+            return int((time.monotonic() - self.start_time) * 1e3 / self.servo_period)
+        if key in self.values:
+            return self.values[key]
+        if default is None:
+            raise PpmacError("ILLEGAL PARAMETER")
+        return default
+
+    def set(self, name, value):
+        key, canonical, _ = self.resolve(name)
+        self.values[key] = value
+        self.names.setdefault(key, canonical)
+
+    def name_of(self, name):
+        key, canonical, _ = self.resolve(name)
+        return self.names.get(key, canonical)
+
+    @property
+    def servo_period(self):
+        return self.get("Sys.ServoPeriod")  # [ms]
+
+    def evaluate(self, expr):
+        """ the value of the right side of an assignment """
+
+        def value_of(match):
+            ref = match.group()
+            if ref.startswith("#"):
+                return format_value(self.motor_query(int(ref[1:-1]), ref[-1].lower()))
+            return format_value(self.get(ref))
+
+        return arithmetic(reference_pattern.sub(value_of, expr))
+
+    # motors
+
+    def motor(self, n, field):
+        return self.get(f"Motor[{n}].{field}")
+
+    def set_motor(self, n, **fields):
+        for field, value in fields.items():
+            self.set(f"Motor[{n}].{field}", value)
+
+    def motor_query(self, n, letter):
+        """ #Np, #Nv, #Nf, #Nd, #Nt or #Ng of motor n """
+        position, home = self.motor(n, "ActPos"), self.motor(n, "HomePos")
+        target = self.jogs.get(n, self.motor(n, "DesPos"))
+        if math.isinf(target):
+            target = self.motor(n, "DesPos")
+        if letter == "p":
+            return position - home
+        if letter == "v":
+            return self.motor(n, "ActVel")
+        if letter == "f":
+            return self.motor(n, "DesPos") - position
+        if letter == "d":
+            return self.motor(n, "DesPos") - home
+        if letter == "t":
+            return target - home
+        if letter == "g":
+            return target - self.motor(n, "DesPos")
+        raise PpmacError("ILLEGAL CMD")
+
+    def jog(self, n, target):
+        """ moves motor n to target at JogSpeed, +/-inf to jog on """
+        if not self.motor(n, "ServoCtrl"):
+            raise PpmacError("MOTOR NOT ACTIVE")
+        self.set_motor(n, ClosedLoop=1, AmpEna=1)
+        low, high = self.motor(n, "MinPos"), self.motor(n, "MaxPos")
+        if high > low:
+            # soft limits
+            target = min(max(target, low), high)
+        if target == self.motor(n, "DesPos"):
+            self.stop(n)
+            return
+        self.jogs[n] = target
+        self.set_motor(n, InPos=0)
+
+    def stop(self, n):
+        self.jogs.pop(n, None)
+        self.homing.discard(n)
+        self.set_motor(n, ActVel=0.0, DesVel=0.0, InPos=1)
+
+    def advance(self, now=None):
+        """ moves the jogging motors to where they are by now """
+
+        now = time.monotonic() if now is None else now
+        elapsed, self.last_advance = now - self.last_advance, now
+        for n, target in list(self.jogs.items()):
+            position = self.motor(n, "DesPos")
+            speed = abs(self.motor(n, "JogSpeed")) * 1e3  # [cts/s]
+            direction = 1 if target > position else -1
+            step = min(speed * elapsed, abs(target - position))
+            position += direction * step
+            minus, plus = self.limit_switches.get(n, (-math.inf, math.inf))
+            self.set_motor(n, PlusLimit=int(position >= plus))
+            self.set_motor(n, MinusLimit=int(position <= minus))
+            position = min(max(position, minus), plus)
+            velocity = direction * speed / 1e3  # [cts/ms]
+            self.set_motor(n, ActPos=position, DesPos=position)
+            self.set_motor(n, ActVel=velocity, DesVel=velocity)
+
+            hit_limit = position >= plus if direction > 0 else position <= minus
+            if position == target or hit_limit:
+                if n in self.homing:
+                    self.set_motor(n, HomePos=position, HomeComplete=1)
+                self.stop(n)
+
+    def motor_command(self, n, command):
+        """ runs the online command of motor n, returns its reply or None """
+
+        lower = command.lower()
+        if n not in structures["Motor"][0]:
+            raise PpmacError("OUT OF RANGE NUMBER")
+        if lower and all(letter in "pvfdtg" for letter in lower):
+            return " ".join(
+                format_value(self.motor_query(n, letter)) for letter in lower
+            )
+
+        position = self.motor(n, "DesPos")
+        if lower in ["", "j/"]:
+            if lower:
+                self.jog(n, position)
+        elif lower == "j+":
+            self.jog(n, math.inf)
+        elif lower == "j-":
+            self.jog(n, -math.inf)
+        elif lower == "j=":
+            self.jog(n, self.motor(n, "HomePos"))
+        elif lower.startswith("j="):
+            self.jog(n, self.motor(n, "HomePos") + self.evaluate(command[2:]))
+        elif lower.startswith("j:"):
+            self.jog(n, position + self.evaluate(command[2:]))
+        elif lower.startswith("j^"):
+            self.jog(n, self.motor(n, "ActPos") + self.evaluate(command[2:]))
+        elif lower in ["k", "kill"]:
+            self.stop(n)
+            self.set_motor(n, ClosedLoop=0, AmpEna=0)
+        elif lower == "$":
+            if not self.motor(n, "ServoCtrl"):
+                raise PpmacError("MOTOR NOT ACTIVE")
+            self.stop(n)
+            self.set_motor(n, ClosedLoop=1, AmpEna=1, DesPos=self.motor(n, "ActPos"))
+        elif lower == "hm":
+            self.jog(n, self.home_switches.get(n, 0.0))
+            self.homing.add(n)
+            self.set_motor(n, HomeComplete=0)
+            if n not in self.jogs:
+                # already on the home switch
+                self.set_motor(n, HomePos=position, HomeComplete=1)
+                self.homing.discard(n)
+        elif lower == "hmz":
+            self.stop(n)
+            self.set_motor(n, HomePos=self.motor(n, "ActPos"), HomeComplete=1)
+        else:
+            raise PpmacError("ILLEGAL CMD")
+        return None
+
+    # command lines
+
+    def command(self, command):
+        """ runs one command, returns its reply line or None """
+
+        match = motor_pattern.fullmatch(command)
+        if match:
+            motors = []
+            for group in match[1].split(","):
+                first, _, last = group.partition("..")
+                motors += range(int(first), int(last or first) + 1)
+            replies = [self.motor_command(n, match[2]) for n in motors]
+            replies = [reply for reply in replies if reply is not None]
+            self.addressed = motors[-1]
+            return "\n".join(replies) if replies else None
+        if addressed_pattern.fullmatch(command):
+            return self.motor_command(self.addressed, command)
+        match = re.fullmatch(r"%(\d+(?:\.\d*)?)", command)
+        if match:
+            # feed rate override of the coordinate system
+            self.set("Coord[1].TimeBase", float(match[1]))
+            return None
+
+        name, assigned, expr = command.partition("=")
+        if assigned:
+            self.set(name, self.evaluate(expr))
+            return None
+        return f"{self.name_of(name)}={format_value(self.get(name))}"
+
+    def execute(self, line):
+        """ runs a gpascii command line, returns its reply lines and error lines """
+
+        with self.lock:
+            self.n_lines += 1
+            self.advance()
+            text = line.strip()
+            lower = " ".join(text.lower().split())
+
+            if self.buffer is not None:
+                if lower == "close":
+                    self.buffer = None
+                else:
+                    self.buffer.append(text)
+                return [], []
+            match = re.fullmatch(r"open (plc|prog|subprog) (\w+)", lower)
+            if match:
+                self.buffer = self.programs.setdefault(match.groups(), [])
+                self.buffer.clear()
+                return [], []
+            match = re.fullmatch(r"(enable|disable) plc ([\d,]+)", lower)
+            if match:
+                for n in match[2].split(","):
+                    running = int(match[1] == "enable")
+                    self.set(f"Plc[{n}].Active", running)
+                    self.set(f"Plc[{n}].Running", running)
+                return [], []
+            if lower in ["close", "save", "echo 0", "echo 1"]:
+                return [], []
+
+            replies, errors = [], []
+            for column, command in split_commands(text):
+                try:
+                    reply = self.command(command)
+                except PpmacError as exc:
+                    where = f"stdin:{self.n_lines}:{column}"
+                    errors.append(f"{where}: error #{exc.code}: {exc}: {text}")
+                    break
+                if reply is not None:
+                    replies.append(reply)
+            return replies, errors
+
+
+class GpasciiSession:
+    """ a gpascii -2 on a model, command bytes in, reply bytes out.
+    In a shell, as invoke_shell has it, the input is echoed, the errors come on
+    stdout and gpascii is run from the prompt.
+    """
+
+    def __init__(self, model: PpmacModel, shell=False):
+        self.model = model
+        self.shell = shell
+        self.in_gpascii = not shell
+        self.newline = "\r\n" if shell else "\n"
+        self.pending = b""
+        self.closed = False
+
+    def greeting(self):
+        """ what the client reads first """
+        if self.shell:
+            return prompt.encode()
+        return (banner + self.newline).encode()
+
+    def feed(self, data):
+        """ the stdout and stderr bytes of the complete lines in data,
+        and their number """
+
+        # ctrl-c ends a line too
+        self.pending += data.replace(b"\x03", b"\x03\n")
+        *lines, self.pending = self.pending.split(b"\n")
+        out, err = [], []
+        for line in lines:
+            if self.closed:
+                break
+            line = line.decode("utf-8", errors="replace").rstrip("\r")
+            if self.shell:
+                out.append(line.replace("\x03", "^C") + self.newline)
+            if self.in_gpascii:
+                self.gpascii_line(line, out, err)
+            else:
+                self.shell_line(line, out)
+        return "".join(out).encode(), "".join(err).encode(), len(lines)
+
+    def gpascii_line(self, line, out, err):
+        if "\x03" in line:
+            if self.shell:
+                self.in_gpascii = False
+                out.append(prompt)
+            else:
+                self.closed = True
+            return
+        replies, errors = self.model.execute(line)
+        errors = "".join(error + self.newline for error in errors)
+        (out if self.shell else err).append(errors)
+        out.extend(reply + self.newline for reply in "\n".join(replies).splitlines())
+        out.append("\x06" + self.newline)
+
+    def shell_line(self, line, out):
+        command = line.strip()
+        if command.startswith("gpascii"):
+            self.in_gpascii = True
+            out.append(banner + self.newline)
+        elif command in ["exit", "logout"]:
+            self.closed = True
+        elif command and "\x03" not in command:
+            out.append(f"-sh: {command.split()[0]}: not found{self.newline}{prompt}")
+        else:
+            out.append(prompt)
+
+
+class EmulatedFile:
+    """ stdin, stdout or stderr of an exec_command, as paramiko.ChannelFile """
+
+    def __init__(self, channel):
+        self.channel = channel
+
+    def write(self, text):
+        self.channel.sendall(text.encode() if isinstance(text, str) else text)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EmulatedChannel:
+    """ the parts of a paramiko.Channel the ppmac drivers use, served by a
+    GpasciiSession over a local socket pair, so select works on it """
+
+    def __init__(self, emulator, shell=False):
+        self.emulator = emulator
+        self.session = GpasciiSession(emulator.model, shell=shell)
+        self.sock, self.peer = socket.socketpair()
+        self.stderr_buffer = bytearray()
+        self.stderr_lock = threading.Lock()
+        self.closed = False
+
+        self.peer.sendall(self.session.greeting())
+        self.thread = threading.Thread(
+            target=emulator.run_link,
+            args=(self.peer, self.session, self.write_stderr),
+            daemon=True,
+        )
+        self.thread.start()
+
+    def write_stderr(self, data):
+        with self.stderr_lock:
+            self.stderr_buffer += data
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def recv(self, nbytes):
+        return self.sock.recv(nbytes)
+
+    def recv_ready(self):
+        return bool(select.select([self.sock], [], [], 0)[0])
+
+    def recv_stderr_ready(self):
+        return bool(self.stderr_buffer)
+
+    def recv_stderr(self, nbytes):
+        with self.stderr_lock:
+            data = bytes(self.stderr_buffer[:nbytes])
+            del self.stderr_buffer[:nbytes]
+        return data
+
+    def send(self, data):
+        return self.sock.send(data.encode() if isinstance(data, str) else data)
+
+    def sendall(self, data):
+        self.sock.sendall(data.encode() if isinstance(data, str) else data)
+
+    def exit_status_ready(self):
+        return self.closed
+
+    def drop(self):
+        """ the brick side goes away, the client reads the end of the stream """
+        for sock in [self.peer, self.sock]:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.peer.close()
+
+    def close(self):
+        self.closed = True
+        self.drop()
+        self.sock.close()
+
+
+class EmulatedTransport:
+    def __init__(self):
+        self.active = True
+
+    def is_active(self):
+        return self.active
+
+
+class EmulatedSSHClient:
+    """ a paramiko.SSHClient connecting to a PpmacEmulator """
+
+    def __init__(self, emulator):
+        self.emulator = emulator
+        self.transport = None
+        self.channels = []
+
+    def set_missing_host_key_policy(self, policy):
+        pass
+
+    def connect(self, hostname, username=None, password=None, **kwargs):
+        if not self.emulator.online:
+            raise socket.timeout("timed out")
+        if (username, password) != self.emulator.credentials:
+            raise paramiko.AuthenticationException("Authentication failed.")
+        self.transport = EmulatedTransport()
+        with self.emulator.lock:
+            self.emulator.clients.append(self)
+
+    def open_channel(self, shell):
+        if self.transport is None or not self.transport.active:
+            raise paramiko.SSHException("SSH session not active")
+        channel = EmulatedChannel(self.emulator, shell=shell)
+        self.channels.append(channel)
+        return channel
+
+    def exec_command(self, command, bufsize=-1, **kwargs):
+        if not command.startswith("gpascii"):
+            raise paramiko.SSHException(f"{command} is not emulated")
+        channel = self.open_channel(shell=False)
+        return EmulatedFile(channel), EmulatedFile(channel), EmulatedFile(channel)
+
+    def invoke_shell(self, **kwargs):
+        return self.open_channel(shell=True)
+
+    def get_transport(self):
+        return self.transport
+
+    def drop(self):
+        """ the ssh connection is lost """
+        if self.transport is not None:
+            self.transport.active = False
+        for channel in self.channels:
+            channel.drop()
+
+    def close(self):
+        self.drop()
+        for channel in self.channels:
+            channel.close()
+        self.channels = []
+
+
+class PpmacEmulator:
+    """ serves a PpmacModel to ssh clients made by ssh_client() and on tcp,
+    with latency and throughput limits like a brick on the network.
+
+    latency: [s] from receiving a command line to its reply
+    commands_per_s: lines the brick runs per second, unlimited if None
+    bytes_per_s: of the replies, unlimited if None
+    online: if False, connecting times out, as with the brick off
+    """
+
+    def __init__(
+        self,
+        model: PpmacModel = None,
+        latency=0.0,
+        commands_per_s=None,
+        bytes_per_s=None,
+        credentials=("root", "deltatau"),
+    ):
+        self.model = PpmacModel() if model is None else model
+        self.latency = latency
+        self.commands_per_s = commands_per_s
+        self.bytes_per_s = bytes_per_s
+        self.credentials = credentials
+        self.online = True
+        self.lock = threading.Lock()
+        self.clients = []
+        self.hosts = []
+        self.server = None
+        self.connections = []
+
+    def ssh_client(self):
+        return EmulatedSSHClient(self)
+
+    def attach(self, host):
+        """ connecting to host reaches the emulator from now on """
+        util.ssh_clients[host] = self.ssh_client
+        self.hosts.append(host)
+
+    def detach(self, host):
+        util.ssh_clients.pop(host, None)
+        self.hosts.remove(host)
+
+    def run_link(self, sock, session: GpasciiSession, write_stderr=None):
+        """ answers the command lines read from sock until either side closes.
+        Errors go to write_stderr, or on the stream before the replies. """
+
+        busy_until = 0.0
+        while not session.closed:
+            try:
+                data = sock.recv(65536)
+            except OSError:
+                break
+            if not data:
+                break
+            received = time.perf_counter()
+            out, err, n_lines = session.feed(data)
+            if not (out or err or n_lines):
+                continue
+
+            busy_until = max(busy_until, received)
+            if self.commands_per_s:
+                busy_until += n_lines / self.commands_per_s
+            if self.bytes_per_s:
+                busy_until += (len(out) + len(err)) / self.bytes_per_s
+            delay = busy_until + self.latency - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+            if err:
+                if write_stderr is None:
+                    out = err + out
+                else:
+                    write_stderr(err)
+            try:
+                sock.sendall(out)
+            except OSError:
+                break
+
+        try:
+            sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        sock.close()
+
+    def serve(self, address=("127.0.0.1", 0)):
+        """ listens on address, (host, port) returned. Each connection is a
+        gpascii -2 whose errors are on the stream too. """
+
+        self.server = socket.create_server(address)
+        threading.Thread(target=self.accept_loop, daemon=True).start()
+        return self.server.getsockname()[:2]
+
+    def accept_loop(self):
+        while True:
+            try:
+                sock, _ = self.server.accept()
+            except OSError:
+                return
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            session = GpasciiSession(self.model)
+            self.connections.append(sock)
+            sock.sendall(session.greeting())
+            threading.Thread(
+                target=self.run_link, args=(sock, session), daemon=True
+            ).start()
+
+    def drop(self):
+        """ every link to the emulator is lost, e.g. the brick reboots """
+        with self.lock:
+            clients, self.clients = self.clients, []
+        for client in clients:
+            client.drop()
+        for sock in self.connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        self.connections = []
+
+    def close(self):
+        for host in list(self.hosts):
+            self.detach(host)
+        self.drop()
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PowerPMAC gpascii emulator")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--motors", type=int, default=8)
+    parser.add_argument("--latency", type=float, default=0.0, help="[s]")
+    parser.add_argument("--commands-per-s", type=float, default=None)
+    parser.add_argument("--bytes-per-s", type=float, default=None)
+    args = parser.parse_args()
+
+    emulator = PpmacEmulator(
+        PpmacModel(n_motors=args.motors),
+        latency=args.latency,
+        commands_per_s=args.commands_per_s,
+        bytes_per_s=args.bytes_per_s,
+    )
+    host, port = emulator.serve(("127.0.0.1", args.port))
+    print(f"gpascii emulator on {host}:{port}")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        emulator.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -2,12 +2,129 @@
 for talking to the powerbrick directly via python"""
 
 # from typing import List
+import re
 import sys
 import time
 import select
+import threading
 from collections import deque
+from concurrent.futures import Future, TimeoutError as FutureTimeout
 import paramiko  # ssh library
-from ppmac.util import ClosingContextManager
+from ppmac.util import Backoff, ClosingContextManager, new_ssh_client
+
+# commands which only read, see is_read
+read_patterns = [
+    re.compile(r"#\d+[pvfdtg]+", re.IGNORECASE),  # e.g. #1p, #2pvf
+    re.compile(r"[pqimldc]\d+", re.IGNORECASE),  # e.g. p100
+    # data structure elements, e.g. Motor[1].ActPos, Sys.Time
+    re.compile(r"[a-z_]\w*(\[[^\]=]*\])?(\.\w+(\[[^\]=]*\])?)+", re.IGNORECASE),
+]
+
+
+def is_read(cmds):
+    """ True if every command in cmds is a query, so it is safe to send again """
+    tokens = cmds.split()
+    return bool(tokens) and all(
+        any(pattern.fullmatch(token) for pattern in read_patterns) for token in tokens
+    )
+
+
+def ack_count(cmds, response_count=None):
+    """ number of \x06 acks gpascii sends back for the lines in cmds """
+    cmd_count = cmds.count("\n") + cmds.count("\r") + 1
+    if not response_count:
+        return cmd_count
+    return max(response_count, cmd_count)
+
+
+class ReceiveBuffer:
+    """ the bytes received from gpascii, with the acks counted as they come in
+
+    Each byte is scanned for acks once, the replies are taken off the front by
+    moving an offset and decoded straight from a memoryview, and the consumed
+    front is dropped only once it is the larger part. Receiving is linear in the
+    size of the replies however they are split into reads.
+    """
+
+    compact_size = 1 << 16
+
+    def __init__(self):
+        self.data = bytearray()
+        self.start = 0  # first byte not taken yet
+        self.acks = deque()  # positions of the acks not taken yet
+        # the \n trailing the last ack taken has not been received yet
+        self.skip_newline = False
+
+    def __len__(self):
+        return len(self.data) - self.start
+
+    @property
+    def n_acks(self):
+        return len(self.acks)
+
+    def extend(self, chunk):
+        if not chunk:
+            return
+        scan = len(self.data)
+        self.data += chunk
+        if self.skip_newline:
+            self.skip_newline = False
+            if self.data[self.start] == 0x0A:
+                self.start += 1
+                scan = max(scan, self.start)
+
+        find = self.data.find
+        ack_pos = find(b"\x06", scan)
+        while ack_pos != -1:
+            self.acks.append(ack_pos)
+            ack_pos = find(b"\x06", ack_pos + 1)
+
+    def take(self, n_acks=1):
+        """ the text up to the n_acks-th ack, dropping that ack and the \n after it.
+        The acks in between are left in the text. """
+
+        if n_acks > len(self.acks):
+            raise ValueError(f"{len(self.acks)} acks received, {n_acks} asked for")
+        for _ in range(n_acks - 1):
+            self.acks.popleft()
+        end = self.acks.popleft()
+
+        with memoryview(self.data) as view:
+            text = str(view[self.start : end], "utf-8")
+
+        self.start = end + 1
+        if self.start < len(self.data):
+            if self.data[self.start] == 0x0A:
+                self.start += 1
+        else:
+            self.skip_newline = True
+
+        if self.start > self.compact_size and 2 * self.start > len(self.data):
+            self.compact()
+        return text
+
+    def compact(self):
+        del self.data[: self.start]
+        self.acks = deque(ack_pos - self.start for ack_pos in self.acks)
+        self.start = 0
+
+    def clear(self):
+        self.data = bytearray()
+        self.start = 0
+        self.acks.clear()
+        self.skip_newline = False
+
+
+class PendingBatch:
+    """ a batch of commands sent in pipelined mode, waiting for its acks """
+
+    __slots__ = ("cmds", "n_acks", "future", "sent_time")
+
+    def __init__(self, cmds, n_acks):
+        self.cmds = cmds
+        self.n_acks = n_acks
+        self.future = Future()
+        self.sent_time = time.time()
 
 
 class GpasciiClient(ClosingContextManager):
@@ -23,6 +140,9 @@ class GpasciiClient(ClosingContextManager):
         "OUT OF RANGE NUMBER",
     ]
 
+    # seen if gpascii exits and leaves the ssh shell
+    ssh_prompt = b"ppmac# "
+
     def __init__(self, host, debug=False):
         # TODO: check valid host or host lookup
         self.host = host.strip(" ")
@@ -33,6 +153,7 @@ class GpasciiClient(ClosingContextManager):
         # ssh_prompt = "ppmac# "
         self.timeout = 5
         self.paramiko_session = None  # paramiko connection for send/receive.
+        self.owns_session = True
         # gpascii_session = None
         self.connected = False
         self.stdin = None
@@ -40,7 +161,10 @@ class GpasciiClient(ClosingContextManager):
         self.stderr = None
         self.debug = debug
 
-        self.rcv_buffer = ""
+        self.rcv_buffer = ReceiveBuffer()
+        self.recv_size = 65536  # bytes asked for in each channel read
+        # ack counts of the timed out exchanges, their replies are dropped
+        self.stale_acks = deque([])
 
         # list of commands for which we are waiting for a reply.
         # The first element in the list is the next expected reply
@@ -56,6 +180,29 @@ class GpasciiClient(ClosingContextManager):
         self.snum_received = 0
         self.save_time_per_cmd = 0  # [ms/cmd]
 
+        # pipelined mode, see start_pipeline
+        self.pipelined = False
+        self.pending = deque([])  # PendingBatch, in the order they were sent
+        self.send_lock = threading.RLock()
+        self.reader_thread = None
+        self.reader_stop = threading.Event()
+        self.reader_period = 0.05  # [s] the reader checks for stop this often
+
+        # reconnecting, see mark_lost
+        self.auto_reconnect = True
+        self.backoff = Backoff()
+        self.credentials = ("root", "deltatau")
+        # callable returning the ssh session to reopen on, if it is not owned
+        self.session_source = None
+        self.lost_reason = ""
+        self.lost_after_timeouts = 3  # timeouts in a row taken for a lost link
+        self.n_timeouts = 0
+        self.n_reconnects = 0
+        self.replay = []  # reads in flight when the link was lost, PendingBatch
+        self.closing = threading.Event()
+        self.link_changed = threading.Condition()
+        self.reconnect_thread = None
+
     def connect(self, username="root", password="deltatau"):
         """ssh to PowerBrick and run gpascii.
         returns True (success) if connected
@@ -68,9 +215,12 @@ class GpasciiClient(ClosingContextManager):
         if self.host is None:
             return False
 
+        self.credentials = (username, password)
+        self.closing.clear()
+
         self.d_print(f"Trying to connect to ppmac at {self.host} ..")
         try:
-            self.paramiko_session = paramiko.SSHClient()
+            self.paramiko_session = new_ssh_client(self.host)
             self.paramiko_session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
             self.paramiko_session.connect(
                 self.host, username=username, password=password
@@ -82,6 +232,17 @@ class GpasciiClient(ClosingContextManager):
             self.d_print("Authentication failed when connecting" f"to {self.host}")
             sys.exit(1)
 
+        self.open_gpascii(self.paramiko_session)
+
+        return success
+
+    def open_gpascii(self, session, owns_session=True):
+        """run gpascii on a connected ssh session.
+        A session not owned, e.g. shared by a GpasciiPool, is left open on close"""
+
+        self.paramiko_session = session
+        self.owns_session = owns_session
+
         # 8192 is paramiko default bufsize
         self.stdin, self.stdout, self.stderr = self.paramiko_session.exec_command(
             "gpascii -2", bufsize=8192
@@ -98,12 +259,12 @@ class GpasciiClient(ClosingContextManager):
             if time.time() - loop_time > 5:
                 raise TimeoutError(f"waiting for gpascii on ppmac at {self.host}")
         self.d_print(f'received: "{rcv_buffer}"')
+        self.rcv_buffer.clear()
+        self.stale_acks.clear()
 
         self.connected = True
         # TODO: check ppmac firmware version/CID
 
-        return success
-
     def send_list(self, cmd_list):
         """ send a list of commands
         """
@@ -175,29 +336,20 @@ class GpasciiClient(ClosingContextManager):
             timeout_time = time.time() + timeout
 
         # pull out data from the rcv_buffer until the next 0x06
+        self.read_available()
         if wait:
-            ack_pos = -1
-            while ack_pos == -1:
-                self.rcv_buffer += self.nb_read()
-                ack_pos = self.rcv_buffer.find("\006")
+            while not self.rcv_buffer.n_acks:
+                wait_time = 0.01
                 if timeout != 0:
-                    if time.time() > timeout_time:
+                    wait_time = min(wait_time, timeout_time - time.time())
+                    if wait_time < 0:
                         return []
-                if ack_pos == -1:
-                    time.sleep(0.0001)
-        else:
-            self.rcv_buffer += self.nb_read()
-            ack_pos = self.rcv_buffer.find("\006")
-            if ack_pos == -1:
-                return []
-
-        response = self.rcv_buffer[0:ack_pos]
-        ack_pos = ack_pos + 1  # increment past "\x06"
-
-        if ack_pos >= len(self.rcv_buffer):
-            ack_pos = len(self.rcv_buffer)
+                self.wait_readable(wait_time)
+                self.read_available()
+        elif not self.rcv_buffer.n_acks:
+            return []
 
-        self.rcv_buffer = self.rcv_buffer[ack_pos + 1 :]
+        response = self.rcv_buffer.take(1)
 
         response = response.replace("\r", "")
         response = response.replace("\n", "")
@@ -276,52 +428,68 @@ class GpasciiClient(ClosingContextManager):
         if not cmd_validated:
             return []
 
-        cmd_count = cmds.count("\n") + cmds.count("\r") + 1
-
-        self.send(cmds)
-
-        # if an n_responses of 'all' is supplied, then calcultate what it means
-        if not response_count:
-            # caller indicated ALL responses
-            n_responses = cmd_count
-        else:
-            # caller indicated not to wait for responses.
-            n_responses = max(response_count, cmd_count)
-
-        # make sure it all gets sent before waiting for replies
-        self.stdin.flush()
-
-        st_time = time.time()
-
         if timeout == 0:
             timeout = 30000
 
-        timeout_time = time.time() + timeout
+        if self.pipelined:
+            future = self.submit(cmds, response_count=response_count)
+            try:
+                return future.result(timeout=timeout)
+            except FutureTimeout:
+                # the batch stays in the queue, so the replies stay in sync
+                self.count_timeout()
+                return [], False, "timeout"
+            except ConnectionError as exc:
+                return [], False, str(exc)
 
-        # pull out data from the rcv_buffer as many responses there are 0x06
+        if not self.connected:
+            return [], False, f"disconnected: {self.lost_reason}"
 
-        ack_n = 0
-        while ack_n < n_responses:
-            self.rcv_buffer += self.nb_read()
-            ack_pos = self.rcv_buffer.rfind("\006")
-            ack_n = self.rcv_buffer.count("\006")
-            if timeout != 0:
-                if time.time() > timeout_time:
-                    return [], False, "timeout"
-            if ack_n < 1:
-                time.sleep(0.0001)
+        timeout_time = time.time() + timeout
+        while True:
+            result = self.exchange(cmds, ack_count(cmds, response_count), timeout_time)
+            if self.connected or not is_read(cmds):
+                return result
+            # the link dropped with a read in flight, ask again once reconnected
+            if not self.wait_connected(timeout_time - time.time()):
+                return result
 
-        ack_pos = self.rcv_buffer.rfind("\006")
+    def exchange(self, cmds, n_responses, timeout_time):
+        """ one serial exchange of send_receive_raw """
 
-        response = self.rcv_buffer[0:ack_pos]
+        try:
+            self.send(cmds)
+            # make sure it all gets sent before waiting for replies
+            self.stdin.flush()
+        except (OSError, EOFError, paramiko.SSHException) as exc:
+            self.mark_lost(f"send failed: {exc}")
+            return [], False, f"connection lost: {self.lost_reason}"
 
-        ack_pos = ack_pos + 1  # increment past "\x06"
+        st_time = time.time()
 
-        if ack_pos > len(self.rcv_buffer):
-            ack_pos = len(self.rcv_buffer)
+        # pull out data from the rcv_buffer as many responses there are 0x06
+        # the replies of the exchanges timed out before come first
+        n_stale = sum(self.stale_acks)
+
+        self.read_available()
+        while self.rcv_buffer.n_acks < n_stale + n_responses:
+            if not self.connected:
+                return [], False, f"connection lost: {self.lost_reason}"
+            wait_time = timeout_time - time.time()
+            if wait_time < 0:
+                self.stale_acks.append(n_responses)
+                self.queue_in.pop()
+                self.count_timeout()
+                return [], False, "timeout"
+            self.wait_readable(min(wait_time, 0.01))
+            self.read_available()
+
+        self.n_timeouts = 0
+        while self.stale_acks:
+            self.rcv_buffer.take(self.stale_acks.popleft())
 
         # \x06 is trailed by a \n is this a gpascii artifact?
-        self.rcv_buffer = self.rcv_buffer[ack_pos + 1 :]
+        response = self.rcv_buffer.take(n_responses)
 
         cmd_val = self.queue_in.popleft()[:]
         # cmd_response = [self.queue_in[0], response]
@@ -338,6 +506,231 @@ class GpasciiClient(ClosingContextManager):
         # DONE: YES need success/fail return added
         return cmd_response, wasSuccessful, error_msg  # [cmd, response] pair
 
+    def submit(self, cmds, response_count=None):
+        """ pipelined send: queues cmds behind the batches already in flight and
+        returns a Future of the (cmd_response, success, error_msg) that
+        send_receive_raw would return. Can be called from any thread.
+        """
+
+        if not self.pipelined:
+            raise RuntimeError("submit needs start_pipeline() first")
+
+        future = Future()
+        cmd_validated, cmds = self.validate_cmd(cmds)
+        if not cmd_validated:
+            future.set_result([])
+            return future
+
+        batch = PendingBatch(cmds, ack_count(cmds, response_count))
+        with self.send_lock:
+            if not self.connected:
+                batch.future.set_exception(
+                    ConnectionError(f"disconnected: {self.lost_reason}")
+                )
+                return batch.future
+            self.write_batch(batch)
+
+        return batch.future
+
+    def write_batch(self, batch):
+        # queued before it is written, so the reader always finds it
+        self.pending.append(batch)
+        self.d_print(f"sending: {batch.cmds}")
+        try:
+            self.stdin.write(batch.cmds + "\r\n")
+            self.stdin.flush()
+        except (OSError, EOFError, paramiko.SSHException) as exc:
+            self.mark_lost(f"send failed: {exc}")
+        self.snum_received += 1
+
+    def start_pipeline(self):
+        """ hands the receiving over to a reader thread, which matches the acks
+        to the batches sent with submit, in order. send_receive_raw then submits
+        and waits, so callers on many threads share the channel back to back.
+        """
+
+        if self.pipelined:
+            return
+        if self.queue_in:
+            raise RuntimeError("replies pending, can't start pipelined mode")
+
+        self.pipelined = True
+        self.start_reader()
+
+    def stop_pipeline(self):
+        """ stops the reader, the batches still in flight fail with ConnectionError """
+
+        if not self.pipelined:
+            return
+        self.stop_reader()
+        self.pipelined = False
+        self.fail_pending(ConnectionError("gpascii pipeline stopped"))
+        self.replay, replay = [], self.replay
+        for batch in replay:
+            batch.future.set_exception(ConnectionError("gpascii pipeline stopped"))
+
+    def start_reader(self):
+        self.reader_stop.clear()
+        self.reader_thread = threading.Thread(
+            target=self.reader_loop, name=f"gpascii reader {self.host}", daemon=True
+        )
+        self.reader_thread.start()
+
+    def stop_reader(self):
+        self.reader_stop.set()
+        if self.reader_thread is not None:
+            if self.reader_thread is not threading.current_thread():
+                self.reader_thread.join()
+            self.reader_thread = None
+
+    def fail_pending(self, exc):
+        while self.pending:
+            batch = self.pending.popleft()
+            if not batch.future.done():
+                batch.future.set_exception(exc)
+
+    def count_timeout(self):
+        """ an exchange timed out, the link is taken for lost after
+        lost_after_timeouts of them in a row """
+
+        with self.send_lock:
+            self.n_timeouts += 1
+            n_timeouts = self.n_timeouts
+        if n_timeouts >= self.lost_after_timeouts:
+            self.mark_lost(f"{n_timeouts} timeouts in a row")
+
+    def mark_lost(self, reason):
+        """ takes the link for lost, e.g. on the channel closing or gpascii
+        exiting to the shell prompt. Reads in flight are kept to be sent again,
+        other exchanges in flight fail. Reconnects in the background with
+        backoff, the exchanges meanwhile fail at once as disconnected.
+        """
+
+        with self.send_lock, self.link_changed:
+            if not self.connected:
+                return
+            self.connected = False
+            self.lost_reason = reason
+            self.d_print(f"gpascii on {self.host} lost: {reason}")
+            self.reader_stop.set()
+
+            while self.pending:
+                batch = self.pending.popleft()
+                if is_read(batch.cmds):
+                    self.replay.append(batch)
+                else:
+                    batch.future.set_exception(
+                        ConnectionError(f"connection lost: {reason}")
+                    )
+
+            self.link_changed.notify_all()
+            if self.auto_reconnect and not self.closing.is_set():
+                if self.reconnect_thread is None or not self.reconnect_thread.is_alive():
+                    self.reconnect_thread = threading.Thread(
+                        target=self.reconnect_loop,
+                        name=f"gpascii reconnect {self.host}",
+                        daemon=True,
+                    )
+                    self.reconnect_thread.start()
+
+    def reconnect_loop(self):
+        while not self.closing.wait(self.backoff.next()):
+            try:
+                self.reopen()
+                return
+            except SystemExit:
+                # connect gives up on authentication
+                self.lost_reason = "authentication failed"
+                return
+            except Exception as exc:
+                self.lost_reason = f"reconnecting: {exc}"
+                self.d_print(f"gpascii on {self.host} {self.lost_reason}")
+
+    def reopen(self):
+        """ runs gpascii again, on a new ssh session if the session is owned,
+        and sends the reads which were in flight """
+
+        self.stop_reader()
+        self.discard_streams()
+        self.rcv_buffer.clear()
+        self.stale_acks.clear()
+        self.queue_in.clear()
+
+        if self.owns_session:
+            self.connect(*self.credentials)
+        else:
+            self.open_gpascii(self.session_source(), owns_session=False)
+
+        with self.send_lock:
+            if self.pipelined:
+                self.start_reader()
+                self.replay, replay = [], self.replay
+                for batch in replay:
+                    batch.sent_time = time.time()
+                    self.write_batch(batch)
+
+        self.n_reconnects += 1
+        self.n_timeouts = 0
+        self.backoff.reset()
+        with self.link_changed:
+            self.link_changed.notify_all()
+
+    def wait_connected(self, timeout):
+        """ True once reconnected, False on timeout or close """
+        with self.link_changed:
+            self.link_changed.wait_for(
+                lambda: self.connected or self.closing.is_set(), max(timeout, 0)
+            )
+            return self.connected
+
+    def discard_streams(self):
+        for stream in [self.stdin, self.stdout, self.stderr]:
+            try:
+                if stream is not None:
+                    stream.close()
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+        if self.owns_session and self.paramiko_session is not None:
+            try:
+                self.paramiko_session.close()
+            except (OSError, EOFError, paramiko.SSHException):
+                pass
+
+    def reader_loop(self):
+        """ receives for the pipelined mode, completes the batches as their last
+        ack comes in """
+
+        channel = self.stdout.channel
+
+        while not self.reader_stop.is_set():
+            rl, _, _ = select.select([channel], [], [], self.reader_period)
+            if not rl:
+                continue
+            data = self.recv(channel)
+            if not data:
+                return
+            self.rcv_buffer.extend(data)
+
+            while self.stale_acks and self.rcv_buffer.n_acks >= self.stale_acks[0]:
+                self.rcv_buffer.take(self.stale_acks.popleft())
+
+            while self.pending and self.rcv_buffer.n_acks >= self.pending[0].n_acks:
+                batch = self.pending.popleft()
+                response = self.rcv_buffer.take(batch.n_acks)
+                self.n_timeouts = 0
+
+                error_returned, error_msg = self.stderr_error()
+                self.time_sum += (time.time() - batch.sent_time) * 1000
+                self.num_received += 1
+                self.ave_time_per_cmd = self.time_sum / self.num_received
+                batch.future.set_result(
+                    (
+                        [batch.cmds, response.replace("\006\n", "")],
+                        not error_returned,
+                        error_msg,
+                    )
+                )
+
     def clear_stats(self):
         """ clear the received statistics"""
         self.time_sum = 0
@@ -379,6 +772,37 @@ class GpasciiClient(ClosingContextManager):
 
         return buffer
 
+    def read_available(self):
+        """non-blocking read of all there is in stdout into rcv_buffer,
+        returns the number of bytes read"""
+        channel = self.stdout.channel
+        n_read = 0
+        # readable at the end of the stream too, which recv_ready doesn't tell
+        while self.connected and select.select([channel], [], [], 0.0)[0]:
+            data = self.recv(channel)
+            if not data:
+                break
+            self.rcv_buffer.extend(data)
+            n_read += len(data)
+        return n_read
+
+    def recv(self, channel):
+        """ a read of the channel, empty if the link is found lost """
+        try:
+            data = channel.recv(self.recv_size)
+        except (OSError, EOFError, paramiko.SSHException) as exc:
+            self.mark_lost(f"receive failed: {exc}")
+            return b""
+        if not data:
+            self.mark_lost("channel closed")
+        elif self.ssh_prompt in data:
+            self.mark_lost("gpascii exited to the shell prompt")
+        return data
+
+    def wait_readable(self, timeout):
+        """waits up to timeout for stdout to have data"""
+        select.select([self.stdout.channel], [], [], max(timeout, 0))
+
     def nb_read_stderr(self):
         """ non-blocking read of stderr"""
         buffer = ""
@@ -449,12 +873,18 @@ class GpasciiClient(ClosingContextManager):
         # I checked and these close methods seem not to leave any
         # open connections to the brick or processes running on the brick
 
+        self.closing.set()
+        with self.link_changed:
+            self.link_changed.notify_all()
+        self.stop_pipeline()
+
         self.stdout.close()
         self.stdin.close()
         self.stderr.close()
 
         # if self.gpascii_paramiko_session is not None:
-        self.paramiko_session.close()
+        if self.owns_session:
+            self.paramiko_session.close()
         #   self.gpascii_paramiko_session = None
         self.d_print("force disconnected gpascii.")
         # else:
@@ -0,0 +1,212 @@
+""" pool of gpascii channels to a ppmac
+all on one ssh connection, shared by the devices talking to the same brick"""
+
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import paramiko  # ssh library
+from ppmac.gpascii import GpasciiClient
+from ppmac.util import ClosingContextManager, new_ssh_client
+
+
+class GpasciiPool(ClosingContextManager):
+    """ n_channels gpascii sessions run over one paramiko transport.
+
+    Each exchange takes an idle channel for itself, so exchanges of independent
+    devices run in parallel. Channels are handed out to the callers in the order
+    they asked for one, and are reused round robin, connected ones first. A
+    channel idle for longer than health_period is checked with health_cmd before
+    it is handed out, and taken for lost if it doesn't answer. Lost channels
+    reconnect in the background, on a new ssh session if the shared one is gone.
+
+    usage:
+        pool = gpascii_pool("10.23.92.220", n_channels=4)
+        pool.connect()
+        cmd_response, success, error_msg = pool.send_receive_raw("#1p")
+        pool.close()
+    """
+
+    def __init__(
+        self,
+        host,
+        n_channels=2,
+        debug=False,
+        health_cmd="Sys.Time",
+        health_period=10.0,
+        health_timeout=2.0,
+        session_factory=None,
+    ):
+        self.host = host.strip(" ")
+        self.n_channels = n_channels
+        self.debug = debug
+        self.health_cmd = health_cmd
+        self.health_period = health_period  # [s]
+        self.health_timeout = health_timeout  # [s]
+        # connected ssh session from (host, username, password), paramiko if None
+        self.session_factory = session_factory
+
+        self.session = None
+        self.session_lock = threading.Lock()
+        self.credentials = ("root", "deltatau")
+        self.channels = []
+        self.idle = deque([])
+        self.last_used = {}
+        self.waiters = deque([])
+        self.cond = threading.Condition()
+        self.n_users = 0
+        self.n_failed_checks = 0
+
+    @property
+    def connected(self):
+        return any(channel.connected for channel in self.channels)
+
+    def connect(self, username="root", password="deltatau"):
+        """ssh to the ppmac once and open the gpascii channels on it.
+        Does nothing if the pool is already open."""
+
+        with self.cond:
+            if self.channels:
+                return True
+
+            self.credentials = (username, password)
+            self.session = self.open_session()
+
+            self.channels = []
+            for _ in range(self.n_channels):
+                channel = GpasciiClient(self.host, debug=self.debug)
+                channel.credentials = self.credentials
+                channel.session_source = self.live_session
+                channel.open_gpascii(self.session, owns_session=False)
+                self.channels.append(channel)
+                self.last_used[id(channel)] = time.time()
+
+            self.idle = deque(self.channels)
+            self.cond.notify_all()
+            return True
+
+    def open_session(self):
+        username, password = self.credentials
+        if self.session_factory is not None:
+            return self.session_factory(self.host, username, password)
+        session = new_ssh_client(self.host)
+        session.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        session.connect(self.host, username=username, password=password)
+        return session
+
+    def live_session(self):
+        """ the shared ssh session, connected again if its transport is gone.
+        Called by the channels reconnecting. """
+
+        with self.session_lock:
+            get_transport = getattr(self.session, "get_transport", None)
+            if get_transport is not None:
+                transport = get_transport()
+                if transport is None or not transport.is_active():
+                    self.d_print(f"ssh session to {self.host} lost, connecting again")
+                    self.session.close()
+                    self.session = self.open_session()
+            return self.session
+
+    def acquire(self, timeout=None):
+        """ the next idle channel, waiting behind the earlier callers for it.
+        Raises TimeoutError if none is free within timeout. """
+
+        ticket = object()
+        with self.cond:
+            self.waiters.append(ticket)
+            try:
+                if not self.cond.wait_for(
+                    lambda: self.waiters[0] is ticket and self.idle, timeout
+                ):
+                    raise TimeoutError(f"no free gpascii channel to {self.host}")
+                channel = next(
+                    (channel for channel in self.idle if channel.connected),
+                    self.idle[0],
+                )
+                self.idle.remove(channel)
+            finally:
+                self.waiters.remove(ticket)
+                # the next in line may find a channel too
+                self.cond.notify_all()
+
+        if channel.connected:
+            if time.time() - self.last_used[id(channel)] > self.health_period:
+                self.check(channel)
+        return channel
+
+    def release(self, channel):
+        with self.cond:
+            self.last_used[id(channel)] = time.time()
+            self.idle.append(channel)
+            self.cond.notify_all()
+
+    @contextmanager
+    def channel(self, timeout=None):
+        channel = self.acquire(timeout=timeout)
+        try:
+            yield channel
+        finally:
+            self.release(channel)
+
+    def check(self, channel):
+        """ takes the channel for lost if it doesn't answer health_cmd,
+        it then reconnects in the background """
+
+        reply = channel.send_receive_raw(self.health_cmd, timeout=self.health_timeout)
+        healthy = len(reply) == 3 and reply[1]
+        if not healthy:
+            self.n_failed_checks += 1
+            channel.mark_lost(f"no reply to {self.health_cmd}")
+        return healthy
+
+    def send_receive_raw(self, cmds=None, response_count=None, timeout=5):
+        """ GpasciiClient.send_receive_raw on the next free channel,
+        waiting up to timeout for one """
+
+        try:
+            with self.channel(timeout=timeout or None) as channel:
+                return channel.send_receive_raw(
+                    cmds=cmds, response_count=response_count, timeout=timeout
+                )
+        except TimeoutError:
+            return [], False, "timeout"
+
+    def close(self):
+        """ closes the channels and the ssh session when the last user closes """
+
+        with self.cond:
+            self.n_users = max(self.n_users - 1, 0)
+            if self.n_users or not self.channels:
+                return
+            for channel in self.channels:
+                channel.close()
+            self.channels = []
+            self.idle.clear()
+            with self.session_lock:
+                self.session.close()
+                self.session = None
+
+    def d_print(self, msg):
+        """ use to print a debug message"""
+        if self.debug:
+            print(msg)
+
+
+# one pool per ppmac host, see gpascii_pool
+pools = {}
+pools_lock = threading.Lock()
+
+
+def gpascii_pool(host, n_channels=2, **kwargs):
+    """ the GpasciiPool of host, made on first use. Each call counts a user,
+    the pool closes when all of them have called close(). n_channels and kwargs
+    only apply to a new pool. """
+
+    host = host.strip(" ")
+    with pools_lock:
+        pool = pools.get(host)
+        if pool is None:
+            pool = pools[host] = GpasciiPool(host, n_channels=n_channels, **kwargs)
+        pool.n_users += 1
+        return pool
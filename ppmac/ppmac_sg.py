@@ -20,6 +20,7 @@ import sys, time
 import queue, threading
 import asyncio  # for commands to interface to caproto
 import regex as re
+from ppmac.util import Backoff, new_ssh_client
 
 
 # multi-threaded version of ppmac_tool
@@ -55,6 +56,7 @@ class PpmacToolMt:
         None  #  queue for receiving from ppmac (thread started in CONN_STS)
     )
     thread = None
+    credentials = ("root", "deltatau")
 
     # status_cmd_list = [] # this is used in the thread, and is not thread safe, don't write to it during run time
 
@@ -70,10 +72,13 @@ class PpmacToolMt:
 
     def __init__(self, host=None):
         self.host = host
+        # delays of the reconnect attempts of the helper thread
+        self.backoff = Backoff(initial=1.0)
 
     def connect(self, username="root", password="deltatau", prompt="ppmac# "):
         "ssh to PowerBrick and run gpascii"
         success = 0
+        self.credentials = (username, password)
 
         if self.host is not None:
             i = 1
@@ -82,13 +87,7 @@ class PpmacToolMt:
 
                 print("connecting to ppmac at {:}.".format(self.host))
                 try:
-                    self.ppmac_ssh_paramiko = paramiko.SSHClient()
-                    self.ppmac_ssh_paramiko.set_missing_host_key_policy(
-                        paramiko.AutoAddPolicy()
-                    )
-                    self.ppmac_ssh_paramiko.connect(
-                        self.host, username=username, password=password
-                    )  # , timeout=self.TIMEOUT)
+                    self.open_ssh(username, password)
                     # print("Success, connected.")
                     success = 1
                     break
@@ -112,51 +111,66 @@ class PpmacToolMt:
                     print("Could not connect to {:}. Giving up".format(self.host))
                     sys.exit(1)
 
-            # Create a raw shell
-            self.ppmac_ssh = self.ppmac_ssh_paramiko.invoke_shell()
+            success = self.start_gpascii()
 
-            # wait for the "ppmac#"?
-            buffer = ""
-            for i in range(10):
-                if self.ppmac_ssh.recv_ready():
-                    buffer += self.ppmac_ssh.recv(4096).decode()
-                # print(buffer)
-                if self.ssh_prompt in buffer:
-                    success = 1
-                    # print("now at linux shell.")
-                    break
-                time.sleep(1)
+        # startup a new thread and make in/out queues
+        self.queue_to_ppmac = queue.Queue()  # async_lib.ThreadsafeQueue()
+        self.queue_from_ppmac = queue.Queue()  # async_lib.ThreadsafeQueue()
+        self.thread = threading.Thread(target=self.ppmac_helper_thread, daemon=True)
+        self.thread.start()
 
-            if success != 1:
-                print("linux shell failed to start.")
+        return success
 
-            success = 0
+    def open_ssh(self, username, password):
+        self.ppmac_ssh_paramiko = new_ssh_client(self.host)
+        self.ppmac_ssh_paramiko.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        self.ppmac_ssh_paramiko.connect(
+            self.host, username=username, password=password
+        )  # , timeout=self.TIMEOUT)
 
-            self.ppmac_ssh.send("gpascii -2\n")
+    def start_gpascii(self):
+        """ runs gpascii in a shell of the ssh connection, returns 1 on success """
+        success = 0
 
-            # print("sent gpascii.")
+        # Create a raw shell
+        self.ppmac_ssh = self.ppmac_ssh_paramiko.invoke_shell()
 
-            # wait for the "INPUT" end of line
-            buffer = ""
-            for i in range(10):
-                if self.ppmac_ssh.recv_ready():
-                    buffer += self.ppmac_ssh.recv(4096).decode()
-                # print(buffer)
-                if self.gpascii_inp in buffer:
-                    success = 1
-                    self.connected = True
-                    # print("gpascii started ok.")
-                    break
-                time.sleep(1)
+        # wait for the "ppmac#"?
+        buffer = ""
+        for i in range(10):
+            if self.ppmac_ssh.recv_ready():
+                buffer += self.ppmac_ssh.recv(4096).decode()
+            # print(buffer)
+            if self.ssh_prompt in buffer:
+                success = 1
+                # print("now at linux shell.")
+                break
+            time.sleep(1)
 
-            if success != 1:
-                print("gpascii failed to start.")
+        if success != 1:
+            print("linux shell failed to start.")
 
-        # startup a new thread and make in/out queues
-        self.queue_to_ppmac = queue.Queue()  # async_lib.ThreadsafeQueue()
-        self.queue_from_ppmac = queue.Queue()  # async_lib.ThreadsafeQueue()
-        self.thread = threading.Thread(target=self.ppmac_helper_thread, daemon=True)
-        self.thread.start()
+        success = 0
+
+        self.ppmac_ssh.send("gpascii -2\n")
+
+        # print("sent gpascii.")
+
+        # wait for the "INPUT" end of line
+        buffer = ""
+        for i in range(10):
+            if self.ppmac_ssh.recv_ready():
+                buffer += self.ppmac_ssh.recv(4096).decode()
+            # print(buffer)
+            if self.gpascii_inp in buffer:
+                success = 1
+                self.connected = True
+                # print("gpascii started ok.")
+                break
+            time.sleep(1)
+
+        if success != 1:
+            print("gpascii failed to start.")
 
         return success
 
@@ -264,11 +278,19 @@ class PpmacToolMt:
                     self.queue_to_ppmac.task_done()  # remove from queue
 
             else:
+                # the brick rebooted or gpascii exited, connect again with backoff.
+                # status_cmd_list is kept, so the status reads carry on
                 print("disconnected")
-                time.sleep(1)
-                # threading.Thread.sleep(100) # sleep for 100ms
-                # self.thread.sleep(100) # sleep for 100ms
-                # TODO: reconnect?
+                time.sleep(self.backoff.next())
+                try:
+                    if self.ppmac_ssh_paramiko is not None:
+                        self.ppmac_ssh_paramiko.close()
+                    self.open_ssh(*self.credentials)
+                    if self.start_gpascii() == 1:
+                        print(f"reconnected to ppmac at {self.host}.")
+                        self.backoff.reset()
+                except Exception as e:
+                    print(f"reconnecting to ppmac at {self.host} failed: {e}")
 
     # TODO: combine/rationalise the get_status_list, send_online, and send_receive functions
     #  together as they do similar things
@@ -1,6 +1,18 @@
 """ utility classes/methods for ppmac
 """
+import random
 from contextlib import ContextDecorator
+import paramiko  # ssh library
+
+# ssh client factories of the hosts not reached through paramiko,
+# e.g. a PpmacEmulator attached to a host name, see new_ssh_client
+ssh_clients = {}
+
+
+def new_ssh_client(host):
+    """ an unconnected paramiko.SSHClient, or what is registered for host """
+    factory = ssh_clients.get(host)
+    return paramiko.SSHClient() if factory is None else factory()
 
 
 class ClosingContextManager(ContextDecorator):
@@ -13,3 +25,31 @@ class ClosingContextManager(ContextDecorator):
         # type, value, traceback):
         self.close()
         return False
+
+
+class Backoff:
+    """exponential backoff of the reconnect attempts,
+    with some jitter so channels dropped together don't retry in step
+    """
+
+    def __init__(self, initial=0.5, maximum=30.0, factor=2.0, jitter=0.1):
+        self.initial = initial  # [s]
+        self.maximum = maximum  # [s]
+        self.factor = factor
+        self.jitter = jitter  # fraction of the delay
+        self.attempts = 0
+        self.delay = None  # [s] before the jitter
+
+    def next(self):
+        """ the delay before the next attempt """
+        # grown from the last delay, so it stays at maximum however long it retries
+        if self.delay is None:
+            self.delay = min(self.initial, self.maximum)
+        else:
+            self.delay = min(self.delay * self.factor, self.maximum)
+        self.attempts += 1
+        return self.delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+    def reset(self):
+        self.attempts = 0
+        self.delay = None
@@ -0,0 +1,32 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# the compiler and process logs are opened on the import of reactive_agent
+os.environ.setdefault("WRASC_OUTPUT_DIR", tempfile.mkdtemp(prefix="ra_out_"))
+
+from wrasc import reactive_agent as ra  # noqa: E402
+
+
+def compile_agents(script_globals, **kwargs):
+    """ compile_n_install of the agents in script_globals, kwargs are passed on """
+    # compile_n_install redirects stdout to its dump file
+    stdout = sys.stdout
+    try:
+        return ra.compile_n_install({}, script_globals, **kwargs)
+    finally:
+        sys.stdout = stdout
+
+
+@pytest.fixture(autouse=True)
+def output_dir(tmp_path, monkeypatch):
+    """ compile_n_install, the status page and the dependency caches of each test
+    write to its tmp_path instead of ra_out
+    """
+    for name in ["output_dir", "excel_out_path", "html_out_path"]:
+        monkeypatch.setattr(ra, name, str(tmp_path))
+    monkeypatch.setattr(
+        ra, "dmodel_log_filename", str(tmp_path / "dmodel_compiler.log")
+    )
@@ -0,0 +1,400 @@
+import socket
+import threading
+import time
+
+import pytest
+
+from ppmac.gpascii import GpasciiClient, ReceiveBuffer, is_read
+from ppmac.pool import GpasciiPool
+from ppmac.util import Backoff
+
+
+class StandInChannel:
+    """ the parts of a paramiko channel GpasciiClient uses, on a local socket """
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def recv(self, nbytes):
+        return self.sock.recv(nbytes)
+
+    def recv_ready(self):
+        return True
+
+    def recv_stderr_ready(self):
+        return False
+
+
+class StandInFile:
+    def __init__(self, channel, sock=None):
+        self.channel = channel
+        self.file = sock.makefile("w", encoding="utf-8") if sock else None
+
+    def write(self, text):
+        self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+    def close(self):
+        if self.file:
+            self.file.close()
+
+
+class StandInGpascii:
+    """ answers each line with "<line>=<n>" and an ack, latency after receiving it.
+    Lines are answered in order but not one at a time, like a remote gpascii.
+    """
+
+    def __init__(self, latency=0.002, banner=False):
+        self.latency = latency
+        self.banner = banner
+        self.client_sock, self.sock = socket.socketpair()
+        self.n_lines = 0
+        # cleared, the replies are held back as by a hung brick
+        self.answering = threading.Event()
+        self.answering.set()
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+
+    def serve(self):
+        if self.banner:
+            self.sock.sendall(b"STDIN Open for ASCII Input\n")
+        buffer = b""
+        while True:
+            try:
+                data = self.sock.recv(65536)
+            except OSError:
+                return
+            if not data:
+                return
+            received = time.perf_counter()
+            buffer += data
+            *lines, buffer = buffer.split(b"\n")
+            replies = []
+            for line in lines:
+                line = line.strip(b"\r")
+                if line == b"exit":
+                    replies.append(b"\nppmac# ")
+                    continue
+                self.n_lines += 1
+                replies.append(line + b"=%d\r\n\x06\n" % self.n_lines)
+            delay = received + self.latency - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self.answering.wait()
+            try:
+                self.sock.sendall(b"".join(replies))
+            except OSError:
+                return
+
+    def files(self):
+        """ stdin, stdout, stderr as exec_command returns them """
+        channel = StandInChannel(self.client_sock)
+        return (
+            StandInFile(channel, self.client_sock),
+            StandInFile(channel),
+            StandInFile(channel),
+        )
+
+    def client(self):
+        gpascii = GpasciiClient("standin")
+        gpascii.stdin, gpascii.stdout, gpascii.stderr = self.files()
+        gpascii.connected = True
+        return gpascii
+
+    def drop(self):
+        """ the link goes down, the client reads the end of the stream """
+        self.sock.shutdown(socket.SHUT_RDWR)
+        self.sock.close()
+
+    def close(self):
+        self.answering.set()
+        self.client_sock.close()
+        self.sock.close()
+
+
+class StandInSession:
+    """ an ssh session running a stand-in gpascii for each exec_command """
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.stand_ins = []
+        self.closed = False
+
+    def exec_command(self, command, bufsize=-1):
+        assert command == "gpascii -2"
+        stand_in = StandInGpascii(latency=self.latency, banner=True)
+        self.stand_ins.append(stand_in)
+        return stand_in.files()
+
+    def close(self):
+        self.closed = True
+        for stand_in in self.stand_ins:
+            stand_in.close()
+
+
+def commands_per_s(gpascii, n_threads, n_batches, lines_per_batch):
+    mismatched = []
+
+    def worker(k):
+        for j in range(n_batches):
+            cmds = "\n".join(f"p{k}_{j}_{i}" for i in range(lines_per_batch))
+            cmd_response, success, _ = gpascii.send_receive_raw(cmds)
+            # every reply belongs to the batch it was sent with
+            if not success or cmd_response[1].split("=")[0] != f"p{k}_{j}_0":
+                mismatched.append(cmds)
+
+    threads = [threading.Thread(target=worker, args=(k,)) for k in range(n_threads)]
+    time_0 = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not mismatched
+    return n_threads * n_batches * lines_per_batch / (time.perf_counter() - time_0)
+
+
+def test_pipelined_submit():
+    stand_in = StandInGpascii(latency=0.0)
+    gpascii = stand_in.client()
+    gpascii.start_pipeline()
+
+    futures = [gpascii.submit(f"p{k}\np{k + 100}") for k in range(50)]
+    for k, future in enumerate(futures):
+        cmd_response, success, error_msg = future.result(timeout=5)
+        assert success and error_msg == ""
+        assert cmd_response == [
+            f"p{k}\np{k + 100}",
+            f"p{k}={2 * k + 1}\r\np{k + 100}={2 * k + 2}\r\n",
+        ]
+
+    assert gpascii.len_queue() == 0 and not gpascii.pending
+    assert gpascii.num_received == 50
+
+    gpascii.stop_pipeline()
+    assert not gpascii.pipelined
+    stand_in.close()
+
+
+def test_pipelined_throughput():
+    # a serial exchange waits a round trip each, the pipelined ones overlap
+    stand_in = StandInGpascii(latency=0.002)
+    gpascii = stand_in.client()
+    serial = commands_per_s(gpascii, n_threads=1, n_batches=50, lines_per_batch=4)
+
+    gpascii.start_pipeline()
+    pipelined = commands_per_s(gpascii, n_threads=8, n_batches=50, lines_per_batch=4)
+    gpascii.stop_pipeline()
+    stand_in.close()
+
+    print(f"serial {serial:.0f} commands/s, pipelined {pipelined:.0f} commands/s")
+    assert pipelined > 2 * serial
+
+
+def test_receive_buffer():
+    replies = b"p1=1\r\n\x06\np2=2\r\np3=3\r\n\x06\n\x06\np4=4\r\n\x06\n"
+    expected = ["p1=1\r\n", "p2=2\r\np3=3\r\n", "", "p4=4\r\n"]
+
+    # however the replies are split into reads
+    for size in [1, 2, 3, 7, len(replies)]:
+        rcv_buffer = ReceiveBuffer()
+        taken = []
+        for k in range(0, len(replies), size):
+            rcv_buffer.extend(replies[k : k + size])
+            while rcv_buffer.n_acks:
+                taken.append(rcv_buffer.take())
+        assert taken == expected
+        assert len(rcv_buffer) == 0
+
+    rcv_buffer = ReceiveBuffer()
+    rcv_buffer.extend(replies)
+    # the acks in between stay in the text
+    assert rcv_buffer.take(3) == "p1=1\r\n\x06\np2=2\r\np3=3\r\n\x06\n"
+    with pytest.raises(ValueError):
+        rcv_buffer.take(2)
+
+
+def test_bulk_download():
+    rates = {}
+    for n_lines in [1000, 10000]:
+        stand_in = StandInGpascii(latency=0.0)
+        gpascii = stand_in.client()
+        cmds = "\n".join(f"p{k}" for k in range(n_lines))
+        time_0 = time.perf_counter()
+        cmd_response, success, _ = gpascii.send_receive_raw(cmds)
+        elapsed = time.perf_counter() - time_0
+        rates[n_lines] = n_lines / elapsed
+        print(f"{n_lines} lines in {elapsed:.3f}s, {rates[n_lines]:.0f} commands/s")
+
+        assert success
+        lines = cmd_response[1].replace("\r", "").split("\n")
+        assert lines[:-1] == [f"p{k}={k + 1}" for k in range(n_lines)]
+        assert len(gpascii.rcv_buffer) == 0 and gpascii.len_queue() == 0
+        stand_in.close()
+
+    # linear in the size of the download, a quadratic receive would be 10 times
+    # slower per line on the larger one
+    assert rates[10000] > rates[1000] / 3
+
+
+def test_timeout_keeps_sync():
+    stand_in = StandInGpascii(latency=0.2)
+    gpascii = stand_in.client()
+
+    assert gpascii.send_receive_raw("p1", timeout=0.05) == ([], False, "timeout")
+    # the late reply of p1 is dropped, not taken for p2
+    cmd_response, success, _ = gpascii.send_receive_raw("p2", timeout=5)
+    assert success and cmd_response == ["p2", "p2=2\r\n"]
+    stand_in.close()
+
+
+def test_pool():
+    sessions = []
+
+    def session_factory(host, username, password):
+        sessions.append(StandInSession(latency=0.002))
+        return sessions[-1]
+
+    pool = GpasciiPool("standin", n_channels=4, session_factory=session_factory)
+    pool.connect()
+    pool.connect()
+    # one ssh session for all the channels
+    assert len(sessions) == 1 and len(sessions[0].stand_ins) == 4
+
+    one_channel = commands_per_s(pool, n_threads=1, n_batches=20, lines_per_batch=4)
+    parallel = commands_per_s(pool, n_threads=8, n_batches=20, lines_per_batch=4)
+    print(f"1 channel {one_channel:.0f} commands/s, 4 channels {parallel:.0f}")
+    assert parallel > 2 * one_channel
+    # round robin over the channels
+    assert all(stand_in.n_lines for stand_in in sessions[0].stand_ins)
+
+    # the callers are served in the order they asked
+    order = []
+    held = [pool.acquire() for _ in range(4)]
+
+    def waiter(k):
+        with pool.channel(timeout=5):
+            order.append(k)
+
+    threads = []
+    for k in range(3):
+        threads.append(threading.Thread(target=waiter, args=(k,)))
+        threads[-1].start()
+        while len(pool.waiters) <= k:
+            time.sleep(0.001)
+    with pytest.raises(TimeoutError):
+        pool.acquire(timeout=0.01)
+    for channel in held:
+        pool.release(channel)
+    for thread in threads:
+        thread.join()
+    assert order == [0, 1, 2]
+
+    # a dead channel idle for long is found by its check and reconnects
+    channel = pool.acquire()
+    channel.backoff = Backoff(initial=0.01)
+    sessions[0].stand_ins[pool.channels.index(channel)].close()
+    pool.release(channel)
+    pool.last_used[id(channel)] -= pool.health_period + 1
+    pool.health_timeout = 0.1
+    for _ in range(4):
+        with pool.channel():
+            pass
+    assert channel.wait_connected(5) and channel.n_reconnects == 1
+    assert len(sessions[0].stand_ins) == 5
+    cmd_response, success, _ = pool.send_receive_raw("p1")
+    assert success and cmd_response[0] == "p1"
+
+    pool.close()
+    assert sessions[0].closed and not pool.connected
+
+
+def test_is_read():
+    for cmds in ["#1p", "#2pvf", "p100", "Motor[1].ActPos", "Sys.Time #1p\nP8192"]:
+        assert is_read(cmds)
+    for cmds in ["#1j+", "Motor[1].JogSpeed=5", "p100=1", "enable", "&1b1r", ""]:
+        assert not is_read(cmds)
+
+
+def test_backoff():
+    backoff = Backoff(initial=0.5, maximum=30.0, jitter=0)
+    assert [backoff.next() for _ in range(4)] == [0.5, 1.0, 2.0, 4.0]
+
+    # a brick down overnight keeps retrying at the cap
+    delays = [backoff.next() for _ in range(5000)]
+    assert delays[-1] == 30.0 and backoff.attempts == 5004
+    backoff.reset()
+    assert backoff.next() == 0.5
+
+
+def test_reconnect():
+    session = StandInSession(latency=0.1)
+    gpascii = GpasciiClient("standin")
+    gpascii.backoff = Backoff(initial=0.01)
+    gpascii.session_source = lambda: session
+    gpascii.open_gpascii(session, owns_session=False)
+
+    # the link drops with a read in flight, it is asked again once reconnected
+    threading.Timer(0.03, session.stand_ins[0].drop).start()
+    cmd_response, success, _ = gpascii.send_receive_raw("Motor[1].ActPos")
+    assert success and cmd_response == ["Motor[1].ActPos", "Motor[1].ActPos=1\r\n"]
+    assert gpascii.n_reconnects == 1 and len(session.stand_ins) == 2
+
+    # a command which moves is not sent again
+    threading.Timer(0.03, session.stand_ins[1].drop).start()
+    _, success, error_msg = gpascii.send_receive_raw("#1j+")
+    assert not success and error_msg == "connection lost: channel closed"
+    assert gpascii.wait_connected(5) and session.stand_ins[2].n_lines == 0
+
+    # gpascii exits to the shell
+    _, success, error_msg = gpascii.send_receive_raw("exit")
+    assert error_msg == "connection lost: gpascii exited to the shell prompt"
+    assert gpascii.wait_connected(5) and gpascii.n_reconnects == 3
+
+    # pipelined, the reads in flight are sent again in order
+    gpascii.start_pipeline()
+    futures = [gpascii.submit(cmds) for cmds in ["p1", "#1j+", "p2 p3"]]
+    session.stand_ins[-1].drop()
+    assert futures[0].result(timeout=5)[0] == ["p1", "p1=1\r\n"]
+    with pytest.raises(ConnectionError):
+        futures[1].result(timeout=5)
+    assert futures[2].result(timeout=5)[0] == ["p2 p3", "p2 p3=2\r\n"]
+    assert gpascii.n_reconnects == 4
+
+    gpascii.close()
+    session.close()
+
+
+def test_pipelined_timeouts():
+    session = StandInSession(latency=0.0)
+    gpascii = GpasciiClient("standin")
+    gpascii.backoff = Backoff(initial=0.01)
+    gpascii.session_source = lambda: session
+    gpascii.open_gpascii(session, owns_session=False)
+    gpascii.start_pipeline()
+
+    # a late reply resets the count of timeouts
+    session.stand_ins[0].answering.clear()
+    assert gpascii.send_receive_raw("p1", timeout=0.05) == ([], False, "timeout")
+    assert gpascii.n_timeouts == 1
+    session.stand_ins[0].answering.set()
+    cmd_response, success, _ = gpascii.send_receive_raw("p2")
+    assert success and cmd_response == ["p2", "p2=2\r\n"]
+    assert gpascii.n_timeouts == 0
+
+    # the brick stops answering but the link stays up, it is taken for lost
+    session.stand_ins[0].answering.clear()
+    for k in range(gpascii.lost_after_timeouts):
+        _, _, error_msg = gpascii.send_receive_raw(f"p{k}", timeout=0.05)
+        assert error_msg == "timeout"
+    assert gpascii.wait_connected(5) and gpascii.n_reconnects == 1
+    assert len(session.stand_ins) == 2
+    cmd_response, success, _ = gpascii.send_receive_raw("p9")
+    assert success and cmd_response[0] == "p9" and gpascii.n_timeouts == 0
+
+    gpascii.close()
+    session.close()
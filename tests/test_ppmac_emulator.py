@@ -0,0 +1,190 @@
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+
+from pytest import approx
+
+from ppmac.emulator import PpmacEmulator, PpmacModel, split_commands
+from ppmac.gpascii import GpasciiClient
+from ppmac.util import Backoff
+from wrasc import ppmac_ra as ppra
+
+
+def test_not_imported_with_ppmac():
+    # a stand-in for the tests, not loaded on the hosts driving a real brick
+    check = "import sys, ppmac; assert 'ppmac.emulator' not in sys.modules"
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    subprocess.run([sys.executable, "-c", check], check=True, cwd=root)
+
+
+def test_model():
+    model = PpmacModel(n_motors=4)
+
+    assert model.execute("Motor[1].JogSpeed #1p #2v") == (
+        ["Motor[1].JogSpeed=32", "0", "0"],
+        [],
+    )
+    assert model.execute("p(8190+2) = $10 + 1.5 * 2  P8192") == (["P8192=19"], [])
+    assert model.execute("gate3[0].chan[1].servocapt") == (
+        ["Gate3[0].Chan[1].ServoCapt=0"],
+        [],
+    )
+
+    # the commands up to the error are run
+    replies, errors = model.execute("#1p gooble #2p")
+    assert replies == ["0"]
+    assert errors == ["stdin:4:5: error #20: ILLEGAL CMD: #1p gooble #2p"]
+    for line, error in [
+        ("Motor[1].JogSpee", "ILLEGAL PARAMETER"),
+        ("Motor[99].ActPos", "ILLEGAL PARAMETER"),
+        ("P70000", "OUT OF RANGE NUMBER"),
+        ("#6j+", "MOTOR NOT ACTIVE"),
+    ]:
+        assert error in model.execute(line)[1][0]
+
+    # programs go to the buffer, not run
+    model.execute("open plc 3")
+    model.execute("P1=1")
+    model.execute("close")
+    model.execute("enable plc 3")
+    assert model.execute("P1 Plc[3].Running") == (["P1=0", "Plc[3].Running=1"], [])
+
+    assert split_commands("#1j- #2j=#1p - 10 P1 = 2") == [
+        (1, "#1j-"),
+        (6, "#2j=#1p-10"),
+        (19, "P1=2"),
+    ]
+
+
+def test_jog():
+    model = PpmacModel(n_motors=2)
+    model.limit_switches[2] = (-100, 100)
+
+    # 1 ct/ms, 1000 cts/s
+    model.execute("Motor[1].JogSpeed=1 Motor[2].JogSpeed=1")
+    model.execute("#1j=50 #2j+")
+    now = model.last_advance
+    model.advance(now + 0.02)
+    assert model.motor_query(1, "p") == approx(20)
+    assert model.motor_query(1, "g") == approx(30)
+    assert model.motor(1, "InPos") == 0 and model.motor(1, "ActVel") == 1
+    model.advance(now + 0.2)
+    assert model.motor_query(1, "p") == 50 and model.motor(1, "InPos") == 1
+
+    # stopped on the limit switch
+    assert model.motor_query(2, "p") == 100 and model.motor(2, "PlusLimit") == 1
+    assert 2 not in model.jogs
+
+    model.jogs[2] = -200
+    model.advance(now + 0.25)
+    assert model.motor_query(2, "p") == approx(50)
+    assert model.motor(2, "PlusLimit") == 0
+    model.execute("#2k")
+    assert 2 not in model.jogs and model.motor(2, "ClosedLoop") == 0
+
+    # homed where the motor is
+    model.execute("#1hmz")
+    assert model.motor_query(1, "p") == 0 and model.motor(1, "HomeComplete") == 1
+
+
+def test_gpascii_client():
+    emulator = PpmacEmulator(latency=0.001)
+    emulator.attach("emulated")
+    gpascii = GpasciiClient("emulated")
+    gpascii.backoff = Backoff(initial=0.01)
+    assert gpascii.connect()
+
+    cmd_response, success, _ = gpascii.send_receive_raw("Motor[3].JogSpeed=5\n#3j:500")
+    assert success and cmd_response[1] == ""
+    cmd_response, success, _ = gpascii.send_receive_raw("Motor[3].JogSpeed\n#3g")
+    assert success and cmd_response[1].startswith("Motor[3].JogSpeed=5\n")
+
+    _, success, error_msg = gpascii.send_receive_raw("gooble")
+    assert not success and error_msg == "ILLEGAL CMD"
+
+    # the brick goes away and comes back, the read is asked again
+    emulator.online = False
+    emulator.drop()
+    threading.Timer(0.1, setattr, (emulator, "online", True)).start()
+    cmd_response, success, _ = gpascii.send_receive_raw("Motor[3].JogSpeed")
+    assert success and cmd_response[1] == "Motor[3].JogSpeed=5\n"
+    assert gpascii.n_reconnects == 1
+
+    gpascii.close()
+    emulator.close()
+
+
+def test_ppmac_tool_mt():
+    emulator = PpmacEmulator()
+    emulator.attach("emulated")
+    ppmac = ppra.PPMAC("emulated", backward=True)
+    ppmac.connect()
+    assert ppmac.connected
+
+    cmd_response, success, _ = ppmac.send_receive_raw("P10=7")
+    assert success
+    cmd_response, success, _ = ppmac.send_receive_raw("P10")
+    assert success and cmd_response == ["P10", "P10=7"]
+    cmd_response, success, _ = ppmac.send_receive_raw("gooble")
+    assert not success
+
+    emulator.close()
+
+
+def test_gate():
+    emulator = PpmacEmulator(latency=0.001)
+    emulator.model.limit_switches[1] = (-500, 500)
+    emulator.attach("emulated")
+    ppmac = ppra.PPMAC("emulated", pooled=True)
+    ppmac.connect()
+
+    # runs to the minus limit and homes there
+    gate = ppra.WrascPmacGate(
+        verbose=0,
+        ppmac=ppmac,
+        L1=1,
+        pass_conds=["Motor[L1].MinusLimit>0", "Motor[L1].InPos>0"],
+        cry_cmds="#{L1}j-",
+        celeb_cmds=["#{L1}hmz"],
+    )
+    ppra.do_ags([gate], cycle_period=0.02)
+    assert gate.is_done
+
+    model = emulator.model
+    assert model.motor(1, "ActPos") == -500 and model.motor(1, "HomeComplete") == 1
+    cmd_response, success, _ = ppmac.send_receive_raw("#1p")
+    assert success and cmd_response == ["#1p", "0\n"]
+
+    ppmac.close()
+    emulator.close()
+
+
+def tcp_commands_per_s(emulator, n_lines):
+    host, port = emulator.serve()
+    link = socket.create_connection((host, port))
+    reader = link.makefile("rb")
+    assert reader.readline() == b"STDIN Open for ASCII Input\n"
+
+    time_0 = time.perf_counter()
+    link.sendall(b"".join(b"P%d=%d P%d\n" % (k, k, k) for k in range(n_lines)))
+    replies = [reader.readline() for _ in range(2 * n_lines)]
+    elapsed = time.perf_counter() - time_0
+
+    assert replies[-2:] == [b"P%d=%d\n" % (n_lines - 1, n_lines - 1), b"\x06\n"]
+    link.close()
+    emulator.close()
+    return n_lines / elapsed
+
+
+def test_tcp_throughput():
+    n_lines = 2000
+    unlimited = tcp_commands_per_s(PpmacEmulator(), n_lines)
+    limited = tcp_commands_per_s(PpmacEmulator(commands_per_s=10000), n_lines)
+    print(f"{unlimited:.0f} commands/s, {limited:.0f} commands/s limited to 10000")
+
+    # not faster than the brick is set to, which is what holds it back
+    assert limited <= 10000
+    assert unlimited > limited
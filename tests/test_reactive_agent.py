@@ -0,0 +1,552 @@
+import asyncio
+import time
+
+import pytest
+
+from wrasc import reactive_agent as ra
+from wrasc.reactive_profiler import AgentProfiler
+from wrasc.reactive_replay import Recorder
+from wrasc.reactive_store import StateStore
+from wrasc.reactive_timer import VirtualClock
+
+from tests.conftest import compile_agents
+
+
+def count_poi(ag_self: ra.Agent):
+    # a source which settles after a few cycles
+    if ag_self.count < 3:
+        ag_self.count += 1
+    return ag_self.count, ""
+
+
+def double_poi(ag_self: ra.Agent):
+    return ag_self.counter_ag.poll.Var * 2, ""
+
+
+def follow_poi(ag_self: ra.Agent):
+    ag_self.calls += 1
+    return ag_self.still_ag.poll.Var, ""
+
+
+def make_agents():
+
+    counter_ag = ra.Agent(poll_in=count_poi)
+    counter_ag.count = 0
+
+    double_ag = ra.Agent(poll_in=double_poi)
+    double_ag.counter_ag = counter_ag
+
+    still_ag = ra.Agent(initial_value=5)
+
+    follow_ag = ra.Agent(poll_in=follow_poi)
+    follow_ag.still_ag = still_ag
+    follow_ag.calls = 0
+
+    return dict(
+        counter_ag=counter_ag, double_ag=double_ag, still_ag=still_ag, follow_ag=follow_ag
+    )
+
+
+def new_state_record():
+    return {
+        ra.StateNames.Invalid: 0,
+        ra.StateNames.Idle: 0,
+        ra.StateNames.Armed: 0,
+        ra.StateNames.Done: 0,
+        ra.StateNames.Inhibited: 0,
+    }
+
+
+def test_event_driven_matches_full_scan():
+
+    full = make_agents()
+    full_sorted = compile_agents(full)
+
+    event = make_agents()
+    event_sorted = compile_agents(event)
+    active_set = ra.ActiveSet(event_sorted)
+
+    for _ in range(10):
+        ra.inference(full_sorted, new_state_record())
+        ra.action(full_sorted, new_state_record())
+
+        active_set.inference(new_state_record())
+        active_set.action(new_state_record())
+
+    for agname in ["counter_ag", "double_ag", "still_ag", "follow_ag"]:
+        assert full[agname].poll.Var == event[agname].poll.Var
+        assert full[agname].state() == event[agname].state()
+
+    assert event["double_ag"].poll.Var == 6
+    assert event["follow_ag"].poll.Var == 5
+
+    # the stable branch is left alone once settled
+    assert full["follow_ag"].calls == 10
+    assert event["follow_ag"].calls < 5
+
+
+def test_event_driven_wakes_pushed_agents():
+
+    event = make_agents()
+    active_set = ra.ActiveSet(compile_agents(event))
+
+    for _ in range(5):
+        active_set.inference(new_state_record())
+        active_set.action(new_state_record())
+
+    calls = event["follow_ag"].calls
+    event["still_ag"].poll.force(7)
+
+    for _ in range(3):
+        active_set.inference(new_state_record())
+        active_set.action(new_state_record())
+
+    assert event["follow_ag"].poll.Var == 7
+    assert event["follow_ag"].calls > calls
+
+
+def slow_poi(ag_self: ra.Agent):
+    # stands in for a CA get or a ppmac round-trip
+    time.sleep(0.05)
+    return ag_self.count, ""
+
+
+def sum_poi(ag_self: ra.Agent):
+    return (
+        ag_self.slow0_ag.poll.Var
+        + ag_self.slow1_ag.poll.Var
+        + ag_self.slow2_ag.poll.Var
+        + ag_self.slow3_ag.poll.Var,
+        "",
+    )
+
+
+def test_layer_executor():
+
+    script_globals = {}
+    for i in range(4):
+        slow_ag = ra.Agent(poll_in=slow_poi)
+        slow_ag.count = i
+        slow_ag.spans = []
+        script_globals[f"slow{i}_ag"] = slow_ag
+
+    sum_ag = ra.Agent(poll_in=sum_poi)
+    for i in range(4):
+        setattr(sum_ag, f"slow{i}_ag", script_globals[f"slow{i}_ag"])
+    script_globals["sum_ag"] = sum_ag
+
+    sorted_ags = compile_agents(script_globals)
+    assert [len(agnames) for agnames in ra.layer_groups(sorted_ags)] == [4, 1]
+
+    executor = ra.LayerExecutor(max_workers=4)
+    try:
+        ra.inference(sorted_ags, new_state_record(), executor=executor)
+    finally:
+        executor.shutdown()
+
+    assert sum_ag.poll.Var == 6
+    assert executor.layer_times[0]["n"] == 4
+    assert executor.layer_times[1]["n"] == 1
+    # the four slow agents overlap
+    assert executor.layer_times[0]["wall"] < 0.15
+    assert len(executor.report()) == 2
+
+
+async def async_slow_poi(ag_self: ra.Agent):
+    time_0 = time.monotonic()
+    await asyncio.sleep(0.05)
+    ag_self.spans.append((time_0, time.monotonic()))
+    return ag_self.count, ""
+
+
+async def async_done_aov(ag_self: ra.Agent):
+    time_0 = time.monotonic()
+    await asyncio.sleep(0.05)
+    ag_self.spans.append((time_0, time.monotonic()))
+    return ra.StateLogics.Done, "done"
+
+
+def overlap(spans):
+    """ True if the (start, end) spans all run at the same time at some point """
+    return max(start for start, _ in spans) < min(end for _, end in spans)
+
+
+def test_async_process_loop():
+
+    script_globals = {}
+    for i in range(4):
+        # a mix of plain and async handlers
+        slow_ag = ra.Agent(
+            poll_in=async_slow_poi if i % 2 else slow_poi, act_on_valid=async_done_aov
+        )
+        slow_ag.count = i
+        slow_ag.spans = []
+        script_globals[f"slow{i}_ag"] = slow_ag
+
+    sum_ag = ra.Agent(poll_in=sum_poi)
+    for i in range(4):
+        setattr(sum_ag, f"slow{i}_ag", script_globals[f"slow{i}_ag"])
+    script_globals["sum_ag"] = sum_ag
+
+    sorted_ags = compile_agents(script_globals)
+
+    time_0 = time.monotonic()
+    asyncio.run(ra.async_process_loop(sorted_ags, n_loop=1, cycle_period=0.01))
+    elapsed = time.monotonic() - time_0
+
+    slow_ags = [script_globals[f"slow{i}_ag"] for i in range(4)]
+    assert sum_ag.poll.Var == 6
+    assert all(slow_ag.act.Var is ra.StateLogics.Done for slow_ag in slow_ags)
+    # the async handlers of a layer overlap within the cycle
+    assert overlap([slow_ags[1].spans[0], slow_ags[3].spans[0]])
+    assert overlap([slow_ag.spans[-1] for slow_ag in slow_ags])
+    # the two blocking poll_in's run one after the other, the rest overlap
+    assert elapsed < 0.3
+
+
+def test_async_process_loop_options(tmp_path):
+
+    counter_ag = ra.Agent(poll_in=count_poi)
+    counter_ag.count = 0
+    sorted_ags = compile_agents(dict(counter_ag=counter_ag))
+
+    virtual_clock = VirtualClock(1000.0)
+    recorder = Recorder(str(tmp_path / "run.rarec"))
+    time_0 = time.monotonic()
+    asyncio.run(
+        ra.async_process_loop(
+            sorted_ags,
+            n_loop=100,
+            cycle_period=60.0,
+            html_refresh=None,
+            time_source=virtual_clock,
+            recorder=recorder,
+            defer_puts=True,
+        )
+    )
+
+    # 100 minutes of cycles, with no waiting
+    assert time.monotonic() - time_0 < 5
+    assert virtual_clock() == pytest.approx(1000.0 + 100 * 60.0, abs=60.0)
+    assert recorder.n_cycles == 100 and counter_ag.poll.Var == 3
+    assert ra.clock() != virtual_clock()
+
+
+
+def test_async_process_loop_engines():
+
+    def run(loop_fn, **kwargs):
+        agents = make_agents()
+        sorted_ags = compile_agents(agents)
+        if kwargs.pop("store", False):
+            kwargs["store"] = StateStore(sorted_ags)
+        result = loop_fn(
+            sorted_ags,
+            n_loop=10,
+            cycle_period=1.0,
+            html_refresh=None,
+            time_source=VirtualClock(),
+            **kwargs,
+        )
+        if asyncio.iscoroutine(result):
+            asyncio.run(result)
+        return agents
+
+    def snapshot(agents):
+        return {
+            agname: (agent.poll.Var, agent.state()) for agname, agent in agents.items()
+        }
+
+    # the async loop runs the engines of process_loop to the same states
+    for options in [dict(event_driven=True), dict(store=True)]:
+        plain = run(ra.process_loop, **options)
+        on_asyncio = run(ra.async_process_loop, **options)
+        assert snapshot(on_asyncio) == snapshot(plain)
+        assert on_asyncio["follow_ag"].calls == plain["follow_ag"].calls
+
+    # the stable branch is left alone once settled
+    assert on_asyncio["double_ag"].poll.Var == 6
+    assert run(ra.async_process_loop, event_driven=True)["follow_ag"].calls < 5
+
+    profiler = AgentProfiler()
+    agents = run(ra.async_process_loop, profiler=profiler)
+    rows = {row["handler"]: row for row in profiler.report(n=10)}
+    assert rows["count_poi"]["calls"] == 10 and rows["count_poi"]["phase"] == "poll"
+    # detached at the end of the loop
+    assert "_in_proc_async" not in vars(agents["counter_ag"])
+
+
+def prev_poi(ag_self: ra.Agent):
+    return ag_self.prev_ag.poll.Var, ""
+
+
+def test_compile_many_agents():
+
+    script_globals = {"first_ag": ra.Agent(initial_value=1)}
+    prev = script_globals["first_ag"]
+    for k in range(2000):
+        agent = ra.Agent(poll_in=prev_poi)
+        agent.prev_ag = prev
+        script_globals[f"a{k}_ag"] = prev = agent
+
+    timings = {}
+    sorted_ags = compile_agents(script_globals, dependency_cache=False, timings=timings)
+
+    assert list(timings) == [
+        "discovery",
+        "config save",
+        "dependency compile",
+        "prep1",
+        "sort",
+        "pv connect",
+    ]
+    assert len(sorted_ags) == 2001
+    assert script_globals["a1999_ag"].layer == 2000
+    assert len(ra.layer_groups(sorted_ags)) == 2001
+    # discovery and layering are linear in the number of agents
+    assert timings["discovery"] < 1 and timings["dependency compile"] < 10
+
+
+def tick_poi(ag_self: ra.Agent):
+    ag_self.ticks.append(ag_self.tick)
+    return len(ag_self.ticks), ""
+
+
+def tick_aov(ag_self: ra.Agent):
+    ag_self.act_ticks.append(ag_self.tick)
+    return ra.StateLogics.Idle, ""
+
+
+def make_multi_rate_agents():
+    script_globals = dict(
+        fast_ag=ra.Agent(poll_in=tick_poi, act_on_valid=tick_aov),
+        slow_ag=ra.Agent(
+            poll_in=tick_poi, act_on_valid=tick_aov, poll_period=3, act_period=2
+        ),
+    )
+    for agent in script_globals.values():
+        agent.ticks, agent.act_ticks, agent.external = [], [], True
+    return script_globals
+
+
+def test_multi_rate():
+
+    plain = make_multi_rate_agents()
+    plain_sorted = compile_agents(plain)
+
+    event = make_multi_rate_agents()
+    active_set = ra.ActiveSet(compile_agents(event))
+
+    for tick in range(7):
+        for agent in list(plain.values()) + list(event.values()):
+            agent.tick = tick
+        ra.inference(plain_sorted, new_state_record(), tick=tick)
+        ra.action(plain_sorted, new_state_record(), tick=tick)
+        active_set.inference(new_state_record())
+        active_set.action(new_state_record())
+
+    for script_globals in [plain, event]:
+        assert script_globals["fast_ag"].ticks == list(range(7))
+        assert script_globals["slow_ag"].ticks == [0, 3, 6]
+        assert script_globals["slow_ag"].poll.Var == 3
+
+    assert plain["slow_ag"].act_ticks == [0, 2, 4, 6]
+    # event driven, it is acted on after it is visited, on its next act tick
+    assert event["slow_ag"].act_ticks == [0, 4, 6]
+
+    assert ra.Agent(poll_period=2).poll_period == 2
+    with pytest.raises(ValueError):
+        ra.Agent(act_period=0.5)
+
+
+def test_adaptive_process_loop():
+
+    script_globals = make_agents()
+    sorted_ags = compile_agents(script_globals)
+
+    cycle_timer = ra.CycleTimer(0.01)
+    ra.process_loop(
+        sorted_ags,
+        n_loop=15,
+        cycle_period=0.01,
+        max_period=0.04,
+        cycle_timer=cycle_timer,
+        html_refresh=None,
+    )
+    # counter_ag settles after 3 cycles, then the period is stretched
+    assert cycle_timer.cycle_period == 0.04
+    assert not ra.agents_active(sorted_ags, new_state_record())
+
+    script_globals["still_ag"].poll.force(8)
+    ra.inference(sorted_ags, new_state_record())
+    assert ra.agents_active(sorted_ags, new_state_record())
+
+
+def arm_aov(ag_self: ra.Agent):
+    if ag_self.armed_at is not None:
+        return ra.StateLogics.Done, "done"
+    ag_self.armed_at = ra.clock()
+    return ra.StateLogics.Armed, "armed"
+
+
+def wait_aoa(ag_self: ra.Agent):
+    ag_self.calls += 1
+    if ra.clock() < ag_self.armed_at + ag_self.wait:
+        ag_self.wake_time = ag_self.armed_at + ag_self.wait
+        return ra.StateLogics.Armed, "waiting"
+    ag_self.wake_time = None
+    return ra.StateLogics.Done, "done"
+
+
+def make_waiter(wait):
+    waiter_ag = ra.Agent(
+        poll_in=lambda ag_self: (True, ""), act_on_valid=arm_aov, act_on_armed=wait_aoa
+    )
+    waiter_ag.calls = 0
+    waiter_ag.armed_at = None
+    waiter_ag.wait = wait
+    return waiter_ag
+
+
+def test_event_driven_parks_waiting_agents():
+
+    waiter_ag = make_waiter(0.2)
+    active_set = ra.ActiveSet(compile_agents(dict(waiter_ag=waiter_ag)))
+
+    for _ in range(50):
+        active_set.inference(new_state_record())
+        active_set.action(new_state_record())
+        time.sleep(0.01)
+
+    assert waiter_ag.act.Var is ra.StateLogics.Done
+    # visited when it starts waiting, once more as act.Changed settles, and when
+    # the wait is over, not in between
+    assert waiter_ag.calls == 3
+    assert len(active_set.wheel) == 0
+
+
+def test_virtual_time():
+
+    waiter_ag = make_waiter(3600)
+    script_globals = dict(waiter_ag=waiter_ag, counter_ag=make_agents()["counter_ag"])
+    sorted_ags = compile_agents(script_globals)
+
+    virtual_clock = VirtualClock(start=1000.0)
+    time_0 = time.perf_counter()
+    ra.process_loop(
+        sorted_ags,
+        n_loop=3700,
+        cycle_period=1.0,
+        event_driven=True,
+        html_refresh=None,
+        time_source=virtual_clock,
+    )
+
+    # an hour of cycles, in well under a second of real time
+    assert time.perf_counter() - time_0 < 5
+    assert virtual_clock() == pytest.approx(1000.0 + 3700 * 1.0, abs=1)
+    assert waiter_ag.act.Var is ra.StateLogics.Done
+    assert waiter_ag.act.ChangeTime - waiter_ag.armed_at == pytest.approx(3600, abs=1)
+    # the agents of a phase share one reading of the clock
+    assert script_globals["counter_ag"].poll.Time == waiter_ag.poll.Time
+    # and the agents are back on real time
+    assert ra.clock() != virtual_clock()
+
+
+class MonitoredPV:
+    """ a PV with monitor callbacks, updated by the test """
+
+    def __init__(self, value):
+        self.value = value
+        self.callbacks = {}
+        self.reads = 0
+
+    def add_callback(self, callback):
+        index = len(self.callbacks)
+        self.callbacks[index] = callback
+        return index
+
+    def remove_callback(self, index):
+        del self.callbacks[index]
+
+    def post(self, value, timestamp):
+        self.value = value
+        for callback in list(self.callbacks.values()):
+            callback(pvname="TEST:PV", value=value, timestamp=timestamp)
+
+
+def counted_get_in_pv(ag_self: ra.Agent):
+    ag_self.in_PV.reads += 1
+    return ra.get_in_pv(ag_self)
+
+
+def test_monitored_pvs():
+
+    pv = MonitoredPV(1.0)
+    watcher_ag = ra.Agent(poll_in=ra.get_in_pv)
+    watcher_ag.in_PV = pv
+    counted_ag = ra.Agent(poll_in=counted_get_in_pv, watch_pvs=[pv])
+    counted_ag.in_PV = pv
+    polled_ag = ra.Agent(poll_in=lambda ag_self: (ag_self.poll.Var, ""))
+
+    sorted_ags = compile_agents(
+        dict(watcher_ag=watcher_ag, counted_ag=counted_ag, polled_ag=polled_ag)
+    )
+    assert ra.watched_pvs(watcher_ag) == [pv] and ra.watched_pvs(polled_ag) == []
+    active_set = ra.ActiveSet(sorted_ags)
+    assert len(pv.callbacks) == 2
+
+    def run(n):
+        for _ in range(n):
+            active_set.inference(new_state_record())
+            active_set.action(new_state_record())
+
+    run(10)
+    assert watcher_ag.poll.Var == 1.0
+    # visited once, and once more as poll.Changed settles
+    assert pv.reads == 2
+
+    pv.post(2.5, timestamp=1234.5)
+    run(10)
+    assert watcher_ag.poll.Var == counted_ag.poll.Var == 2.5
+    assert watcher_ag.input_time == 1234.5
+    assert pv.reads == 4
+
+    active_set.close()
+    assert pv.callbacks == {}
+
+
+def failing_pr(ag_self: ra.Agent):
+    # ZeroDivisionError on the second cycle
+    return 1 / (ag_self.counter_ag.poll.Var - 2)
+
+
+def test_loops_clean_up_on_errors():
+
+    for async_loop in [False, True]:
+        pv = MonitoredPV(1.0)
+        counter_ag = ra.Agent(poll_in=count_poi)
+        counter_ag.count = 0
+        # poll_pr raising is re-raised as RuntimeError by _in_proc
+        failing_ag = ra.Agent(poll_in=ra.get_in_pv, poll_pr=failing_pr)
+        failing_ag.in_PV = pv
+        failing_ag.counter_ag = counter_ag
+        sorted_ags = compile_agents(dict(counter_ag=counter_ag, failing_ag=failing_ag))
+
+        real_source = ra.clock.source
+        options = dict(
+            n_loop=10,
+            html_refresh=None,
+            time_source=VirtualClock(),
+            event_driven=True,
+            profile=True,
+        )
+        with pytest.raises(RuntimeError):
+            if async_loop:
+                asyncio.run(ra.async_process_loop(sorted_ags, **options))
+            else:
+                ra.process_loop(sorted_ags, **options)
+
+        assert ra.clock.source is real_source
+        assert pv.callbacks == {}
+        assert "_in_proc" not in vars(failing_ag)
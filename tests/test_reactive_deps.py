@@ -0,0 +1,95 @@
+import pytest
+
+from wrasc import reactive_agent as ra
+from wrasc.reactive_deps import CircularDependency, DependencyCache, layer_partition
+
+
+def pusher_aov(ag_self: ra.Agent):
+    """ docstring mentioning doc_ag is ignored """
+    # so is comment_ag
+    ag_self.target_ag.poll.force(1)
+    ag_self.watched_ag.act.hold(for_cycles=2)
+    return ag_self.source_ag.poll.Var, "see string_ag"
+
+
+handlers = dict(
+    one_line=lambda ag_self: (ag_self.a_ag.poll.Var, ""),
+    multi_line=lambda ag_self: (
+        ag_self.a_ag.poll.Var
+        + ag_self.b_ag.poll.Var,
+        "",
+    ),
+)
+
+
+def test_references():
+
+    cache = DependencyCache()
+    assert cache.references(pusher_aov) == (
+        ["ag_self.source_ag", "ag_self.target_ag", "ag_self.watched_ag"],
+        ["ag_self.target_ag", "ag_self.watched_ag"],
+    )
+    assert cache.references(handlers["one_line"]) == (["ag_self.a_ag"], [])
+    # multiline lambdas keep the references after their first line
+    assert cache.references(handlers["multi_line"]) == (
+        ["ag_self.a_ag", "ag_self.b_ag"],
+        [],
+    )
+
+
+def test_cache_file(tmp_path):
+
+    path = str(tmp_path / "test.deps.json")
+
+    cache = DependencyCache(path)
+    found = cache.references(pusher_aov)
+    assert (cache.hits, cache.misses) == (0, 1)
+    assert cache.save()
+
+    # a new start finds the handler unchanged
+    cache = DependencyCache(path)
+    assert cache.references(pusher_aov) == found
+    assert (cache.hits, cache.misses) == (1, 0)
+    assert not cache.save()
+
+
+def make_chain(n):
+    agents = [ra.Agent(name=f"a{k}_ag") for k in range(n)]
+    for k in range(1, n):
+        agents[k].infer_ags.add((agents[k - 1].name, agents[k - 1]))
+    return agents
+
+
+def test_layer_partition():
+
+    agents = make_chain(4)
+    side_ag = ra.Agent(name="side_ag")
+    side_ag.infer_ags.add(("a0_ag", agents[0]))
+
+    partition = layer_partition(agents[::-1] + [side_ag])
+    assert [[agent.name for agent in layer] for layer in partition] == [
+        ["a0_ag"],
+        ["a1_ag", "side_ag"],
+        ["a2_ag"],
+        ["a3_ag"],
+    ]
+    assert [agent.layer for agent in agents] == [0, 1, 2, 3]
+
+    # a deep graph is fine too
+    assert len(layer_partition(make_chain(5000))) == 5000
+
+
+def test_circular_dependency():
+
+    agents = make_chain(5)
+    # a1 -> a2 -> a3 -> a1, a4 is held up by the cycle but not part of it
+    agents[1].infer_ags.add(("a3_ag", agents[3]))
+    loner_ag = ra.Agent(name="loner_ag")
+    loner_ag.infer_ags.add(("loner_ag", loner_ag))
+
+    with pytest.raises(CircularDependency) as e:
+        layer_partition(agents + [loner_ag])
+
+    cycles = sorted(sorted(agent.name for agent in cycle) for cycle in e.value.cycles)
+    assert cycles == [["a1_ag", "a2_ag", "a3_ag"], ["loner_ag"]]
+    assert "a3_ag" in str(e.value)
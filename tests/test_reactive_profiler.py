@@ -0,0 +1,43 @@
+import time
+
+from wrasc import reactive_agent as ra
+from wrasc.reactive_profiler import AgentProfiler
+
+from tests.conftest import compile_agents
+
+
+def slow_poi(ag_self: ra.Agent):
+    time.sleep(0.01)
+    return 1, ""
+
+
+def quick_poi(ag_self: ra.Agent):
+    return 2, ""
+
+
+def done_aov(ag_self: ra.Agent):
+    return ra.StateLogics.Done, "done"
+
+
+def test_profiler_top_handlers():
+
+    script_globals = dict(
+        slow_ag=ra.Agent(poll_in=slow_poi, act_on_valid=done_aov),
+        quick_ag=ra.Agent(poll_in=quick_poi),
+    )
+    sorted_ags = compile_agents(script_globals)
+
+    profiler = AgentProfiler()
+    ra.process_loop(sorted_ags, n_loop=3, cycle_period=0.02, profiler=profiler)
+
+    top = profiler.report(n=1)
+    assert top[0]["agent"] == "slow_ag"
+    assert top[0]["phase"] == "poll" and top[0]["handler"] == "slow_poi"
+    assert top[0]["calls"] == 3
+    assert top[0]["max"] >= 0.01 and top[0]["p99"] >= 0.01
+
+    assert any(row["handler"] == "done_aov" for row in profiler.report(n=10))
+    assert "slow_ag" in profiler.report_str()
+
+    # detached at the end of the loop, the class methods are back in use
+    assert "_in_proc" not in vars(script_globals["slow_ag"])
@@ -0,0 +1,161 @@
+from wrasc.reactive_pvs import Prefetcher, PVRegistry, PutQueue
+
+
+class FakePV:
+    made = []
+
+    def __init__(self, pvname, verbose=False, connection_callback=None):
+        self.pvname = pvname
+        self.connected = False
+        self.connection_callback = connection_callback
+        FakePV.made.append(self)
+
+    def connect(self):
+        self.connected = True
+        self.connection_callback(pvname=self.pvname, conn=True, pv=self)
+
+
+def test_registry():
+
+    FakePV.made = []
+    polls = []
+
+    def poll():
+        # an IOC answering all the searches of the first round at once
+        polls.append(len(polls))
+        for _pv in FakePV.made:
+            if "MISSING" not in _pv.pvname:
+                _pv.connect()
+
+    registry = PVRegistry(factory=FakePV, poll=poll)
+    names = [f"SR08ID01:MOT{k}.{field}" for k in range(100) for field in ["RBV", "VAL"]]
+    for name in names + names[:50] + ["SR08ID01:MISSING"]:
+        registry.pv(name)
+
+    assert len(FakePV.made) == len(registry) == 201
+    assert registry.pv(names[0]) is registry.pv(names[0])
+
+    assert registry.wait_for_connections(timeout=0.05) == ["SR08ID01:MISSING"]
+    # later polls are only for the missing one
+    assert all(_pv.connected for _pv in FakePV.made[:-1])
+
+    report = registry.report()
+    assert report["n_connected"] == 200
+    assert report["not_connected"] == ["SR08ID01:MISSING"]
+    assert registry.latency(names[0]) >= 0
+    assert "200/201 PVs connected" in registry.report_str()
+
+    # nothing new to wait for
+    assert registry.wait_for_connections(timeout=1.0) == []
+
+
+class PutPV:
+    sent = []
+
+    def __init__(self, pvname):
+        self.pvname = pvname
+
+    def put(self, value, wait=False, callback=None, callback_data=None, **kwargs):
+        PutPV.sent.append((self.pvname, value))
+        if callback:
+            callback(pvname=self.pvname, **callback_data)
+
+
+def test_put_queue():
+
+    PutPV.sent = []
+    flushes = []
+    completed = []
+    queue = PutQueue(flush_io=lambda: flushes.append(len(PutPV.sent)))
+
+    velo, twv = PutPV("M1.VELO"), PutPV("M1.TWV")
+    queue.begin()
+    queue.put(velo, 1.0)
+    queue.put(twv, 0.1)
+    queue.put(
+        velo,
+        2.0,
+        callback=lambda pvname, data: completed.append((pvname, data)),
+        callback_data=dict(data="velo"),
+    )
+    # a put not through the queue, e.g. from another thread, is not held back
+    twv.put(0.5)
+    assert PutPV.sent == [("M1.TWV", 0.5)]
+    queue.end()
+
+    # coalesced, in the order of the first put, with one flush at the end
+    assert PutPV.sent[1:] == [("M1.VELO", 2.0), ("M1.TWV", 0.1)]
+    assert flushes == [3]
+    assert queue.n_puts == 3 and queue.n_sent == 2
+
+    # completion is delivered on the next inference
+    assert completed == []
+    queue.deliver()
+    assert completed == [("M1.VELO", "velo")]
+
+    # puts are sent at once outside of the phase
+    queue.put(velo, 3.0)
+    assert PutPV.sent[-1] == ("M1.VELO", 3.0)
+
+
+class GetPV:
+    """ a PV without monitor, get is a blocking round trip """
+
+    reads = 0
+
+    def __init__(self, pvname, value):
+        self.pvname = pvname
+        self.chid = pvname
+        self.value = value
+        self.connected = True
+        self.auto_monitor = False
+
+    def get(self, count=None, as_string=False, use_monitor=True, **kwargs):
+        GetPV.reads += 1
+        return self.value
+
+
+def test_prefetcher():
+
+    pvs = {name: GetPV(name, k) for k, name in enumerate(["A", "B", "C"])}
+    requests = []
+    flushes = []
+
+    prefetcher = Prefetcher(
+        ca_get=lambda chid, wait: requests.append(chid),
+        get_complete=lambda chid, timeout: pvs[chid].value,
+        flush_io=lambda: flushes.append(len(requests)),
+    )
+    prefetcher.add(pvs["A"])
+
+    GetPV.reads = 0
+    prefetcher.begin()
+    assert [prefetcher.get(pv) for pv in pvs.values()] == [0, 1, 2]
+    prefetcher.end()
+    # A was prefetched, B and C are learned
+    assert requests == ["A"] and GetPV.reads == 2
+    assert sorted(prefetcher.pvs) == ["A", "B", "C"]
+
+    pvs["B"].value = 10
+    requests.clear()
+    prefetcher.begin()
+    assert [prefetcher.get(pv) for pv in pvs.values()] == [0, 10, 2]
+    # as a string, or asked fresh, is not served from the snapshot
+    prefetcher.get(pvs["C"], as_string=True)
+    pvs["A"].value = 20
+    assert prefetcher.get(pvs["A"], use_monitor=False) == 20
+    # PV.get itself is left alone
+    assert pvs["A"].get() == 20
+    prefetcher.end()
+    assert requests == ["A", "B", "C"] and flushes[-1] == 3
+    assert GetPV.reads == 5 and prefetcher.n_served == 4
+
+    # outside of the phase, a plain get
+    assert prefetcher.get(pvs["B"]) == 10 and GetPV.reads == 6
+
+    # issued early, collected by the next begin
+    prefetcher.issue()
+    requests.clear()
+    prefetcher.begin()
+    prefetcher.end()
+    assert requests == []
@@ -0,0 +1,193 @@
+from wrasc import reactive_agent as ra
+from wrasc.reactive_pvs import pv_registry
+from wrasc.reactive_replay import (
+    Read,
+    Recorder,
+    Replayer,
+    StubPV,
+    decode,
+    encode,
+    replay,
+    stub_pvs,
+)
+from wrasc.reactive_timer import VirtualClock
+
+from tests.conftest import compile_agents
+
+
+class FakePpmac:
+    """ a ppmac whose position counts up on each read """
+
+    def __init__(self):
+        self.host = "fake"
+        self.position = 0
+
+    def send_receive_raw(self, command, timeout=5):
+        self.position += 1
+        return [command, str(self.position)], True, ""
+
+
+class NoPpmac:
+    host = "fake"
+
+    def send_receive_raw(self, command, timeout=5):
+        raise ConnectionError("no hardware in a replay")
+
+
+class WatchedPV:
+    """ a PV whose monitor updates are posted by the test """
+
+    def __init__(self):
+        self.callbacks = {}
+
+    def add_callback(self, callback):
+        self.callbacks[len(self.callbacks)] = callback
+        return len(self.callbacks) - 1
+
+    def remove_callback(self, index):
+        del self.callbacks[index]
+
+    def post(self, value, timestamp):
+        for callback in list(self.callbacks.values()):
+            callback(pvname="TEST:PV", value=value, timestamp=timestamp)
+
+
+class QuietPV(WatchedPV):
+    """ no monitor updates in a replay """
+
+    def post(self, value, timestamp):
+        pass
+
+
+def feed_poi(ag_self: ra.Agent):
+    # stands in for the CA thread, posting on every third cycle
+    ag_self.n_feeds += 1
+    if ag_self.n_feeds % 3 == 0:
+        ag_self.pv.post(ag_self.n_feeds, timestamp=1000.0 + ag_self.n_feeds)
+    return ag_self.n_feeds % 3, ""
+
+
+def capped_position_poi(ag_self: ra.Agent):
+    # settles, so the agent is only read again on the monitor updates
+    position, _ = position_poi(ag_self)
+    return min(position, 3), ""
+
+
+def position_poi(ag_self: ra.Agent):
+    response, success, _ = ag_self.ppmac.send_receive_raw("#1p")
+    return int(response[1]), ""
+
+
+def arm_aov(ag_self: ra.Agent):
+    if ag_self.poll.Var >= ag_self.target:
+        return ra.StateLogics.Done, "there"
+    return ra.StateLogics.Armed, "moving"
+
+
+def make_graph(ppmac, target=4):
+    position_ag = ra.Agent(
+        poll_in=position_poi, act_on_valid=arm_aov, act_on_armed=arm_aov
+    )
+    position_ag.ppmac = ppmac
+    position_ag.target = target
+
+    return compile_agents(dict(position_ag=position_ag))
+
+
+def make_watched_graph(ppmac, pv):
+    feed_ag = ra.Agent(poll_in=feed_poi)
+    feed_ag.pv = pv
+    feed_ag.n_feeds = 0
+    position_ag = ra.Agent(poll_in=capped_position_poi, watch_pvs=[pv])
+    position_ag.ppmac = ppmac
+
+    return compile_agents(dict(feed_ag=feed_ag, position_ag=position_ag))
+
+
+def make_pv_graph():
+    in_ag = ra.Agent(eprefix="", inpvname="TEST:REPLAY:IN", poll_in=ra.get_in_pv)
+
+    return compile_agents(dict(in_ag=in_ag))
+
+
+def test_encode():
+    for value in [None, True, False, 1.5, -3, "p1=5", [1, 2], ("Valid", "Done")]:
+        assert decode(encode(value), 0) == (value, len(encode(value)))
+    assert len(encode(1.5)) == 9
+
+
+def test_record_and_replay(tmp_path):
+
+    path = str(tmp_path / "run.rarec")
+    recorder = Recorder(path)
+    ra.process_loop(
+        make_graph(FakePpmac()),
+        n_loop=8,
+        html_refresh=None,
+        time_source=VirtualClock(),
+        recorder=recorder,
+    )
+    assert recorder.n_cycles == 8
+    # a position and two clock readings a cycle
+    assert recorder.n_reads == 8 * 3
+
+    replayer = Replayer(path)
+    assert replay(path, make_graph(NoPpmac()), replayer=replayer) == []
+    assert replayer.misses == 0
+    assert replayer.recorded[(4, "g__position_ag")] == ("Valid", "Done")
+
+    # a change in the graph shows up as the transitions which moved
+    differences = replay(path, make_graph(NoPpmac(), target=6))
+    assert [difference[:2] for difference in differences] == [
+        (4, "g__position_ag"),
+        (6, "g__position_ag"),
+    ]
+
+
+def test_replay_wakeups(tmp_path):
+
+    path = str(tmp_path / "run.rarec")
+    ppmac = FakePpmac()
+    recorder = Recorder(path)
+    ra.process_loop(
+        make_watched_graph(ppmac, WatchedPV()),
+        n_loop=20,
+        html_refresh=None,
+        time_source=VirtualClock(),
+        recorder=recorder,
+        event_driven=True,
+    )
+    # read on the first cycles and on the updates only
+    assert 6 <= ppmac.position < 20
+
+    # nothing posts in the replay, the agent is woken by the recorded updates
+    replayer = Replayer(path)
+    graph = make_watched_graph(NoPpmac(), QuietPV())
+    assert replay(path, graph, replayer=replayer, event_driven=True) == []
+    assert replayer.n_reads == recorder.n_reads and replayer.misses == 0
+    assert graph["g__position_ag"]["agent"].input_time == 1000.0 + 18
+
+
+def test_replay_stubs_pvs(tmp_path):
+
+    path = str(tmp_path / "run.rarec")
+    # a record of a graph reading a PV which doesn't exist here
+    recorder = Recorder(path)
+    recorder.open()
+    for cycle in range(1, 4):
+        recorder.begin_cycle(cycle)
+        recorder.write(Read, "clock", 1000.0 + cycle)
+        recorder.write(Read, "pv:TEST:REPLAY:IN", 2.5 * cycle)
+        recorder.write(Read, "clock", 1000.2 + cycle)
+    recorder.close()
+
+    replayer = Replayer(path)
+    replay(path, make_pv_graph, replayer=replayer)
+    assert replayer.n_reads == 9 and replayer.misses == 0
+    assert replayer.replayed[(1, "g__in_ag")] == ("Valid", "Idle")
+    # the registry is back to making PVs
+    assert pv_registry.factory is not StubPV
+
+    with stub_pvs():
+        graph = make_pv_graph()
+    assert isinstance(graph["g__in_ag"]["agent"].in_PV, StubPV)
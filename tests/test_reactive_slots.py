@@ -0,0 +1,72 @@
+""" memory and attribute access of the slotted Agent / MyObservable
+
+run with -s to see the numbers:
+    python -m pytest -s tests/test_reactive_slots.py
+"""
+
+import time
+import tracemalloc
+
+from wrasc import reactive_agent as ra
+
+n_agents = 10000
+
+
+class PlainObject:
+    """ the same attributes in a per instance __dict__, as before slotting """
+
+    def __init__(self, slotted):
+        for cls in type(slotted).__mro__:
+            for attr in getattr(cls, "__slots__", ()):
+                if attr in ["__dict__", "__weakref__"] or not hasattr(slotted, attr):
+                    continue
+                value = getattr(slotted, attr)
+                if isinstance(value, ra.MyObservable):
+                    value = PlainObject(value)
+                setattr(self, attr, value)
+
+
+def allocated(make):
+    tracemalloc.start()
+    objects = [make() for _ in range(n_agents)]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return objects, size / n_agents
+
+
+def hot_loop(agents):
+    # the kind of access done by check_var / set_var / state on every cycle
+    time_0 = time.perf_counter()
+    for _ in range(10):
+        for agent in agents:
+            poll = agent.poll
+            if poll._hold_counter < 1 and poll._force_counter < 1:
+                poll.Changed = poll.Var != poll.Last
+                poll.NoChangeCount += 1
+                agent.in_state = agent.inhibited
+    return time.perf_counter() - time_0
+
+
+def test_slotted_agents():
+
+    template = ra.Agent()
+    assert not hasattr(template.poll, "__dict__")
+
+    agents, slotted_size = allocated(ra.Agent)
+    plain_agents, plain_size = allocated(lambda: PlainObject(template))
+
+    slotted_time = min(hot_loop(agents) for _ in range(3))
+    plain_time = min(hot_loop(plain_agents) for _ in range(3))
+
+    print(
+        f"\n{n_agents} agents: {slotted_size:.0f} bytes per slotted agent, "
+        f"{plain_size:.0f} with __dict__; "
+        f"hot attribute loop {slotted_time:.4f}s vs {plain_time:.4f}s "
+        f"({plain_time / slotted_time:.2f}x)"
+    )
+
+    assert slotted_size < plain_size
+
+    # user attributes still work
+    agents[0].counter_ag = agents[1]
+    assert agents[0].counter_ag is agents[1]
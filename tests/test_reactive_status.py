@@ -0,0 +1,46 @@
+import os
+
+from wrasc import reactive_agent as ra
+from wrasc.reactive_status import StatusWriter
+
+
+def rows_of(values):
+    return [dict(name=f"ag{k}_ag", description=str(v)) for k, v in enumerate(values)]
+
+
+def test_status_writer_delta(tmp_path):
+
+    path = str(tmp_path / "status.html")
+    status_writer = StatusWriter(path, ra.VarsTable, refresh_period=60)
+
+    rows = rows_of([1, 2, 3])
+    status_writer.update(rows)
+    assert status_writer.write()
+    with open(path) as f:
+        assert f.read() == ra.VarsTable(rows).__html__()
+    assert status_writer.n_rendered == 3
+
+    # nothing new from the loop, nothing to write
+    assert not status_writer.write()
+
+    rows = rows_of([1, 5, 3])
+    status_writer.update(rows)
+    assert status_writer.write()
+    with open(path) as f:
+        assert f.read() == ra.VarsTable(rows).__html__()
+    # only the changed row is rendered again
+    assert status_writer.n_rendered == 4
+    assert status_writer.n_writes == 2
+    assert os.listdir(tmp_path) == ["status.html"]
+
+
+def test_status_writer_thread(tmp_path):
+
+    path = str(tmp_path / "status.html")
+    status_writer = StatusWriter(path, ra.VarsTable, refresh_period=60).start()
+    status_writer.update(rows_of([]))
+    status_writer.stop()
+
+    with open(path) as f:
+        assert f.read() == ra.VarsTable([]).__html__()
+    assert status_writer.thread is None
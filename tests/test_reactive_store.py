@@ -0,0 +1,107 @@
+import numpy as np
+
+from wrasc import reactive_agent as ra
+from wrasc.reactive_store import StateStore
+
+from tests.conftest import compile_agents
+
+
+def count_poi(ag_self: ra.Agent):
+    ag_self.count += 1
+    return ag_self.count, ""
+
+
+def double_poi(ag_self: ra.Agent):
+    return ag_self.counter_ag.poll.Var * 2, ""
+
+
+def holder_poi(ag_self: ra.Agent):
+    # pushes an agent later in the same inference
+    if ag_self.counter_ag.poll.Var == 4:
+        ag_self.late.poll.hold(for_cycles=2)
+    return ag_self.counter_ag.poll.Var, ""
+
+
+def late_poi(ag_self: ra.Agent):
+    return ag_self.holder_ag.poll.Var + 1, ""
+
+
+def make_agents():
+    counter_ag = ra.Agent(poll_in=count_poi)
+    counter_ag.count = 0
+    double_ag = ra.Agent(poll_in=double_poi)
+    double_ag.counter_ag = counter_ag
+    holder_ag = ra.Agent(poll_in=holder_poi)
+    holder_ag.counter_ag = counter_ag
+    late_ag = ra.Agent(poll_in=late_poi)
+    late_ag.holder_ag = holder_ag
+    # not an _ag name, so it is not taken as a dependency
+    holder_ag.late = late_ag
+
+    return dict(
+        counter_ag=counter_ag, double_ag=double_ag, holder_ag=holder_ag, late_ag=late_ag
+    )
+
+
+def snapshot(agents):
+    return {
+        agname: (
+            agent.poll.Var,
+            agent.poll.Changed,
+            agent.poll.ChangeCount,
+            agent.poll._hold_counter,
+            agent.state(),
+        )
+        for agname, agent in agents.items()
+        if agname.endswith("_ag")
+    }
+
+
+def test_store_matches_objects():
+
+    plain = make_agents()
+    plain_sorted = compile_agents(plain)
+
+    stored = make_agents()
+    stored_sorted = compile_agents(stored)
+    store = StateStore(stored_sorted)
+    assert isinstance(stored["double_ag"].poll.ChangeCount, int)
+
+    skipped = []
+    for cycle in range(8):
+        if cycle == 2:
+            plain["double_ag"].poll.hold(for_cycles=3)
+            stored["double_ag"].poll.hold(for_cycles=3)
+
+        plain_states, stored_states = {}, {}
+        for ag_states in [plain_states, stored_states]:
+            for name in ra.StateNames.__dict__.values():
+                if isinstance(name, str) and not name.startswith("_"):
+                    ag_states[name] = 0
+
+        ra.inference(plain_sorted, plain_states)
+        ra.action(plain_sorted, plain_states)
+        ra.inference(stored_sorted, stored_states, store=store)
+        ra.action(stored_sorted, stored_states, store=store)
+
+        assert snapshot(plain) == snapshot(stored)
+        assert plain_states == stored_states
+        skipped.append(np.flatnonzero(store.skipped).tolist())
+
+    # held agents skip _in_proc, unless they are pushed during the inference
+    i_double, i_late = store.index["g__double_ag"], store.index["g__late_ag"]
+    assert skipped == [[], [], [i_double], [i_double], [i_double, i_late], [], [], []]
+
+
+def test_store_columns():
+
+    stored = make_agents()
+    store = StateStore(compile_agents(stored))
+
+    stored["late_ag"].poll.hold(for_cycles=2)
+    stored["counter_ag"].poll.force(10, for_cycles=-1)
+
+    i_late, i_counter = store.index["g__late_ag"], store.index["g__counter_ag"]
+    assert store.poll.held(ra.clock())[i_late]
+    assert np.flatnonzero(store.poll.forced()).tolist() == [i_counter]
+    assert stored["late_ag"].poll._hold_counter == 2
@@ -0,0 +1,148 @@
+import pytest
+
+from wrasc.reactive_timer import (
+    AdaptivePeriod,
+    CycleTimer,
+    Histogram,
+    OverrunPolicy,
+    TimerWheel,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+def make_timer(policy, clock):
+    return CycleTimer(
+        1.0, overrun_policy=policy, spin=0, clock=clock, sleep=clock.sleep
+    )
+
+
+def run_cycle(cycle_timer, clock, busy):
+    start = cycle_timer.wait_infer()
+    clock.now += busy
+    cycle_timer.end_inference()
+    cycle_timer.wait_act()
+    cycle_timer.end_action()
+    return start
+
+
+def test_histogram():
+    hist = Histogram()
+    for k in range(1, 101):
+        hist.add(k * 1e-4)
+
+    assert hist.count == 100
+    assert hist.min == 1e-4 and hist.max == 1e-2
+    assert abs(hist.mean - 50.5e-4) < 1e-12
+    # estimated from the log bins, within a bin width
+    assert 50e-4 <= hist.percentile(50) < 65e-4
+    assert hist.percentile(100) == hist.max
+
+    hist.clear()
+    assert hist.count == 0 and hist.percentile(50) is None
+
+
+def test_on_time_cycles():
+    clock = FakeClock()
+    cycle_timer = make_timer(OverrunPolicy.Skip, clock)
+
+    starts = [run_cycle(cycle_timer, clock, busy=0.1) for _ in range(5)]
+
+    assert starts == [101.0, 102.0, 103.0, 104.0, 105.0]
+    assert cycle_timer.overruns == 0
+    assert cycle_timer.jitter.max == 0
+    assert cycle_timer.act_deadline == 105.2
+
+
+def test_overrun_policies():
+    starts = {}
+    for policy in [OverrunPolicy.Skip, OverrunPolicy.CatchUp, OverrunPolicy.Stretch]:
+        clock = FakeClock()
+        cycle_timer = make_timer(policy, clock)
+        starts[policy] = [run_cycle(cycle_timer, clock, busy=0.1)]
+        # overrun by a cycle and a half
+        starts[policy].append(run_cycle(cycle_timer, clock, busy=2.5))
+        starts[policy] += [run_cycle(cycle_timer, clock, busy=0.1) for _ in range(2)]
+
+        # catching up is still behind at the end of the next cycle
+        assert cycle_timer.overruns == (2 if policy == OverrunPolicy.CatchUp else 1)
+        assert len(cycle_timer.late_cycles) == cycle_timer.overruns
+
+    assert starts[OverrunPolicy.Skip] == [101.0, 102.0, 105.0, 106.0]
+    assert starts[OverrunPolicy.CatchUp] == [101.0, 102.0, 104.5, 104.6]
+    assert starts[OverrunPolicy.Stretch] == [101.0, 102.0, 104.5, 105.5]
+
+
+def test_adaptive_period():
+
+    adaptive_period = AdaptivePeriod(0.1, 1.0, quiet_cycles=2)
+    periods = [adaptive_period.update(False) for _ in range(7)]
+    assert periods == [0.1, 0.1, 0.2, 0.4, 0.8, 1.0, 1.0]
+    # back to the fast rate at once
+    assert adaptive_period.update(True) == 0.1
+
+    with pytest.raises(ValueError):
+        AdaptivePeriod(1.0, 0.1)
+
+
+def test_set_period():
+    clock = FakeClock()
+    cycle_timer = make_timer(OverrunPolicy.Skip, clock)
+
+    assert run_cycle(cycle_timer, clock, busy=0.1) == 101.0
+    cycle_timer.set_period(0.5)
+    assert run_cycle(cycle_timer, clock, busy=0.1) == 101.5
+    assert cycle_timer.act_deadline == 101.6
+    assert run_cycle(cycle_timer, clock, busy=0.1) == 102.0
+
+
+def test_timer_wheel():
+
+    wheel = TimerWheel(resolution=0.01, slot_bits=2, levels=3)
+    deadlines = {key: 100.0 + 0.037 * key * key for key in range(40)}
+    for key, deadline in deadlines.items():
+        wheel.insert(key, deadline)
+    wheel.insert(1, 100.5)
+    wheel.cancel(2)
+    deadlines[1] = 100.5
+    del deadlines[2]
+
+    expired = []
+    now = 100.0
+    while wheel:
+        now += 0.05
+        for key in wheel.advance(now):
+            # not late by more than the step, never early
+            assert now - 0.05 - 0.01 < deadlines[key] <= now
+            expired.append(key)
+
+    # including the deadlines beyond the top level
+    assert sorted(expired) == sorted(deadlines)
+    assert wheel.advance(now + 100) == []
+
+
+def test_timer_wheel_start():
+
+    # an earlier deadline inserted before the first advance is not late
+    wheel = TimerWheel(resolution=0.01, slot_bits=2, levels=3)
+    wheel.insert("a", 100.0)
+    wheel.insert("b", 1.0)
+    assert wheel.advance(1.5) == ["b"]
+    assert wheel.advance(99.5) == []
+    assert wheel.advance(100.5) == ["a"]
+
+    # started, deadlines already past expire on the next advance
+    wheel = TimerWheel(resolution=0.01, slot_bits=2, levels=3, start=50.0)
+    wheel.insert("a", 60.0)
+    wheel.insert("b", 10.0)
+    assert wheel.advance(50.01) == ["b"]
+    assert wheel.advance(60.01) == ["a"]
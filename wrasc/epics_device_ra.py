@@ -109,19 +109,19 @@ def confirm_restoring(ag_self: ra.Agent):
 
 
 def restore(ag_self: ra.Agent):
-    ag_self.in_PV.value = ag_self.poll.SavedVar
+    ag_self.put_pv(ag_self.in_PV, ag_self.poll.SavedVar)
     return ra.StateLogics.Done, 'restored'
 
 
 def put_out_pv(ag_self: ra.Agent):
     # mind this: pvc will not be invoked for process every cycle.
     if ag_self.out_PV.value != ag_self.poll.Var:
-        ag_self.out_PV.put(ag_self.poll.Var)
+        ag_self.put_pv(ag_self.out_PV, ag_self.poll.Var)
     return ra.StateLogics.Done, ''
 
 
 def reset_out_pv(ag_self: ra.Agent):
-    ag_self.out_PV.value = 0
+    ag_self.put_pv(ag_self.out_PV, 0)
     return ra.StateLogics.Idle, ''
 
 
@@ -181,7 +181,7 @@ def restore_rrbv(ag_self: ra.Agent):
         # caput(pvprefix+'.'+'SET','Use')
 
 
-    ag_self.in_PV.value = ag_self.poll.SavedVar
+    ag_self.put_pv(ag_self.in_PV, ag_self.poll.SavedVar)
     return ra.StateLogics.Done, 'restored'
 
 _VERBOSE_ = 4
@@ -325,6 +325,8 @@ class EpicsExtendedMotor(ra.Device):
                 exec_str = "self.{0}.install_pvs(inpvname='{1}', outpvname='{1}', dev_prefix='{2}', eprefix='{3}')"\
                     .format(agname, pvname, self.dev_prefix, self.eprefix)
                 exec(exec_str)
+                # the verify handlers only read in_PV from outside the device
+                getattr(self, agname).watch_pvs = [getattr(self, agname).in_PV]
 
                 # and set saved values:
 
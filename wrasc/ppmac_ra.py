@@ -1,6 +1,6 @@
 from pandas.core.indexes.base import Index
 from wrasc import reactive_agent as ra
-from ppmac import GpasciiClient
+from ppmac import GpasciiClient, GpasciiPool, gpascii_pool
 from ppmac import PpmacToolMt
 
 
@@ -11,6 +11,8 @@ from io import StringIO
 import csv
 import os
 import time
+import threading
+import asyncio
 import utils
 from fractions import Fraction
 from utils.pputils import *
@@ -64,6 +66,10 @@ def ppwr_poll_in(ag_self: ra.Agent):
     if ag_self.cry_tries < ag_self.cry_pretries:
         return False, "pre-tries not exhasuted, skiped checking conds."
 
+    if not ag_self.ppmac.connected:
+        # transient, the driver reconnects in the background
+        return ra.StateLogics.Invalid, f"{ag_self.ppmac.host} disconnected"
+
     ag_self.receive_cond_parsed(ag_self.pass_conds_parsed)
 
     return ag_self.check_pass_conds()
@@ -101,15 +107,18 @@ def ppwr_act_on_valid(ag_self: ra.Agent):
 def ppwr_act_on_armed(ag_self: ra.Agent):
 
     if ag_self.wait_after_celeb:
-        elapsed = ra.timer() - ag_self.poll.ChangeTime
+        elapsed = ra.clock() - ag_self.poll.ChangeTime
         if elapsed < ag_self.wait_after_celeb:
+            # nothing to do till then, the event driven loop parks the agent
+            ag_self.wake_time = ag_self.poll.ChangeTime + ag_self.wait_after_celeb
             return (
                 ra.StateLogics.Armed,
                 f"waiting {elapsed:.2f}/{ag_self.wait_after_celeb}sec",
             )
         else:
             # need to flick a deliberate change here, to reset the timer!
-            ag_self.poll.ChangeTime = ra.timer()
+            ag_self.poll.ChangeTime = ra.clock()
+            ag_self.wake_time = None
 
     if ag_self.pass_logs_parsed:
         ag_self.acquire_log()
@@ -126,6 +135,10 @@ def ppwr_act_on_invalid(ag_self: ra.Agent):
     assert isinstance(ag_self, WrascPmacGate)
     ag_self: WrascPmacGate
 
+    if not ag_self.ppmac.connected:
+        # keep the retries, the conds are checked again once reconnected
+        return ra.StateLogics.Idle, "waiting for ppmac to reconnect"
+
     ag_self.cry_tries = 0
 
     if ag_self.fetch_cmds_parsed:
@@ -177,22 +190,39 @@ class PPMAC:
     Args:
         backward (bool): sets the driver to use the ultra slow but backward compatible PpmacToolMt
         host (str): url
+        pipelined (bool): GpasciiClient in pipelined mode, exchanges from many
+            threads go back to back on the one channel
+        pooled (bool): share the GpasciiPool of the host with the other PPMAC
+            instances, exchanges run in parallel on its channels
     """
 
-    def __init__(self, host, debug=False, backward=False) -> None:
+    def __init__(
+        self, host, debug=False, backward=False, pipelined=False, pooled=False
+    ) -> None:
 
         self.host = host
+        self.pooled = pooled and not backward
+        self.pipelined = pipelined and not backward and not pooled
 
-        if not backward:
+        if self.pooled:
+            self.gpascii = gpascii_pool(self.host, debug=debug)
+        elif not backward:
             self.gpascii = GpasciiClient(host=self.host, debug=debug)
         else:
             self.gpascii = PpmacToolMt(host=self.host)
 
-        self.connected = False
+        # one exchange at a time, agents sharing this ppmac may run on a thread pool
+        self.lock = threading.RLock()
+
+    @property
+    def connected(self):
+        """ False while the driver is reconnecting, too """
+        return bool(self.gpascii.connected)
 
     def connect(self):
         self.gpascii.connect()
-        self.connected = self.gpascii.connected
+        if self.connected and self.pipelined:
+            self.gpascii.start_pipeline()
 
     def send_receive_raw(self, command, timeout=5):
         """send and then receive a series of commands in sequence
@@ -205,6 +235,16 @@ class PPMAC:
             [type]: [description]
         """
 
+        if self.pipelined or self.pooled:
+            # the replies are matched to the exchanges by the gpascii reader,
+            # or each exchange has a pool channel to itself
+            return self._send_receive_raw(command, timeout=timeout)
+
+        with self.lock:
+            return self._send_receive_raw(command, timeout=timeout)
+
+    def _send_receive_raw(self, command, timeout=5):
+
         command = re.sub("([\n][\n]+)", "\n", command.rstrip("\n").lstrip("\n"))
         n_to_receive = command.count("\n") + 1 if command else 0
 
@@ -213,7 +253,7 @@ class PPMAC:
             # construct an empty respond here and leave
             return ["", ""], True, ""
 
-        if isinstance(self.gpascii, GpasciiClient):
+        if isinstance(self.gpascii, (GpasciiClient, GpasciiPool)):
 
             # TODO turn this to a decorator
             # split commamnds if more than limit
@@ -272,7 +312,7 @@ class PPMAC:
 
     def send_list_receive_dict(self, cmd_list, timeout=5):
 
-        if not isinstance(self.gpascii, GpasciiClient):
+        if not isinstance(self.gpascii, (GpasciiClient, GpasciiPool)):
             return None, None, None
 
         cmd_str = "\n".join(str(e) for e in cmd_list)
@@ -1112,5 +1152,44 @@ def do_ags(ag_list, cycle_period=0.25, all_done=True, verbose=None):
             ag_self._out_proc()
 
 
+async def async_do_ags(ag_list, cycle_period=0.25, all_done=True, verbose=None):
+    """do_ags on asyncio: the agents' exchanges overlap within each phase
+    and the wait for the next cycle doesn't block the event loop
+
+    Args:
+        ag_list (list or ppra.WrascPmacGate): agents to process until done
+    """
+
+    if not isinstance(ag_list, list):
+        ag_list = [ag_list]
+
+    for ag in ag_list:
+        ag: WrascPmacGate
+        ag.reset()
+        if verbose:
+            ag.verbose = verbose
+
+    loop = asyncio.get_running_loop()
+    next_infer_time = loop.time() + cycle_period
+
+    while not ags_done(ag_list, all_done):
+
+        while next_infer_time < loop.time():
+            next_infer_time += cycle_period
+        next_act_time = next_infer_time + cycle_period / (2)
+
+        await asyncio.sleep(next_infer_time - loop.time())
+
+        await asyncio.gather(*[ag_self._in_proc_async() for ag_self in ag_list])
+
+        for ag_self in ag_list:
+            if ag_self.verbose > 1:
+                print(f"{ag_self.name}: {ag_self.annotate()[1]}")
+
+        await asyncio.sleep(next_act_time - loop.time())
+
+        await asyncio.gather(*[ag_self._out_proc_async() for ag_self in ag_list])
+
+
 if __name__ == "__main__":
     pass
@@ -30,7 +30,11 @@
 #
 
 
+import asyncio
+import contextlib
 import functools
+import heapq
+import itertools
 import sys
 import time
 import inspect
@@ -39,10 +43,22 @@ from timeit import default_timer as timer
 from typing import Set, Any, List, Union, Tuple
 
 import numpy as np
-from epics import PV
+from epics import PV, ca
 from wrasc.reactive_utils import myEsc, cls, retrieve_name, retrieve_name_in_globals
+from wrasc.reactive_timer import (
+    AdaptivePeriod,
+    CycleTimer,
+    OverrunPolicy,
+    PhaseClock,
+    TimerWheel,
+)
+from wrasc.reactive_profiler import AgentProfiler
+from wrasc.reactive_status import StatusWriter
+from wrasc.reactive_deps import DependencyCache, CircularDependency, layer_partition
+from wrasc.reactive_pvs import prefetcher, pv_registry, put_queue
 import re
-from collections import OrderedDict
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
 import logging
 import os
 from datetime import datetime
@@ -61,7 +77,7 @@ If you get compile error at pass 3, "max iteration" it is most likely due to a c
 """
 
 # output_dir = os.path.expanduser("~") + "/wrasc_output"
-output_dir = "ra_out"
+output_dir = os.environ.get("WRASC_OUTPUT_DIR", "ra_out")
 
 dmodel_log_filename = os.path.join(output_dir, "dmodel_compiler" + ".log")
 info_log_filename = os.path.join(output_dir, "reactive_agents_process" + ".log")
@@ -112,6 +128,10 @@ excel_out_path = output_dir
 html_out_filename = "SCS-Poll-Vars.html"
 html_out_path = excel_out_path
 
+# time of the agents: observables, holds, forces and waits read this, frozen for
+# the duration of each phase by the process loops. timer() is for measurements
+clock = PhaseClock()
+
 
 # Declare your table
 class VarsTable(ft.Table):
@@ -304,7 +324,7 @@ class Device:
 
             for _pvf in [item for item in pvf_list if item not in self.pvf_list]:
                 self.pvf_list.append(_pvf)
-                _pvfPV = PV(eprefix + dev_prefix + _pvf, verbose=False)
+                _pvfPV = pv_registry.pv(eprefix + dev_prefix + _pvf)
                 self.pv_by_name.update({_pvf: _pvfPV})
 
     def get_pv_by_name(self, pv_name=None):
@@ -323,11 +343,50 @@ class Device:
         return _r
 
 
+async def resolve(result):
+    """ awaits the result of handlers which are coroutines, plain results pass through """
+    if inspect.isawaitable(result):
+        return await result
+    return result
+
+
 method_names = ["poll_pr", "poll_in", "act_on_invalid", "act_on_valid", "act_on_armed"]
 push_method_names = ["poll.force", "poll.unhold", "poll.hold", "act.hold", "act.unhold"]
 
 
 class MyObservable:
+    # two of these per agent, slotted to keep them small and their attributes fast
+    __slots__ = (
+        "Var",
+        "SavedVar",
+        "ErrTol",
+        "NoRestore",
+        "Changed",
+        "Diff",
+        "ChangeCount",
+        "Time",
+        "ChangeTime",
+        "Err",
+        "ForcedVar",
+        "DiffTime",
+        "Last",
+        "LastTime",
+        "DebounceCycles",
+        "VarDebounced",
+        "NoChangeCount",
+        "IsStable",
+        "_hold_counter",
+        "_force_counter",
+        "_hold_timer",
+        "_force_timer",
+        "_hold_indefinitely",
+        "_force_indefinitely",
+        "unit",
+        "verbose",
+        "last_message",
+        "on_push",
+    )
+
     def __init__(self, **kwargs):
         self.Var = None
         self.SavedVar = None
@@ -336,7 +395,7 @@ class MyObservable:
         self.Changed = True
         self.Diff = None
         self.ChangeCount = 0
-        self.Time = timer()
+        self.Time = clock()
         self.ChangeTime = self.Time
         self.Err = None
         self.ForcedVar = None
@@ -364,11 +423,19 @@ class MyObservable:
 
         self.last_message = ""
 
+        # called on every push (hold, unhold, force), so that an event driven
+        # process_loop can wake up the agent owning this observable
+        self.on_push = None
+
+    def pushed(self):
+        if self.on_push is not None:
+            self.on_push()
+
     def is_on_hold(self):
         return (
             self._hold_indefinitely
             or (self._hold_counter > 0)
-            or (self._hold_timer >= timer())
+            or (self._hold_timer >= clock())
         )
 
     def hold(self, for_cycles=1, for_seconds=-1, reset_var=True):
@@ -389,10 +456,11 @@ class MyObservable:
         if self._hold_counter < for_cycles:
             self._hold_counter = for_cycles
 
-        time_0 = timer()
+        time_0 = clock()
         if self._hold_timer < time_0 + for_seconds:
             self._hold_timer = time_0 + for_seconds
 
+        self.pushed()
         return True
 
     def unhold(self):
@@ -402,6 +470,7 @@ class MyObservable:
         # Removing (200406) immediate procing as _proc is now external to the observables
         # self._proc()
 
+        self.pushed()
         return True
 
     def force(self, forced_var, for_cycles=1, for_seconds=0, immediate=False):
@@ -423,10 +492,11 @@ class MyObservable:
         if self._force_counter < for_cycles:
             self._force_counter = for_cycles
 
-        time_0 = timer()
+        time_0 = clock()
         if self._force_timer < time_0 + for_seconds:
             self._force_timer = time_0 + for_seconds
 
+        self.pushed()
         return True
 
     def delta(self):
@@ -447,7 +517,7 @@ class MyObservable:
         if self._force_indefinitely:
             self._force_counter = 1
 
-        if not ((self._hold_counter < 1) and (self._hold_timer < timer())):
+        if not ((self._hold_counter < 1) and (self._hold_timer < clock())):
             # TODO review: do we need persistent invalidation? probably NO
             # changed it to reflect
             # if it is holding, then it is not "just" changed.
@@ -493,19 +563,19 @@ class MyObservable:
                     # val1->None .. None->val2 is a change.
                     self.Changed = not (_v == self.Last)
                     if self.Changed:
-                        self.DiffTime = timer() - self.LastTime
+                        self.DiffTime = clock() - self.LastTime
             else:
                 # inVar is valid
                 self.Changed = not (_v == self.Var)
                 if self.Changed:
-                    self.DiffTime = timer() - self.Time
+                    self.DiffTime = clock() - self.Time
                     self.Last = self.Var
                     self.LastTime = self.Time
 
             if self.Changed:
                 self.NoChangeCount = 0
                 self.ChangeCount += 1
-                self.ChangeTime = timer()
+                self.ChangeTime = clock()
                 try:
                     # this may throw an exception depending on dmAgentType... put this last!
                     if isinstance(self.Var, type(_v)):
@@ -526,28 +596,82 @@ class MyObservable:
 
         # Assign new variable: Time is the time of last update, weather it is changed or not or even None.
 
-        self.Time = timer()
+        self.Time = clock()
         self.Var = _v
 
 
 # DModel agent class
 class Agent(object):
-    depend_ags = ...  # type: Set[Any]
-    infer_ags = ...  # type: Set[Any]
-    preced_ags = ...  # type: Set[Any]
-    dmAgentType = "uninitialised"
-    owner = Device()
-
-    poll_pr = ...  # type: function
-    poll_in = ...  # type: function
-    act_on_invalid = ...  # type: function
-    act_on_valid = ...  # type: function
-    act_on_armed = ...  # type: function
-
-    act_on = ...  # type: function
-
-    poll = ...  # type: MyObservable
-    act = ...  # type: MyObservable
+    depend_ags: Set[Any]
+    infer_ags: Set[Any]
+    preced_ags: Set[Any]
+    dmAgentType: str
+    owner: Device
+
+    poll_pr: Any
+    poll_in: Any
+    act_on_invalid: Any
+    act_on_valid: Any
+    act_on_armed: Any
+
+    act_on: Any
+
+    poll: MyObservable
+    act: MyObservable
+
+    # the state used on every cycle is slotted, __dict__ is kept for the
+    # attributes which scripts and subclasses attach to their agents
+    __slots__ = (
+        "owner",
+        "poll",
+        "act",
+        "inhibited",
+        "known",
+        "in_state",
+        "out_state",
+        "poll_pr",
+        "poll_in",
+        "act_on_invalid",
+        "act_on_valid",
+        "act_on_armed",
+        "act_on",
+        "unit",
+        "in_unit",
+        "out_unit",
+        "verbose",
+        "in_verbose",
+        "out_verbose",
+        "in_message",
+        "out_message",
+        "first_name",
+        "owner_name",
+        "eprefix",
+        "dev_prefix",
+        "name",
+        "dmAgentType",
+        "description",
+        "depend_ags",
+        "preced_ags",
+        "infer_ags",
+        "layer",
+        "time_out",
+        "external",
+        "poll_period",
+        "act_period",
+        "wake_time",
+        "watch_pvs",
+        "read_pvs",
+        "input_time",
+        "pvs_by_name",
+        "pvs_by_name_PVs",
+        "inpvname",
+        "in_PV",
+        "outpvname",
+        "out_PV",
+        "agent_list",
+        "__dict__",
+        "__weakref__",
+    )
 
     def __init__(self, owner: Device = None, **kwargs):
 
@@ -602,6 +726,24 @@ class Agent(object):
 
         self.time_out = None
 
+        # None: worked out by the event driven scheduler, see has_external_input
+        self.external = None
+
+        # in base ticks of process_loop, see poll_due
+        self.poll_period = 1
+        self.act_period = 1
+
+        # clock() before which an Armed agent has nothing to do, e.g. waiting
+        # out wait_after_celeb, so the event driven scheduler can park it
+        self.wake_time = None
+
+        # None: worked out, see watched_pvs
+        self.watch_pvs = None
+        # read with get_pv in poll_in, to be prefetched, see Prefetcher
+        self.read_pvs = None
+        # CA timestamp of the last monitor update which woke the agent
+        self.input_time = None
+
         self.setup(**kwargs)
 
         self.pvs_by_name = None
@@ -631,6 +773,11 @@ class Agent(object):
         description=None,
         time_out=None,
         unit="",
+        external=None,
+        poll_period=None,
+        act_period=None,
+        watch_pvs=None,
+        read_pvs=None,
         **kwargs,
     ):
 
@@ -678,6 +825,29 @@ class Agent(object):
         if time_out:
             self.time_out = time_out
 
+        if external is not None:
+            self.external = external
+
+        # PVs or PV names, the monitors of which wake the agent when event driven
+        if watch_pvs is not None:
+            self.watch_pvs = list(watch_pvs)
+        # PVs or PV names, read synchronously by the handlers
+        if read_pvs is not None:
+            self.read_pvs = list(read_pvs)
+
+        # e.g. poll_period=10 polls the agent on every 10th tick of process_loop
+        for _period_name, _period in [
+            ("poll_period", poll_period),
+            ("act_period", act_period),
+        ]:
+            if _period is None:
+                continue
+            if not isinstance(_period, int) or _period < 1:
+                raise ValueError(
+                    f"{_period_name} shall be a whole number of ticks, got {_period}"
+                )
+            setattr(self, _period_name, _period)
+
     def install_pvs(
         self,
         eprefix=None,
@@ -698,14 +868,14 @@ class Agent(object):
 
         if inpvname:
             self.inpvname = inpvname
-            self.in_PV = PV(
-                eprefix + dev_prefix + inpvname, verbose=False
+            self.in_PV = pv_registry.pv(
+                eprefix + dev_prefix + inpvname
             )  # , callback=handle_update)
 
         if outpvname:
             self.outpvname = outpvname
-            self.out_PV = PV(
-                eprefix + dev_prefix + outpvname, verbose=False
+            self.out_PV = pv_registry.pv(
+                eprefix + dev_prefix + outpvname
             )  # , callback=handle_update)
 
         if pvs_by_name:
@@ -713,8 +883,8 @@ class Agent(object):
             self.pvs_by_name_PVs = {}
 
             for _pvf in self.pvs_by_name:
-                _pvfPV = PV(
-                    self.eprefix + self.dev_prefix + _pvf, verbose=False
+                _pvfPV = pv_registry.pv(
+                    self.eprefix + self.dev_prefix + _pvf
                 )  # , callback=handle_update)
                 self.pvs_by_name_PVs.update({_pvf: _pvfPV})
 
@@ -777,56 +947,92 @@ class Agent(object):
         # DONE look at the list of valid refs and eval if your precedents are all valid. Otw post a message
         # if planned invalidation is passed
 
-        _v = None
-
         return_message = self.poll.check_var()
 
         if return_message:
             return self.state(), return_message
 
-        if self.poll_in:
-            try:
-                # pre poll function, which will NOT be interrogated for dependencies
-
-                # now fuse the pre and poll:
-                # if poll is unknown, the it wins.
-                # if poll is known, the pre can represent the value
-                # by multiplication!
-                # i.e. if poll returns True, then pre determins the value
-                #
-                try:
-                    if self.poll_pr is not None:
-                        self.inhibited = not self.poll_pr(self)  # override to diabled
-                except:
-                    # TODO fix this
-                    raise RuntimeError(
-                        f"Exception in poll_pr func of agent {self.name} "
-                    )
+        _v, return_message = self._poll_handlers()
 
-                if self.inhibited:
-                    _v, return_message = None, "inhibited"
-                else:
-                    _v, return_message = self.poll_in(self)
+        self.poll.set_var(_v, return_message)
 
-            except AttributeError:
-                _v = None
-                return_message = str(sys.exc_info()[0])
-                raise AttributeError(return_message)
-            except TypeError:
-                _v = None
-                return_message = str(sys.exc_info()[0])
-            except KeyError:
-                _v = None
-                return_message = str(sys.exc_info()[0])
-        else:
-            # not forced and no poll method, retain the existing var
-            _v = self.poll.Var
-            return_message = ""
+        return self.state(), return_message
+
+    async def _in_proc_async(self):
+        """ _in_proc for process loops running on asyncio, handlers may be async def """
+
+        return_message = self.poll.check_var()
+
+        if return_message:
+            return self.state(), return_message
+
+        _v, return_message = await self._poll_handlers_async()
 
         self.poll.set_var(_v, return_message)
 
         return self.state(), return_message
 
+    def _poll_handlers(self):
+
+        if not self.poll_in:
+            # not forced and no poll method, retain the existing var
+            return self.poll.Var, ""
+
+        try:
+            # pre poll function, which will NOT be interrogated for dependencies
+
+            # now fuse the pre and poll:
+            # if poll is unknown, the it wins.
+            # if poll is known, the pre can represent the value
+            # by multiplication!
+            # i.e. if poll returns True, then pre determins the value
+            #
+            try:
+                if self.poll_pr is not None:
+                    self.inhibited = not self.poll_pr(self)  # override to diabled
+            except:
+                # TODO fix this
+                raise RuntimeError(f"Exception in poll_pr func of agent {self.name} ")
+
+            if self.inhibited:
+                return None, "inhibited"
+
+            return self.poll_in(self)
+
+        except AttributeError:
+            return_message = str(sys.exc_info()[0])
+            raise AttributeError(return_message)
+        except TypeError:
+            return None, str(sys.exc_info()[0])
+        except KeyError:
+            return None, str(sys.exc_info()[0])
+
+    async def _poll_handlers_async(self):
+        """ same as _poll_handlers, awaiting async handlers """
+
+        if not self.poll_in:
+            return self.poll.Var, ""
+
+        try:
+            try:
+                if self.poll_pr is not None:
+                    self.inhibited = not await resolve(self.poll_pr(self))
+            except:
+                raise RuntimeError(f"Exception in poll_pr func of agent {self.name} ")
+
+            if self.inhibited:
+                return None, "inhibited"
+
+            return await resolve(self.poll_in(self))
+
+        except AttributeError:
+            return_message = str(sys.exc_info()[0])
+            raise AttributeError(return_message)
+        except TypeError:
+            return None, str(sys.exc_info()[0])
+        except KeyError:
+            return None, str(sys.exc_info()[0])
+
     def _out_proc(self):
         """
 
@@ -839,33 +1045,70 @@ class Agent(object):
         # if return_message:
         #     return self.state(), return_message
 
-        _v = None
-        return_message = ""
+        if self._act_held():
+            # TODO review: do we need persistant act.hold? probably NO
+            # changed it from None to outVar
+            _v, return_message = self.act.Var, "on act.hold..."
+        else:
+            _v, return_message = self._act_handler()
+
+        return self._act_set_var(_v, return_message)
+
+    async def _out_proc_async(self):
+        """ _out_proc for process loops running on asyncio, handlers may be async def """
+
+        if self._act_held():
+            _v, return_message = self.act.Var, "on act.hold..."
+        else:
+            _v, return_message = await self._act_handler_async()
+
+        return self._act_set_var(_v, return_message)
+
+    def _act_held(self):
+
         if self.act._hold_indefinitely:
             self.act._hold_counter = 1
 
-        if not ((self.act._hold_counter < 1) and (self.act._hold_timer < timer())):
-            # TODO review: do we need persistant act.hold? probably NO
-            # changed it from None to outVar
-            _v = self.act.Var
+        if not ((self.act._hold_counter < 1) and (self.act._hold_timer < clock())):
             # in case of holding on timer, decrementing the cycle counter is useless and harmless.
             self.act._hold_counter -= 1
-            return_message = "on act.hold..."
-        else:
-            # calculate the current state
-            # DONE Major bug fixed:
-            self.state()
+            return True
 
-            if self.act_on is not None:
-                try:
-                    # assert(self.act_on == self.act_on_invalid)
-                    _v, return_message = self.act_on(self)
-                except TypeError:
-                    _v = None
-                    return_message = str(sys.exc_info()[0])
-                except KeyError:
-                    _v = None
-                    return_message = str(sys.exc_info()[0])
+        return False
+
+    def _act_handler(self):
+
+        # calculate the current state
+        # DONE Major bug fixed:
+        self.state()
+
+        if self.act_on is None:
+            return None, ""
+
+        try:
+            # assert(self.act_on == self.act_on_invalid)
+            return self.act_on(self)
+        except TypeError:
+            return None, str(sys.exc_info()[0])
+        except KeyError:
+            return None, str(sys.exc_info()[0])
+
+    async def _act_handler_async(self):
+        """ same as _act_handler, awaiting async handlers """
+
+        self.state()
+
+        if self.act_on is None:
+            return None, ""
+
+        try:
+            return await resolve(self.act_on(self))
+        except TypeError:
+            return None, str(sys.exc_info()[0])
+        except KeyError:
+            return None, str(sys.exc_info()[0])
+
+    def _act_set_var(self, _v, return_message):
 
         # TODO improve change setting by defining inChange_threshold
         if self.act.Var is None:
@@ -877,10 +1120,10 @@ class Agent(object):
 
         if self.act.Changed:
             self.act.ChangeCount += 1
-            self.act.DiffTime = timer() - self.act.Time
+            self.act.DiffTime = clock() - self.act.Time
             self.act.Last = self.act.Var
             self.act.LastTime = self.act.Time
-            self.act.ChangeTime = timer()
+            self.act.ChangeTime = clock()
             try:
                 # this may through an exception depending on dmAgentType... put this last!
                 if isinstance(self.act.Var, type(_v)):
@@ -892,6 +1135,16 @@ class Agent(object):
         self.act.last_message = return_message
         return self.state(), return_message
 
+    def get_pv(self, pv, **kwargs):
+        """ pv.get(**kwargs), from the snapshot taken before the inference phase
+        if the process loop prefetches, see reactive_pvs.Prefetcher """
+        return prefetcher.get(pv, **kwargs)
+
+    def put_pv(self, pv, value, **kwargs):
+        """ pv.put(value, **kwargs), held back to the end of the action phase if
+        the process loop defers the puts, see reactive_pvs.PutQueue """
+        return put_queue.put(pv, value, **kwargs)
+
     def annotate(self):
 
         status = self.state()
@@ -988,9 +1241,7 @@ def prep1(ddict, cfg_motor_props=None, eprefix=None):
             _pvs_by_name = ddict[_ag]["pvf_list"]
 
             for _pvf in _pvs_by_name:
-                _pvfPV = PV(
-                    dev_prefix + _pvf, verbose=False
-                )  # , callback=handle_update)
+                _pvfPV = pv_registry.pv(dev_prefix + _pvf)  # , callback=handle_update)
                 pvf = _pvf
                 ddict[_ag].update({pvf: _pvfPV})
 
@@ -998,8 +1249,132 @@ def prep1(ddict, cfg_motor_props=None, eprefix=None):
         ddict[_ag].update({"layer": ddict[_ag]["agent"].layer})
 
 
-def inference(sorted_ag_list, ag_states, debug=False):
+class AgentsByLayer(OrderedDict):
+    """ agents_sorted_by_layer as made by compile_n_install
+
+    layers: the layer partition of the dependency compiler, a list with one list
+        of agent names per layer, for schedulers to use as is
+    """
+
+    def __init__(self, *args, layers=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.layers = layers
+
+
+def layer_groups(sorted_ag_list):
+    """ splits agents_sorted_by_layer into lists of agent names of the same layer """
+    if getattr(sorted_ag_list, "layers", None) is not None:
+        return sorted_ag_list.layers
+    return [
+        list(agnames)
+        for _, agnames in itertools.groupby(
+            sorted_ag_list, key=lambda agname: sorted_ag_list[agname]["agent"].layer
+        )
+    ]
+
+
+def attach_ca_context():
+    """ pyepics PVs are only visible to threads attached to the initial CA context.
+    libca is left alone if no PVs are made yet, as initialising it is not thread safe.
+    """
+    if ca.libca is not None:
+        ca.use_initial_context()
+
+
+def timed_in_proc(agent: Agent):
+    time_0 = timer()
+    result = agent._in_proc()
+    return result, timer() - time_0
+
+
+class LayerExecutor:
+    """ runs _in_proc of the agents of one layer concurrently on a bounded thread pool
+
+    Agents in the same layer can't infer from each other, so the only ordering
+    required is a barrier between the layers. Handlers blocked on a CA get or
+    a ppmac round-trip then overlap, and cycle time scales with the depth of
+    the graph rather than the number of agents.
+
+    layer_times keeps per layer timing of the last cycle and the worst case:
+        n: number of agents run in the layer
+        wall: time from submitting the layer to passing the barrier
+        slowest: the agent which held the barrier
+        wait: average time agents waited at the barrier for the slowest one
+    """
+
+    def __init__(self, max_workers=4):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="wrasc_layer",
+            initializer=attach_ca_context,
+        )
+        self.layer_times = {}
+
+    def in_proc(self, agents):
+        """ returns the list of _in_proc results, in the same order as agents """
+
+        if not agents:
+            return []
+
+        time_0 = timer()
+        if len(agents) == 1:
+            results = [timed_in_proc(agents[0])]
+        else:
+            futures = [self.pool.submit(timed_in_proc, agent) for agent in agents]
+            # barrier: the next layer may depend on any of these
+            results = [future.result() for future in futures]
+        wall = timer() - time_0
+
+        busy = [result[1] for result in results]
+        slowest = busy.index(max(busy))
+        layer = agents[0].layer
+        _times = self.layer_times.setdefault(layer, dict(cycles=0, max_wall=0))
+        _times.update(
+            n=len(agents),
+            wall=wall,
+            slowest=agents[slowest].name,
+            wait=wall - sum(busy) / len(busy),
+            cycles=_times["cycles"] + 1,
+            max_wall=max(_times["max_wall"], wall),
+        )
+
+        return [result[0] for result in results]
+
+    def report(self):
+        return [
+            "layer {} - {n} agents, {wall:.4f}s (max {max_wall:.4f}s), "
+            "barrier wait {wait:.4f}s on {slowest}".format(layer, **_times)
+            for layer, _times in sorted(self.layer_times.items())
+        ]
+
+    def shutdown(self):
+        self.pool.shutdown(wait=True)
+
+
+def poll_due(agent: Agent, tick):
+    """ True if the agent is to be polled on this base tick, i.e. every
+    agent.poll_period ticks. All agents are due on tick 0 and when tick is None
+    """
+    return tick is None or tick % agent.poll_period == 0
+
+
+def act_due(agent: Agent, tick):
+    return tick is None or tick % agent.act_period == 0
+
+
+def inference(
+    sorted_ag_list,
+    ag_states,
+    debug=False,
+    executor: LayerExecutor = None,
+    store=None,
+    tick=None,
+):
     # cycle only once, based on dependency order
+    # store: a reactive_store.StateStore of the agents, to skip the agents on hold
+    # and tally the states on whole arrays
+    # tick: number of the base tick, to only poll the agents due on it, see poll_due
 
     # logger = logger_debug if debug else logger_default
     polls_var_list = []
@@ -1008,31 +1383,83 @@ def inference(sorted_ag_list, ag_states, debug=False):
     _this_cycle_has_print = False
     ag_states[StateNames.Valid] = 0
     ag_states[StateNames.Invalid] = 0
-    for agname in sorted_ag_list:
-        agent = sorted_ag_list[agname]["agent"]  # type: Agent
-        # install a copy of agents list on each agent ONCE
-        if not agent.agent_list:
-            agent.agent_list = sorted_ag_list
-        # only the first minor cycle counts as a major cycle.
-        status, return_message = agent._in_proc()
-        (print_str, desc_str, in_var_str) = agent.annotate()
 
-        if str(return_message).startswith("RA_"):
-            # this is a RA command:
-            ra_commands.add(return_message)
+    if store is not None:
+        store.begin_inference()
+
+    # with an executor, each layer is processed as a whole
+    for agnames in layer_groups(sorted_ag_list) if executor else [sorted_ag_list]:
+
+        agents = [sorted_ag_list[agname]["agent"] for agname in agnames]
+        for agent in agents:
+            # install a copy of agents list on each agent ONCE
+            if not agent.agent_list:
+                agent.agent_list = sorted_ag_list
+
+        rows = [store.index[agname] for agname in agnames] if store else None
+        due = [poll_due(agent, tick) for agent in agents]
+        held = None
+        if executor:
+            # decided before the layer is submitted, so results stay in step
+            held = [store.is_held(i) for i in rows] if store else [False] * len(agents)
+            results = iter(
+                executor.in_proc(
+                    [
+                        agent
+                        for agent, on_hold, is_due in zip(agents, held, due)
+                        if is_due and not on_hold
+                    ]
+                )
+            )
 
-        if agent.verbose > 0:
-            polls_var_list.append(dict(name=agname, description=desc_str))
+        for k, agname in enumerate(agnames):
+            agent = agents[k]  # type: Agent
+            if not due[k]:
+                # not its tick, the last state and row of the agent stand
+                if agent.verbose > 0 and "var_row" in sorted_ag_list[agname]:
+                    polls_var_list.append(sorted_ag_list[agname]["var_row"])
+                if store is None and "Status" in sorted_ag_list[agname]:
+                    ag_states[sorted_ag_list[agname]["Status"][0]] += 1
+                continue
 
-        ag_states[status[0]] += 1
-        sorted_ag_list[agname].update({"Status": status})
+            if executor:
+                on_hold = held[k]
+            else:
+                on_hold = store is not None and store.is_held(rows[k])
+
+            # only the first minor cycle counts as a major cycle.
+            if on_hold:
+                status, return_message = store.held_in_proc(rows[k], agent)
+            elif executor:
+                status, return_message = next(results)
+            else:
+                status, return_message = agent._in_proc()
+            (print_str, desc_str, in_var_str) = agent.annotate()
 
-        sorted_ag_list[agname].update({"var_str": in_var_str})
+            if str(return_message).startswith("RA_"):
+                # this is a RA command:
+                ra_commands.add(return_message)
+
+            if agent.verbose > 0:
+                var_row = dict(name=agname, description=desc_str)
+                sorted_ag_list[agname]["var_row"] = var_row
+                polls_var_list.append(var_row)
+
+            if store is not None:
+                store.set_in_state(rows[k], status[0])
+            else:
+                ag_states[status[0]] += 1
+            sorted_ag_list[agname].update({"Status": status})
+
+            sorted_ag_list[agname].update({"var_str": in_var_str})
+
+    if store is not None:
+        store.end_inference(ag_states)
 
     return _this_cycle_has_print, ra_commands, polls_var_list
 
 
-def action(sorted_ag_list, ag_states, debug=False):
+def action(sorted_ag_list, ag_states, debug=False, store=None, tick=None):
 
     logger = logger_debug if debug else logger_default
 
@@ -1040,8 +1467,13 @@ def action(sorted_ag_list, ag_states, debug=False):
 
     ra_commands = set([])
 
-    for agname in sorted_ag_list:
+    for i, agname in enumerate(sorted_ag_list):
         agent = sorted_ag_list[agname]["agent"]  # type: Agent
+        if not act_due(agent, tick):
+            if store is None and "Status" in sorted_ag_list[agname]:
+                ag_states[sorted_ag_list[agname]["Status"][1]] += 1
+            continue
+
         status, return_message = agent._out_proc()
         (print_str, desc_str, in_var_str) = agent.annotate()
 
@@ -1049,7 +1481,10 @@ def action(sorted_ag_list, ag_states, debug=False):
             # this is a RA command:
             ra_commands.add(return_message)
 
-        ag_states[status[1]] += 1
+        if store is not None:
+            store.set_out_state(i, status[1])
+        else:
+            ag_states[status[1]] += 1
         sorted_ag_list[agname].update({"Status": status})
 
         if len(print_str):
@@ -1057,10 +1492,417 @@ def action(sorted_ag_list, ag_states, debug=False):
                 logger.debug(print_str)
                 _this_cycle_has_print = True
 
+    if store is not None:
+        store.end_action(ag_states)
+
     return _this_cycle_has_print, ra_commands
 
 
-def compile_dependencies(_agents_list, script_globals):
+def has_external_input(agent: Agent):
+    """ True if the agent watches something outside of the agent graph,
+    i.e. a PV, a ppmac or anything which is not listed in its infer_ags.
+    Agents can override the guess by setting agent.external
+    """
+    if agent.external is not None:
+        return agent.external
+
+    if agent.in_PV is not None or agent.pvs_by_name_PVs:
+        return True
+
+    # a poll_in which doesn't refer to any agents is watching the outside world
+    return agent.poll_in is not None and not agent.infer_ags
+
+
+def watched_pvs(agent: Agent):
+    """ PVs whose monitor updates are the only outside input of the agent, so the
+    event driven loop visits it on their updates instead of every cycle. Names in
+    agent.watch_pvs are fields of the owner device, or full PV names if the agent
+    has no owner. Unless set, only agents polling their in_PV with get_in_pv are
+    watched. If a PV can't be found the agent is polled as usual
+    """
+    if agent.watch_pvs is None:
+        if agent.poll_in is get_in_pv and agent.in_PV is not None:
+            return [agent.in_PV]
+        return []
+
+    pvs = agent_pvs(agent, agent.watch_pvs)
+    return [] if None in pvs else pvs
+
+
+def agent_pvs(agent: Agent, pvs):
+    """ PVs of a list of PVs and PV names, None for the names not found.
+    Names are fields of the owner device, or full PV names if there is no owner
+    """
+    _pvs = []
+    for pv in pvs:
+        if isinstance(pv, str):
+            if agent.owner is None:
+                pv = pv_registry.pv(pv)
+            elif hasattr(agent.owner, "get_pv_by_name") and agent.owner.pv_by_name:
+                pv = agent.owner.get_pv_by_name(pv)
+            else:
+                pv = None
+        _pvs.append(pv)
+    return _pvs
+
+
+class ActiveSet:
+    """ event driven replacement for inference() and action()
+
+    Only the agents which are due are visited in each cycle, so that stable parts
+    of the graph cost nothing. An agent is visited when:
+        it has an external input (see has_external_input), or one of the PVs it
+            watches posted a monitor update (see watched_pvs)
+        poll.Changed or act.Changed of one of its precedents flips
+        it is pushed by another agent (poll.force, poll.hold, act.unhold, ...)
+        its hold/force countdown is running, or its hold timer expires
+        it is Armed, as act_on_armed is expected to be polled
+    and its poll_period (act_period for the action) is up, see poll_due.
+
+    Agents on a hold timer, and Armed agents with a wake_time ahead, are parked on
+    a TimerWheel and not visited at all, even if they have an external input,
+    until their deadline is up or they are pushed.
+
+    Dependents are taken from depend_ags, as compiled by compile_dependencies,
+    so agents_sorted_by_layer shall be compiled before making an ActiveSet.
+    """
+
+    def __init__(self, sorted_ag_list):
+
+        self.sorted_ag_list = sorted_ag_list
+        self.agnames = list(sorted_ag_list)
+        self.agents = [sorted_ag_list[agname]["agent"] for agname in self.agnames]
+
+        index_of = {agent: i for i, agent in enumerate(self.agents)}
+
+        self.dependents = []
+        self.sources = set()
+        # (pv, callback index) of the monitors, removed by close
+        self.monitors = []
+        # agents woken by monitors, appended to from the CA threads
+        self.dirty = deque()
+        for i, agent in enumerate(self.agents):
+            # install a copy of agents list on each agent ONCE
+            if not agent.agent_list:
+                agent.agent_list = sorted_ag_list
+
+            _dependents = {index_of.get(_ag[1]) for _ag in agent.depend_ags}
+            _dependents.discard(None)
+            _dependents.discard(i)
+            self.dependents.append(sorted(_dependents))
+
+            _watched = watched_pvs(agent)
+            for pv in _watched:
+                self.monitors.append(
+                    (pv, pv.add_callback(functools.partial(self.mark_dirty, i)))
+                )
+            if has_external_input(agent) and not _watched:
+                self.sources.add(i)
+
+            agent.poll.on_push = agent.act.on_push = functools.partial(self.wake, i)
+
+        # the first cycle visits everyone
+        self.pending = set(range(len(self.agents)))
+        # agent index by the time at which its hold or wait expires
+        self.wheel = TimerWheel()
+        # visited in the inference phase of this cycle, to be acted on
+        self.to_act = set()
+        # visited, but their act_period is not up yet
+        self.act_pending = set()
+        # base tick, see poll_due
+        self.tick = -1
+
+        # last counted states, to keep the tally of ag_states incrementally
+        self.in_states = [None] * len(self.agents)
+        self.out_states = [None] * len(self.agents)
+        self.in_counts = {}
+        self.out_counts = {}
+        self.var_rows = OrderedDict()
+
+        self.n_visits = 0
+
+    def wake(self, i):
+        self.pending.add(i)
+        self.wheel.cancel(i)
+
+    def mark_dirty(self, i, timestamp=None, **kwargs):
+        """ monitor callback of a watched PV, queued up for the next inference """
+        self.dirty.append((i, timestamp))
+
+    def take_dirty(self):
+        """ [(agent index, timestamp)] of the monitor updates since the last call """
+        dirty = []
+        while self.dirty:
+            dirty.append(self.dirty.popleft())
+        return dirty
+
+    def close(self):
+        for pv, index in self.monitors:
+            pv.remove_callback(index)
+        self.monitors = []
+
+    def reschedule(self, i, agent: Agent, now):
+        """ keeps the agent active while it is counting down or armed, or parks it
+        on the wheel while it is waiting for a deadline
+        """
+
+        deadline = max(agent.poll._hold_timer, agent.act._hold_timer)
+        armed = agent.act.Var is StateLogics.Armed
+        if armed and agent.wake_time is not None and agent.wake_time > now:
+            deadline = max(deadline, agent.wake_time)
+            armed = False
+
+        if (
+            agent.poll._hold_counter > 0
+            or agent.poll._force_counter > 0
+            or agent.act._hold_counter > 0
+            or armed
+        ):
+            self.pending.add(i)
+        elif deadline >= now:
+            self.wheel.insert(i, deadline)
+
+    @staticmethod
+    def recount(counts, states, i, new_state):
+        if states[i] is not None:
+            counts[states[i]] -= 1
+        counts[new_state] = counts.get(new_state, 0) + 1
+        states[i] = new_state
+
+    def inference(self, ag_states, debug=False, executor: LayerExecutor = None):
+
+        ra_commands = set([])
+        _this_cycle_has_print = False
+
+        due, heap, now = self.begin_inference()
+        while heap:
+            batch = self.next_batch(heap, whole_layer=executor is not None)
+            was_changed = [self.agents[i].poll.Changed for i in batch]
+            if executor:
+                results = executor.in_proc([self.agents[i] for i in batch])
+            else:
+                results = [self.agents[batch[0]]._in_proc()]
+
+            for k, i in enumerate(batch):
+                self.visit_in(
+                    i, results[k], was_changed[k], heap, due, ra_commands, now
+                )
+
+        polls_var_list = self.end_inference(ag_states)
+
+        return _this_cycle_has_print, ra_commands, polls_var_list
+
+    async def async_inference(self, ag_states, debug=False):
+        """ inference() on asyncio, the agents due in a layer are awaited together """
+
+        ra_commands = set([])
+        _this_cycle_has_print = False
+
+        due, heap, now = self.begin_inference()
+        while heap:
+            batch = self.next_batch(heap, whole_layer=True)
+            was_changed = [self.agents[i].poll.Changed for i in batch]
+            results = await asyncio.gather(
+                *[self.agents[i]._in_proc_async() for i in batch]
+            )
+
+            for k, i in enumerate(batch):
+                self.visit_in(
+                    i, results[k], was_changed[k], heap, due, ra_commands, now
+                )
+
+        polls_var_list = self.end_inference(ag_states)
+
+        return _this_cycle_has_print, ra_commands, polls_var_list
+
+    def begin_inference(self):
+        """ (due, heap of due, now) of the agents to visit in this inference """
+
+        self.tick += 1
+        now = clock()
+        self.pending.update(self.wheel.advance(now))
+        for i, timestamp in self.take_dirty():
+            self.agents[i].input_time = timestamp
+            self.wake(i)
+
+        # agents with a poll_period wait in pending for their tick
+        deferred = {i for i in self.pending if not poll_due(self.agents[i], self.tick)}
+        due = (self.pending - deferred) | {
+            i
+            for i in self.sources
+            if i not in self.wheel and poll_due(self.agents[i], self.tick)
+        }
+        self.pending = deferred
+        self.to_act = set()
+
+        heap = list(due)
+        heapq.heapify(heap)
+        return due, heap, now
+
+    def next_batch(self, heap, whole_layer=False):
+        batch = [heapq.heappop(heap)]
+        if whole_layer:
+            # everything due in this layer goes in one batch
+            layer = self.agents[batch[0]].layer
+            while heap and self.agents[heap[0]].layer == layer:
+                batch.append(heapq.heappop(heap))
+        return batch
+
+    def end_inference(self, ag_states):
+        """ tallies the in states, returns the rows of the status page """
+
+        ag_states[StateNames.Valid] = 0
+        ag_states[StateNames.Invalid] = 0
+        for state in self.in_counts:
+            ag_states[state] = self.in_counts[state]
+
+        return list(self.var_rows.values())
+
+    def visit_in(self, i, result, was_changed, heap, due, ra_commands, now):
+
+        agent = self.agents[i]
+        agname = self.agnames[i]
+        status, return_message = result
+        (print_str, desc_str, in_var_str) = agent.annotate()
+        self.n_visits += 1
+
+        if str(return_message).startswith("RA_"):
+            ra_commands.add(return_message)
+
+        if agent.verbose > 0:
+            self.var_rows[agname] = dict(name=agname, description=desc_str)
+
+        self.recount(self.in_counts, self.in_states, i, status[0])
+        self.sorted_ag_list[agname].update({"Status": status})
+        self.sorted_ag_list[agname].update({"var_str": in_var_str})
+
+        self.to_act.add(i)
+
+        if agent.poll.Changed or was_changed:
+            # changed needs one more visit to settle back to False
+            if agent.poll.Changed:
+                self.pending.add(i)
+            for j in self.dependents[i]:
+                if j > i and poll_due(self.agents[j], self.tick):
+                    if j not in due:
+                        due.add(j)
+                        heapq.heappush(heap, j)
+                else:
+                    self.pending.add(j)
+
+        self.reschedule(i, agent, now)
+
+    def action(self, ag_states, debug=False):
+
+        _this_cycle_has_print = False
+        ra_commands = set([])
+
+        now = clock()
+        for i in self.acting():
+            was_changed = self.agents[i].act.Changed
+            result = self.agents[i]._out_proc()
+            if self.visit_out(i, result, was_changed, ra_commands, now, debug):
+                _this_cycle_has_print = True
+
+        self.end_action(ag_states)
+
+        return _this_cycle_has_print, ra_commands
+
+    async def async_action(self, ag_states, debug=False):
+        """ action() on asyncio, the agents of a layer are awaited together """
+
+        _this_cycle_has_print = False
+        ra_commands = set([])
+
+        now = clock()
+        for _, batch in itertools.groupby(
+            self.acting(), key=lambda i: self.agents[i].layer
+        ):
+            batch = list(batch)
+            was_changed = [self.agents[i].act.Changed for i in batch]
+            results = await asyncio.gather(
+                *[self.agents[i]._out_proc_async() for i in batch]
+            )
+            for k, i in enumerate(batch):
+                if self.visit_out(
+                    i, results[k], was_changed[k], ra_commands, now, debug
+                ):
+                    _this_cycle_has_print = True
+
+        self.end_action(ag_states)
+
+        return _this_cycle_has_print, ra_commands
+
+    def acting(self):
+        """ the agents to act on in this cycle, in order """
+        acting = []
+        for i in sorted(self.to_act | self.act_pending):
+            if act_due(self.agents[i], self.tick):
+                self.act_pending.discard(i)
+                acting.append(i)
+            else:
+                self.act_pending.add(i)
+        return acting
+
+    def visit_out(self, i, result, was_changed, ra_commands, now, debug):
+        """ True if the agent has something to print """
+
+        agent = self.agents[i]
+        agname = self.agnames[i]
+        status, return_message = result
+        (print_str, desc_str, in_var_str) = agent.annotate()
+
+        if str(return_message).startswith("RA_"):
+            ra_commands.add(return_message)
+
+        self.recount(self.out_counts, self.out_states, i, status[1])
+        self.sorted_ag_list[agname].update({"Status": status})
+
+        if agent.act.Changed or was_changed:
+            self.pending.add(i)
+            self.pending.update(self.dependents[i])
+
+        self.reschedule(i, agent, now)
+
+        if len(print_str) and debug:
+            logger_debug.debug(print_str)
+            return True
+        return False
+
+    def end_action(self, ag_states):
+        for state in self.out_counts:
+            ag_states[state] = ag_states.get(state, 0) + self.out_counts[state]
+
+
+def resolve_reference(reference, agent: Agent, script_globals):
+    """ the object referred to by a dotted name in a handler of agent
+
+    ag_self and self refer to the agent, ag_owner to its owner device, other
+    names are looked up in script_globals
+    """
+    root, *attrs = reference.split(".")
+    if root == "ag_owner":
+        obj = agent.owner
+    elif root in ["ag_self", "self"]:
+        obj = agent
+    else:
+        obj = script_globals[root]
+    for attr in attrs:
+        obj = getattr(obj, attr)
+    return obj
+
+
+def dependency_cache_path(script_globals):
+    """ one cache per script, next to the other compiler outputs """
+    script_name = os.path.basename(script_globals.get("__file__") or "")
+    script_name = os.path.splitext(script_name)[0] or "script"
+    return os.path.join(output_dir, script_name + ".deps.json")
+
+
+def compile_dependencies(_agents_list, script_globals, cache: DependencyCache = None):
+
+    if cache is None:
+        cache = DependencyCache()
 
     print("\n\n\nCompiling dependencies pass {}".format(1), end="...\n \n")
     for _this_ag in _agents_list:
@@ -1086,87 +1928,51 @@ def compile_dependencies(_agents_list, script_globals):
             if fn is None:
                 continue
 
-            # BUG it seems that getsource truncates lambda functions after first \n.
-            # therefore multiline lambda definitions loose dependancy information
-            source_code = inspect.getsource(fn)
-
-            # exclude method name
-            source_code = re.sub("def .*:", "", source_code)
-            # exclude references in help texts
-            source_code = re.sub('""".*"""', "", source_code)
-            # excude what comes before lambda !!
-            source_code = re.sub(r".*lambda\s+ag_self\s*:", "", source_code)
-
-            # ag_rx = r"[\w.]+_ag"
-            # look for the push dependencies
-            for push_method_name in push_method_names + [""]:
-                ag_rx = r"[\w.]+_ag"
-                if len(push_method_name) > 0:
-                    ag_rx = ag_rx + "(?=." + push_method_name + r"\()"
-                else:
-                    ag_rx = ag_rx + "(?=\W)"
-
-                ag_rx = "(" + ag_rx + ")"
-                dum = re.findall(ag_rx, source_code)
-
-                if not dum:
-                    continue
-
-                # resolve ag_owner and ag_self first to the full name of the agent...
-                # these codewords are used when agent methods are bound to devices,
-                # so self resolves to the owner device instead of the agent.
-                # proper solution is to assert aht self resloves to...but that would be too hard
-                # for now... I am adding another convention which works in any case:
-                # refer to agent seklf as ag_self and to owner device as ag_owner!
-                #
-
-                dum = [
-                    re.sub("ag_owner.", _this_ag_obj.owner_name + ".", _dum)
-                    for _dum in dum
-                ]
-                # dum = [re.sub('self.', _this_ag_obj.owner_name + '.', _dum) for _dum in dum]
-
-                dum = [
-                    re.sub("ag_self.", _this_ag_obj.name + ".", _dum) for _dum in dum
-                ]
-
-                # resolve self. to the full name of the agent...
-                dum = [re.sub("self.", _this_ag_obj.name + ".", _dum) for _dum in dum]
-
-                # this would work in g namespace!
+            found = cache.references(fn) if hasattr(fn, "__code__") else None
+            if found is None:
+                print(
+                    myEsc.WARNING
+                    + "no source for {} of {} - dependencies will be ignored -".format(
+                        method_name, _this_ag_fullname
+                    ),
+                    end=myEsc.END + "\n",
+                )
+                continue
+            references, pushes = found
 
-                dum = list(map(pythonise_ag_name, dum))
-                _depreag_names = []
-                for _dum in dum:
+            # pushes are references too, so they are compiled both ways
+            for is_push, _references in [(True, pushes), (False, references)]:
+                _depreag_list = set()  # type: Set[Tuple[str, Agent]]
+                for reference in _references:
                     try:
-                        _depreag_names.append(eval(_dum + ".name", script_globals))
-                        # _depreag_names = [eval(_dum+'.name', script_globals) for _dum in dum]  # type: List[str]
-                    except NameError:
-                        # error_message = str(sys.exc_info()[0])
+                        _depreag = resolve_reference(
+                            reference, _this_ag_obj, script_globals
+                        )
+                    except (KeyError, AttributeError):
+                        _depreag = None
+                    if not hasattr(_depreag, "dmAgentType"):
                         print(
                             myEsc.WARNING
-                            + "*_ag name without literal declaration (e.g. in comments) - dependency will be ignored -"
+                            + "{} is not an agent - dependency will be ignored -".format(
+                                reference
+                            ),
+                            end=myEsc.END + "\n",
                         )
+                        continue
+                    _depreag_list.add((_depreag.name, _depreag))
 
-                # remove duplicates
-                _depreag_names = list(set(_depreag_names))
-                _depreag_list = [
-                    (_ag_name, eval(_ag_name, script_globals))
-                    for _ag_name in _depreag_names
-                ]  # type: List[Tuple[str, Agent]]
+                if not _depreag_list:
+                    continue
 
                 line_str = "{0}\t{1} {2} \t ({3})"
 
-                if push_method_name:
-                    dep_str = push_method_name + " ->"
+                if is_push:
+                    dep_str = "push ->"
                     if not method_name.startswith("act_"):
-                        # err_str = myEsc.WARNING + '"push method" in none act_ method'
                         err_str = myEsc.SILENT_WARNING
-                        # but ignore it
-                        # exit(1)
                     else:
                         err_str = ""
-                    _this_ag_obj.depend_ags.update(set(_depreag_list))
+                    _this_ag_obj.depend_ags.update(_depreag_list)
                     # now push this agent to precedents list of the dependents as well.
                     # at a very low cost, each agent will have both its deps and pres listed.
                     for _depreag in _depreag_list:
@@ -1176,23 +1982,32 @@ def compile_dependencies(_agents_list, script_globals):
                     dep_str = "reference" + " <-"
 
                     if not method_name.startswith("poll_in"[0:3]):
-                        # err_str = myEsc.WARNING + 'reference in an action method:' + '\n'
                         err_str = myEsc.SILENT_WARNING
                     else:
                         err_str = ""
-                        _this_ag_obj.infer_ags.update(set(_depreag_list))
+                        _this_ag_obj.infer_ags.update(_depreag_list)
 
-                    _this_ag_obj.preced_ags.update(set(_depreag_list))
+                    _this_ag_obj.preced_ags.update(_depreag_list)
                     for _depreag in _depreag_list:
                         _depreag_obj = _depreag[1]
                         _depreag_obj.depend_ags.add(_this_ag)
-                if len(_depreag_names) > 0:
-                    print(
-                        line_str.format(err_str, dep_str, _depreag_names, method_name),
-                        end=myEsc.END + "\n",
-                    )
-                else:
-                    pass
+
+                print(
+                    line_str.format(
+                        err_str,
+                        dep_str,
+                        sorted(_depreag[0] for _depreag in _depreag_list),
+                        method_name,
+                    ),
+                    end=myEsc.END + "\n",
+                )
+
+    cache.save()
+    print(
+        "dependency cache: {} handlers reused, {} analysed".format(
+            cache.hits, cache.misses
+        )
+    )
 
     # clean up duplicates listed under agents
     print("\n----------------\n\n", "Compiling dependencies pass 2", end="...\n \n")
@@ -1253,40 +2068,55 @@ def compile_dependencies(_agents_list, script_globals):
         end="...\n \n",
     )
 
-    lc = 0
-    lc_max = len(_agents_list)
-    layer_updated = True
-    while layer_updated and lc < lc_max:
-        lc += 1
-        layer_updated = False
-        for _this_ag in _agents_list:
-            _this_ag_obj = _this_ag[1]
-            _this_ag_fullname = _this_ag_obj.name
-
-            if _this_ag_obj.layer is None:
-                _this_ag_obj.layer = 0
-
-            for _this_ag_infers in _this_ag_obj.infer_ags:
-                pre_layer = _this_ag_infers[1].layer if _this_ag_infers[1].layer else 0
-                if _this_ag_obj.layer < pre_layer + 1:
-                    layer_updated = True
-                    _this_ag_obj.layer = pre_layer + 1
-                    print("", end=".")
-
-    if layer_updated:
-        raise RuntimeError(
-            "Failed to compile dependency.\nMax iteration reached while layer stats is not complete.\nPossible circular dependency."
-        )
-    else:
-        print(
-            "\n",
-            myEsc.SUCCESS + "\n ========================\n",
-            "Dependency map compiled",
-            end=".\n ======================== \n\n\n" + myEsc.END,
-        )
+    try:
+        partition = layer_partition(_this_ag[1] for _this_ag in _agents_list)
+    except CircularDependency as e:
+        print(myEsc.ERROR + str(e), end=myEsc.END + "\n")
+        raise
 
+    print(
+        "\n",
+        myEsc.SUCCESS + "\n ========================\n",
+        "Dependency map compiled, {} layers".format(len(partition)),
+        end=".\n ======================== \n\n\n" + myEsc.END,
+    )
+    return partition
 
-def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
+
+def device_agent_members(device):
+    """ (name, value) of the *_ag attributes of a device, sorted by name
+
+    Only the *_ag names of the instance and its classes are looked up, rather than
+    every member as inspect.getmembers would
+    """
+    _names = set(getattr(device, "__dict__", {}))
+    for _cls in type(device).__mro__:
+        _names.update(vars(_cls))
+    return [
+        (_name, getattr(device, _name))
+        for _name in sorted(_names)
+        if _name.endswith("_ag") and hasattr(device, _name)
+    ]
+
+
+def compile_n_install(
+    initial_dict_of_agents,
+    script_globals,
+    eprefix=None,
+    dependency_cache=True,
+    timings: dict = None,
+    pv_timeout=5.0,
+):
+    """ finds the agents in script_globals, compiles their dependencies and installs them
+
+    dependency_cache: keep the references found in the handlers in ra_out/<script>.deps.json,
+        so unchanged handlers are not analysed again on the next start
+    timings: a dict to be filled with the time taken by each phase [s]: discovery,
+        config save, dependency compile, prep1, sort and pv connect. These are
+        printed anyway.
+    pv_timeout: wait for the connection of all new PVs at once, for up to this
+        long [s], see PVRegistry.wait_for_connections
+    """
 
     # TODO redirect stdout to file, as a quick hack to silent the compiler
     print("compiling and installing agents started ...")
@@ -1300,26 +2130,29 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
 
     print("Compiling: looking for agents in supplied framework...")
 
-    device_agent_list = []
-    main_globals = script_globals.values()
-    main_globals_list = list(main_globals)[:]
-    # now add agents defined at level 1 (not under devices)
-    for _global in main_globals_list:
-        if hasattr(_global, "dmAgentType"):
+    phase_times = OrderedDict()
+    time_0 = timer()
 
-            _global_name = retrieve_name_in_globals(_global, script_globals)
+    device_agent_list = []
+    main_globals_devices = []
+    # first name of each object, in a single pass over the globals
+    _global_names = {}
+    for _global_name, _global in list(script_globals.items()):
+        if id(_global) in _global_names:
+            continue
+        _global_names[id(_global)] = _global_name
 
+        # now add agents defined at level 1 (not under devices)
+        if hasattr(_global, "dmAgentType"):
             # this is an agent, so all of its references SHOULD end with _ag
             if (_global_name.endswith("_ag")) and ("__" not in _global_name):
-                _global_agent = [["global", (_global_name, _global)]]
-                device_agent_list.extend(_global_agent)
+                device_agent_list.append([["g", None], (_global_name, _global)])
             else:
                 raise RuntimeError(
                     f'Agent is referenced with a non-qualified name: "{_global_name}"'
                 )
-    main_globals_devices = list(
-        filter(lambda a: hasattr(a, "dmDeviceType"), main_globals_list)
-    )
+        elif hasattr(_global, "dmDeviceType"):
+            main_globals_devices.append((_global_name, _global))
 
     # now install agents under devices
     # There might be duplicate copies
@@ -1327,26 +2160,28 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
     # filter agents which doesn't have the name tag of "_ag".
 
     device_dict = {}
-    for _device in main_globals_devices:
-        _device_name = retrieve_name_in_globals(_device, script_globals)
-
+    for _device_name, _device in main_globals_devices:
         device_dict.update({_device_name: _device})
 
-        _members = inspect.getmembers(_device)
         _device_agents = [
             [[_device_name, _device], _member]
-            for _member in _members
-            if hasattr(_member[1], "dmAgentType") and str(_member[0]).endswith("_ag")
+            for _member in device_agent_members(_device)
+            if hasattr(_member[1], "dmAgentType")
         ]
         device_agent_list.extend(_device_agents)
 
+    phase_times["discovery"] = timer() - time_0
+
     print(
         "{} devices found. Saving device configurations. May take a littel while... ".format(
             len(device_dict)
         )
     )
 
+    time_0 = timer()
     save_device_configs(device_dict)
+    phase_times["config save"] = timer() - time_0
+    time_0 = timer()
 
     _dupls = [
         agent for agent in device_agent_list if not str(agent[1][0]).endswith("_ag")
@@ -1361,6 +2196,8 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
         exit(1)
 
     agents_list = []
+    # identities of the installed agents
+    _installed = set()
 
     # INSTALL agents in initial_dict_of_agents
     for dev_ag in device_agent_list:
@@ -1378,7 +2215,8 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
         print(_agName, "... ", end="")
 
         # see if this is a new ag
-        if not (_agent in [_ag[1] for _ag in agents_list]):
+        if id(_agent) not in _installed:
+            _installed.add(id(_agent))
 
             if not (_agName in initial_dict_of_agents):
                 initial_dict_of_agents.update({_agName: {}})
@@ -1425,14 +2263,40 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
             end=myEsc.END + "\n-----------------\n",
         )
 
-    compile_dependencies(agents_list, script_globals)
+    phase_times["discovery"] += timer() - time_0
+    time_0 = timer()
+
+    partition = compile_dependencies(
+        agents_list,
+        script_globals,
+        cache=DependencyCache(
+            dependency_cache_path(script_globals) if dependency_cache else None
+        ),
+    )
+    phase_times["dependency compile"] = timer() - time_0
+    time_0 = timer()
 
     # configure items using input files ...
     prep1(initial_dict_of_agents, eprefix=eprefix)
+    phase_times["prep1"] = timer() - time_0
+    time_0 = timer()
 
-    agents_sorted_by_layer = OrderedDict(
-        sorted(initial_dict_of_agents.items(), key=lambda ag: ag[1]["layer"])
+    _agnames = {id(_agent): _agName for _agName, _agent in agents_list}
+    _layers = [[_agnames[id(_agent)] for _agent in _layer] for _layer in partition]
+    agents_sorted_by_layer = AgentsByLayer(
+        (
+            (_agName, initial_dict_of_agents[_agName])
+            for _layer in _layers
+            for _agName in _layer
+        ),
+        layers=_layers,
     )  # type: OrderedDict[str, dict]
+    phase_times["sort"] = timer() - time_0
+    time_0 = timer()
+
+    not_connected = pv_registry.wait_for_connections(timeout=pv_timeout)
+    phase_times["pv connect"] = timer() - time_0
+    print(pv_registry.report_str())
 
     print("Agents listed by layer:")
     for _ag in agents_sorted_by_layer:
@@ -1443,6 +2307,14 @@ def compile_n_install(initial_dict_of_agents, script_globals, eprefix=None):
     log.close
 
     print("compiling and installing agents done.")
+    print(
+        "{} agents, ".format(len(agents_sorted_by_layer))
+        + ", ".join("{} {:.3f}s".format(*_phase) for _phase in phase_times.items())
+    )
+    if not_connected:
+        print("{} PVs not connected: {}".format(len(not_connected), not_connected))
+    if timings is not None:
+        timings.update(phase_times)
 
     return agents_sorted_by_layer
 
@@ -1488,26 +2360,140 @@ def process_ra_command(ra_commands: list):
         return not break_ra_loop
 
 
-def process_loop(agents_sorted_by_layer, n_loop=1000000, cycle_period=0.5, debug=False):
+def agents_active(sorted_ag_list, ag_states, store=None, active_set=None):
+    """ True if any agent changed or was Armed in the last cycle. Armed includes
+    agents waiting out their wait_after_celeb window
+    """
+    if ag_states.get(StateNames.Armed):
+        return True
+    if active_set is not None:
+        # changes and running countdowns leave agents pending
+        return bool(active_set.pending or active_set.act_pending)
+    if store is not None:
+        return bool(store.poll.Changed.any() or store.act.Changed.any())
+    return any(
+        _agdict["agent"].poll.Changed or _agdict["agent"].act.Changed
+        for _agdict in sorted_ag_list.values()
+    )
 
-    i = 0
-    all_ra_commands = set([])
-    time_0 = timer()
-    next_infer_time = time_0 + cycle_period
-    # process loop
-    print("\n\n\nProcess loop is running...")
 
-    f = open(os.path.join(html_out_path, html_out_filename), "w")
+def make_adaptive_period(cycle_period, min_period, max_period):
+    if max_period is None:
+        return None
+    return AdaptivePeriod(
+        cycle_period if min_period is None else min_period, max_period
+    )
+
 
-    while i < n_loop and "RA_QUIT" not in all_ra_commands:
-        i += 1
-        # this will skip the past samples and prevents fast samples in case of
-        # holding
-        while next_infer_time < timer():
-            next_infer_time += cycle_period
-        next_act_time = next_infer_time + cycle_period / 5
+def add_read_pvs(sorted_ag_list):
+    """ the read_pvs of the agents, to the prefetcher """
+    for _agdict in sorted_ag_list.values():
+        for pv in agent_pvs(_agdict["agent"], _agdict["agent"].read_pvs or []):
+            if pv is not None:
+                prefetcher.add(pv)
+
+
+def start_status_writer(html_refresh):
+    """ background writer of the poll vars page, None if nobody reads it """
+    if not html_refresh:
+        return None
+    return StatusWriter(
+        os.path.join(html_out_path, html_out_filename), VarsTable, html_refresh
+    ).start()
+
+
+class LoopContext:
+    """ what process_loop and async_process_loop set up around the cycles of the
+    agents: the time source, the cycle timer, the active set, the profiler, the
+    recorder, the prefetcher and the status page. See process_loop for the
+    options. Each cycle is begin_cycle, inference_phase, action_phase and
+    end_cycle, and close takes it all down again.
+
+    real_clock: clock of the cycles when there is no time_source
+    """
+
+    def __init__(
+        self,
+        agents_sorted_by_layer,
+        cycle_period=0.5,
+        event_driven=False,
+        n_workers=0,
+        overrun_policy=OverrunPolicy.Skip,
+        act_delay=None,
+        cycle_timer: CycleTimer = None,
+        profile=False,
+        profiler: AgentProfiler = None,
+        html_refresh=1.0,
+        store=None,
+        min_period=None,
+        max_period=None,
+        time_source=None,
+        recorder=None,
+        defer_puts=False,
+        prefetch=False,
+        prefetch_early=False,
+        real_clock=None,
+    ):
+        self.agents_sorted_by_layer = agents_sorted_by_layer
+        self.store = store
+        self.time_source = time_source
+        self.recorder = recorder
+        self.defer_puts = defer_puts
+        self.prefetch = prefetch and not recorder
+        self.prefetch_early = prefetch_early
+
+        self.active_set = ActiveSet(agents_sorted_by_layer) if event_driven else None
+        self.executor = LayerExecutor(max_workers=n_workers) if n_workers > 0 else None
+        self.real_source = clock.source
+        if time_source is not None:
+            clock.source = time_source
+
+        if cycle_timer is None and time_source is not None:
+            cycle_timer = CycleTimer(
+                cycle_period,
+                act_delay=act_delay,
+                overrun_policy=overrun_policy,
+                spin=0,
+                clock=time_source,
+                sleep=time_source.sleep,
+            )
+        elif cycle_timer is None:
+            cycle_timer = CycleTimer(
+                cycle_period,
+                act_delay=act_delay,
+                overrun_policy=overrun_policy,
+                clock=real_clock or time.monotonic,
+            )
+        self.cycle_timer = cycle_timer
+        self.adaptive_period = make_adaptive_period(
+            cycle_period, min_period, max_period
+        )
+        if self.adaptive_period:
+            cycle_timer.set_period(self.adaptive_period.period)
+
+        if profile and profiler is None:
+            profiler = AgentProfiler()
+        self.profiler = profiler
+        if profiler:
+            profiler.attach(
+                _agdict["agent"] for _agdict in agents_sorted_by_layer.values()
+            )
+
+        if recorder:
+            recorder.attach(agents_sorted_by_layer, clock, active_set=self.active_set)
+
+        if self.prefetch:
+            add_read_pvs(agents_sorted_by_layer)
+
+        self.time_0 = cycle_timer.clock()
+        self.status_writer = start_status_writer(html_refresh)
 
-        state_record = {
+    def begin_cycle(self, i):
+        """ the state record of cycle i """
+        if self.recorder:
+            self.recorder.begin_cycle(i)
+
+        return {
             StateNames.Invalid: 0,
             StateNames.Idle: 0,
             StateNames.Armed: 0,
@@ -1515,45 +2501,491 @@ def process_loop(agents_sorted_by_layer, n_loop=1000000, cycle_period=0.5, debug
             StateNames.Inhibited: 0,
         }
 
-        while timer() < next_infer_time:
-            time.sleep(0.02)
-
-        run_time = timer() - time_0
-
-        # INFERENCE: loop through the agents, poll.force vals and update GState but NOT the actions
-        poll_print, ra_commands, polls_var_list = inference(
-            agents_sorted_by_layer, state_record, debug=debug
-        )
-        all_ra_commands.update(ra_commands)
-        process_ra_command(all_ra_commands)
-
-        table = VarsTable(polls_var_list)
-        # this print is equivalent of what logger_debug would do wit additional stdout handler added
-        # print_list = [item['name']+' '+item['description'] for item in polls_var_list if item['description'].startswith('*')]
-        # print(*print_list, sep='\n')
-        f = open(os.path.join(html_out_path, html_out_filename), "w+")
-        f.write(table.__html__())
-        f.close()
-
-        while timer() < next_act_time:
-            time.sleep(0.02)
-        # ACTIONS: loop through the agents,
-        act_print, ra_commands = action(
-            agents_sorted_by_layer, state_record, debug=debug
-        )
-        all_ra_commands.update(ra_commands)
-        process_ra_command(all_ra_commands)
+    @contextlib.contextmanager
+    def inference_phase(self):
+        put_queue.deliver()
+        clock.begin_phase()
+        if self.prefetch:
+            prefetcher.begin()
+        try:
+            yield
+        finally:
+            if self.prefetch:
+                prefetcher.end()
+        clock.end_phase()
+        self.cycle_timer.end_inference()
+
+    def update_status(self, polls_var_list):
+        if self.status_writer:
+            self.status_writer.update(polls_var_list)
+
+    @contextlib.contextmanager
+    def action_phase(self):
+        clock.begin_phase()
+        if self.defer_puts:
+            put_queue.begin()
+        try:
+            yield
+        finally:
+            if self.defer_puts:
+                put_queue.end()
+        clock.end_phase()
+        if self.prefetch and self.prefetch_early:
+            prefetcher.issue()
+        self.cycle_timer.end_action()
+
+    def end_cycle(
+        self, i, state_record, run_time, has_print, debug=False, profile_every=0
+    ):
+        if self.recorder:
+            self.recorder.end_cycle(self.agents_sorted_by_layer)
+
+        if self.adaptive_period:
+            active = agents_active(
+                self.agents_sorted_by_layer,
+                state_record,
+                store=self.store,
+                active_set=self.active_set,
+            )
+            self.cycle_timer.set_period(self.adaptive_period.update(active))
 
-        if poll_print or act_print:
+        if has_print:
             if debug:
                 print("states = {}".format(state_record))
+                if self.executor:
+                    print(*self.executor.report(), sep="\n")
+                print(self.cycle_timer.report_str())
             print(
-                "end of cycle {}, {:.3f}s, average lag={:.3f}s".format(
-                    i, run_time, run_time / i - cycle_period
+                "end of cycle {}, {:.3f}s, jitter={:.6f}s, overruns={}".format(
+                    i,
+                    run_time,
+                    self.cycle_timer.cycle_start - self.cycle_timer.deadline,
+                    self.cycle_timer.overruns,
                 ),
                 end="\n ====================================== \n",
             )
 
+        if self.profiler and profile_every > 0 and i % profile_every == 0:
+            print(self.profiler.report_str())
+
+    def close(self):
+        if self.active_set:
+            self.active_set.close()
+        if self.executor:
+            self.executor.shutdown()
+        if self.profiler:
+            self.profiler.detach()
+        if self.status_writer:
+            self.status_writer.stop()
+        if self.recorder:
+            self.recorder.detach()
+        clock.source = self.real_source
+
+
+def process_loop(
+    agents_sorted_by_layer,
+    n_loop=1000000,
+    cycle_period=0.5,
+    debug=False,
+    event_driven=False,
+    n_workers=0,
+    overrun_policy=OverrunPolicy.Skip,
+    act_delay=None,
+    cycle_timer: CycleTimer = None,
+    profile=False,
+    profile_every=0,
+    profiler: AgentProfiler = None,
+    html_refresh=1.0,
+    store=None,
+    min_period=None,
+    max_period=None,
+    time_source=None,
+    recorder=None,
+    defer_puts=False,
+    prefetch=False,
+    prefetch_early=False,
+):
+    """ runs the inference-action cycles
+
+    Each cycle is a base tick of cycle_period, agents with a poll_period or an
+    act_period of n are only polled or acted on every n ticks, see poll_due.
+
+    event_driven: only visit the agents which are due, see ActiveSet
+    n_workers: if > 0, run the inference of each layer on a thread pool of this size,
+        see LayerExecutor
+    overrun_policy: what to do with late cycles, see OverrunPolicy
+    act_delay: delay of the action phase from the start of cycle, default cycle_period/5
+    cycle_timer: pass a CycleTimer to query the timing statistics while running
+    profile: time the handlers of every agent, see AgentProfiler
+    profile_every: if > 0, print the top handlers every this many cycles
+    profiler: pass an AgentProfiler to profile and query it while running
+    html_refresh: period of the status page updates [s], None to not write it
+    store: a reactive_store.StateStore made from agents_sorted_by_layer, to do the
+        hold countdown and state tally on arrays. Not used if event_driven
+    max_period: if given, the period adapts to the agents, see AdaptivePeriod:
+        min_period (default cycle_period) while any agent changes or is Armed,
+        stretching up to max_period while they are all quiet.
+        Periods of multi-rate agents are in cycles, so they stretch too.
+    time_source: clock with a sleep method, e.g. a VirtualClock, to run the cycles
+        and the agents on instead of real time. The agents read clock, which is
+        frozen at the start of each phase
+    recorder: a reactive_replay.Recorder to log the inputs and state transitions
+        of the agents, or a Replayer to run them on a log, see reactive_replay
+    defer_puts: send the PV puts the agents make with put_pv in each action phase
+        together at its end, and call their completion callbacks in the next
+        cycle, see PutQueue
+    prefetch: read the PVs which the agents read with get_pv, given in their
+        read_pvs or learned on the way, all at once before each inference, see
+        Prefetcher. Not used with a recorder
+    prefetch_early: send the prefetch gets at the end of the action phase, so they
+        are in by the next inference, at the cost of older values
+    """
+
+    loop = LoopContext(
+        agents_sorted_by_layer,
+        cycle_period=cycle_period,
+        event_driven=event_driven,
+        n_workers=n_workers,
+        overrun_policy=overrun_policy,
+        act_delay=act_delay,
+        cycle_timer=cycle_timer,
+        profile=profile,
+        profiler=profiler,
+        html_refresh=html_refresh,
+        store=store,
+        min_period=min_period,
+        max_period=max_period,
+        time_source=time_source,
+        recorder=recorder,
+        defer_puts=defer_puts,
+        prefetch=prefetch,
+        prefetch_early=prefetch_early,
+    )
+    active_set = loop.active_set
+    cycle_timer = loop.cycle_timer
+
+    i = 0
+    all_ra_commands = set([])
+    # process loop
+    print("\n\n\nProcess loop is running...")
+
+    try:
+        while i < n_loop and "RA_QUIT" not in all_ra_commands:
+            i += 1
+            state_record = loop.begin_cycle(i)
+
+            run_time = cycle_timer.wait_infer() - loop.time_0
+
+            # INFERENCE: loop through the agents, poll.force vals and update GState but NOT the actions
+            with loop.inference_phase():
+                if active_set:
+                    poll_print, ra_commands, polls_var_list = active_set.inference(
+                        state_record, debug=debug, executor=loop.executor
+                    )
+                else:
+                    poll_print, ra_commands, polls_var_list = inference(
+                        agents_sorted_by_layer,
+                        state_record,
+                        debug=debug,
+                        executor=loop.executor,
+                        store=store,
+                        tick=i - 1,
+                    )
+            all_ra_commands.update(ra_commands)
+            process_ra_command(all_ra_commands)
+
+            loop.update_status(polls_var_list)
+
+            cycle_timer.wait_act()
+            # ACTIONS: loop through the agents,
+            with loop.action_phase():
+                if active_set:
+                    act_print, ra_commands = active_set.action(
+                        state_record, debug=debug
+                    )
+                else:
+                    act_print, ra_commands = action(
+                        agents_sorted_by_layer,
+                        state_record,
+                        debug=debug,
+                        store=store,
+                        tick=i - 1,
+                    )
+            all_ra_commands.update(ra_commands)
+            process_ra_command(all_ra_commands)
+
+            loop.end_cycle(
+                i,
+                state_record,
+                run_time,
+                poll_print or act_print,
+                debug=debug,
+                profile_every=profile_every,
+            )
+    finally:
+        # a handler may raise, don't leave the monitors, threads and clock behind
+        loop.close()
+
+    print("Reactive Agent process loop terminated. \n ==============================\n")
+
+
+async def async_inference(
+    sorted_ag_list, ag_states, debug=False, store=None, tick=None
+):
+    """ inference() on asyncio: the agents of each layer are awaited concurrently,
+    with a barrier between the layers """
+
+    polls_var_list = []
+
+    ra_commands = set([])
+    _this_cycle_has_print = False
+    ag_states[StateNames.Valid] = 0
+    ag_states[StateNames.Invalid] = 0
+
+    if store is not None:
+        store.begin_inference()
+
+    for agnames in layer_groups(sorted_ag_list):
+
+        agents = [sorted_ag_list[agname]["agent"] for agname in agnames]
+        for agent in agents:
+            # install a copy of agents list on each agent ONCE
+            if not agent.agent_list:
+                agent.agent_list = sorted_ag_list
+
+        rows = [store.index[agname] for agname in agnames] if store else None
+        due = [poll_due(agent, tick) for agent in agents]
+        # decided before the layer is awaited, as with an executor
+        held = [store.is_held(i) for i in rows] if store else [False] * len(agents)
+        results = await asyncio.gather(
+            *[
+                agent._in_proc_async()
+                for agent, on_hold, is_due in zip(agents, held, due)
+                if is_due and not on_hold
+            ]
+        )
+        results = iter(results)
+
+        for k, agname in enumerate(agnames):
+            agent = agents[k]  # type: Agent
+            if not due[k]:
+                if agent.verbose > 0 and "var_row" in sorted_ag_list[agname]:
+                    polls_var_list.append(sorted_ag_list[agname]["var_row"])
+                if store is None and "Status" in sorted_ag_list[agname]:
+                    ag_states[sorted_ag_list[agname]["Status"][0]] += 1
+                continue
+
+            if held[k]:
+                status, return_message = store.held_in_proc(rows[k], agent)
+            else:
+                status, return_message = next(results)
+            (print_str, desc_str, in_var_str) = agent.annotate()
+
+            if str(return_message).startswith("RA_"):
+                # this is a RA command:
+                ra_commands.add(return_message)
+
+            if agent.verbose > 0:
+                var_row = dict(name=agname, description=desc_str)
+                sorted_ag_list[agname]["var_row"] = var_row
+                polls_var_list.append(var_row)
+
+            if store is not None:
+                store.set_in_state(rows[k], status[0])
+            else:
+                ag_states[status[0]] += 1
+            sorted_ag_list[agname].update({"Status": status})
+
+            sorted_ag_list[agname].update({"var_str": in_var_str})
+
+    if store is not None:
+        store.end_inference(ag_states)
+
+    return _this_cycle_has_print, ra_commands, polls_var_list
+
+
+async def async_action(sorted_ag_list, ag_states, debug=False, store=None, tick=None):
+    """ action() on asyncio: same layer agents don't depend on each other,
+    so their actions are awaited concurrently, layer by layer """
+
+    logger = logger_debug if debug else logger_default
+
+    _this_cycle_has_print = False
+
+    ra_commands = set([])
+
+    for agnames in layer_groups(sorted_ag_list):
+
+        agents = [sorted_ag_list[agname]["agent"] for agname in agnames]
+        due = [act_due(agent, tick) for agent in agents]
+        results = await asyncio.gather(
+            *[agent._out_proc_async() for agent, is_due in zip(agents, due) if is_due]
+        )
+        results = iter(results)
+
+        for agname, agent, is_due in zip(agnames, agents, due):
+            if not is_due:
+                if store is None and "Status" in sorted_ag_list[agname]:
+                    ag_states[sorted_ag_list[agname]["Status"][1]] += 1
+                continue
+
+            status, return_message = next(results)
+            (print_str, desc_str, in_var_str) = agent.annotate()
+
+            if str(return_message).startswith("RA_"):
+                # this is a RA command:
+                ra_commands.add(return_message)
+
+            if store is not None:
+                store.set_out_state(store.index[agname], status[1])
+            else:
+                ag_states[status[1]] += 1
+            sorted_ag_list[agname].update({"Status": status})
+
+            if len(print_str):
+                if debug:
+                    logger.debug(print_str)
+                    _this_cycle_has_print = True
+
+    if store is not None:
+        store.end_action(ag_states)
+
+    return _this_cycle_has_print, ra_commands
+
+
+async def async_process_loop(
+    agents_sorted_by_layer,
+    n_loop=1000000,
+    cycle_period=0.5,
+    debug=False,
+    event_driven=False,
+    overrun_policy=OverrunPolicy.Skip,
+    act_delay=None,
+    cycle_timer: CycleTimer = None,
+    profile=False,
+    profile_every=0,
+    profiler: AgentProfiler = None,
+    html_refresh=1.0,
+    store=None,
+    min_period=None,
+    max_period=None,
+    time_source=None,
+    recorder=None,
+    defer_puts=False,
+    prefetch=False,
+    prefetch_early=False,
+):
+    """ process_loop on asyncio
+
+    poll_in, poll_pr and act_on_* handlers may be plain functions or async def.
+    Inference and action phases are kept, but handlers of the same layer overlap.
+    Cycles are scheduled on the event loop's monotonic clock, so other tasks
+    keep running while the loop waits for the next cycle:
+
+        asyncio.run(ra.async_process_loop(agents_sorted_by_layer, cycle_period=0.2))
+
+    The options are those of process_loop, less n_workers as the layers overlap
+    anyway. On a time_source, the waits for the cycles move it on at once and
+    only yield to the other tasks. Profiled handlers are timed from their start
+    to their end, including the other tasks run while they await.
+    """
+
+    loop = LoopContext(
+        agents_sorted_by_layer,
+        cycle_period=cycle_period,
+        event_driven=event_driven,
+        overrun_policy=overrun_policy,
+        act_delay=act_delay,
+        cycle_timer=cycle_timer,
+        profile=profile,
+        profiler=profiler,
+        html_refresh=html_refresh,
+        store=store,
+        min_period=min_period,
+        max_period=max_period,
+        time_source=time_source,
+        recorder=recorder,
+        defer_puts=defer_puts,
+        prefetch=prefetch,
+        prefetch_early=prefetch_early,
+        real_clock=asyncio.get_running_loop().time,
+    )
+    active_set = loop.active_set
+    cycle_timer = loop.cycle_timer
+
+    async def sleep(seconds):
+        if time_source is not None:
+            time_source.sleep(seconds)
+            seconds = 0
+        await asyncio.sleep(seconds)
+
+    i = 0
+    all_ra_commands = set([])
+    # process loop
+    print("\n\n\nProcess loop is running (asyncio)...")
+
+    try:
+        while i < n_loop and "RA_QUIT" not in all_ra_commands:
+            i += 1
+            state_record = loop.begin_cycle(i)
+
+            await sleep(cycle_timer.infer_deadline() - cycle_timer.clock())
+
+            run_time = cycle_timer.started() - loop.time_0
+
+            # INFERENCE: loop through the agents, poll.force vals and update GState but NOT the actions
+            with loop.inference_phase():
+                if active_set:
+                    (
+                        poll_print,
+                        ra_commands,
+                        polls_var_list,
+                    ) = await active_set.async_inference(state_record, debug=debug)
+                else:
+                    poll_print, ra_commands, polls_var_list = await async_inference(
+                        agents_sorted_by_layer,
+                        state_record,
+                        debug=debug,
+                        store=store,
+                        tick=i - 1,
+                    )
+            all_ra_commands.update(ra_commands)
+            process_ra_command(all_ra_commands)
+
+            loop.update_status(polls_var_list)
+
+            await sleep(cycle_timer.act_lead_time())
+            cycle_timer.act_started()
+
+            # ACTIONS: loop through the agents,
+            with loop.action_phase():
+                if active_set:
+                    act_print, ra_commands = await active_set.async_action(
+                        state_record, debug=debug
+                    )
+                else:
+                    act_print, ra_commands = await async_action(
+                        agents_sorted_by_layer,
+                        state_record,
+                        debug=debug,
+                        store=store,
+                        tick=i - 1,
+                    )
+            all_ra_commands.update(ra_commands)
+            process_ra_command(all_ra_commands)
+
+            loop.end_cycle(
+                i,
+                state_record,
+                run_time,
+                poll_print or act_print,
+                debug=debug,
+                profile_every=profile_every,
+            )
+    finally:
+        # a handler may raise, don't leave the monitors, threads and clock behind
+        loop.close()
+
     print("Reactive Agent process loop terminated. \n ==============================\n")
 
 
@@ -1561,6 +2993,7 @@ def process_loop(agents_sorted_by_layer, n_loop=1000000, cycle_period=0.5, debug
 
 # Simple PV mapping agents:
 def get_in_pv(self: Agent):
+    # monitored PVs hold the value of their last update, no CA get here
     _in = self.in_PV.value
     return _in, ""
 
@@ -1568,12 +3001,12 @@ def get_in_pv(self: Agent):
 def put_out_pv(self: Agent):
     # mind this: pvc will not be invoked for process every cycle.
     if self.out_PV.value != self.poll.Var:
-        self.out_PV.put(self.poll.Var)
+        self.put_pv(self.out_PV, self.poll.Var)
     return StateLogics.Done, ""
 
 
 def reset_out_pv(self: Agent):
-    self.out_PV.value = 0
+    self.put_pv(self.out_PV, 0)
     return StateLogics.Idle, ""
 
 
@@ -0,0 +1,384 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_deps.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# dependency extraction from the agent handlers
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+""" agent references in the handlers, found on their syntax tree
+
+A reference is an attribute chain ending with an *_ag name, e.g. ag_self.x_ag or
+dev.pos_ag, and a push is a reference followed by one of the push methods, e.g.
+ag_self.x_ag.poll.force(...). Chains in comments, strings and docstrings are not
+code and are not picked up. Lambdas are found in the syntax tree of their module,
+so multiline lambdas keep all of their references.
+
+The references of each handler are cached on disk, keyed by the hash of the
+handler source, so unchanged handlers are not parsed again on the next start.
+
+layer_partition works out the layers of the compiled agents from their infer_ags,
+in linear time, and names the agents of any dependency cycle.
+"""
+
+import ast
+import dis
+import hashlib
+import inspect
+import json
+import linecache
+import os
+import textwrap
+
+push_methods = [
+    ("poll", "force"),
+    ("poll", "unhold"),
+    ("poll", "hold"),
+    ("act", "hold"),
+    ("act", "unhold"),
+]
+
+cache_version = 1
+
+
+def last_line(code):
+    """ last source line of a code object, including its nested functions """
+    lines = [line for _, line in dis.findlinestarts(code) if line]
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            lines.append(last_line(const))
+    return max(lines, default=code.co_firstlineno)
+
+
+def handler_source(fn):
+    """ source lines spanned by the handler, None if they are not available """
+    code = fn.__code__
+    lines = linecache.getlines(code.co_filename)
+    if not lines:
+        return None
+    return "".join(lines[code.co_firstlineno - 1 : last_line(code)])
+
+
+def handler_key(fn, source):
+    # names tell apart lambdas sharing the same lines
+    code = fn.__code__
+    text = "\0".join([source, code.co_name] + list(code.co_names))
+    return hashlib.sha1(text.encode()).hexdigest()
+
+
+def attribute_chain(node):
+    """ ['a', 'b', 'c'] for a.b.c, None if the chain doesn't start with a name """
+    chain = []
+    while isinstance(node, ast.Attribute):
+        chain.append(node.attr)
+        node = node.value
+    if not isinstance(node, ast.Name):
+        return None
+    chain.append(node.id)
+    return chain[::-1]
+
+
+def ag_prefix(chain):
+    """ the chain up to its last *_ag name """
+    for k in range(len(chain), 0, -1):
+        if chain[k - 1].endswith("_ag"):
+            return chain[:k]
+    return None
+
+
+def node_references(node):
+    """ (references, pushes) of a syntax tree, as sorted lists of dotted names """
+
+    inner = set()
+    for _node in ast.walk(node):
+        if isinstance(_node, ast.Attribute):
+            inner.add(id(_node.value))
+
+    references = set()
+    pushes = set()
+    for _node in ast.walk(node):
+        if isinstance(_node, (ast.Attribute, ast.Name)) and id(_node) not in inner:
+            chain = attribute_chain(_node)
+            prefix = ag_prefix(chain) if chain else None
+            if prefix:
+                references.add(".".join(prefix))
+
+        if isinstance(_node, ast.Call):
+            chain = attribute_chain(_node.func)
+            if (
+                chain
+                and len(chain) > 2
+                and tuple(chain[-2:]) in push_methods
+                and chain[-3].endswith("_ag")
+            ):
+                pushes.add(".".join(chain[:-2]))
+
+    return sorted(references), sorted(pushes)
+
+
+class ModuleTrees:
+    """ parses each source file once, on demand """
+
+    def __init__(self):
+        self.trees = {}
+
+    def get(self, filename):
+        if filename not in self.trees:
+            try:
+                self.trees[filename] = ast.parse("".join(linecache.getlines(filename)))
+            except (SyntaxError, ValueError):
+                self.trees[filename] = None
+        return self.trees[filename]
+
+
+def first_line(node):
+    decorators = getattr(node, "decorator_list", [])
+    return min([node.lineno] + [decorator.lineno for decorator in decorators])
+
+
+def same_names(node, code):
+    """ True if node compiles to code with the same names, to tell lambdas apart """
+    try:
+        expression = ast.fix_missing_locations(ast.Expression(body=node))
+        compiled = compile(expression, code.co_filename, "eval")
+    except (SyntaxError, ValueError, TypeError):
+        return False
+    nested = [const for const in compiled.co_consts if inspect.iscode(const)]
+    return bool(nested) and nested[0].co_names == code.co_names
+
+
+def handler_node(fn, module_trees: ModuleTrees):
+    """ syntax tree of the handler, None if its source can't be found """
+
+    code = fn.__code__
+    tree = module_trees.get(code.co_filename)
+    if tree is not None:
+        kinds = (ast.Lambda,) if code.co_name == "<lambda>" else (
+            ast.FunctionDef,
+            ast.AsyncFunctionDef,
+        )
+        candidates = [
+            node
+            for node in ast.walk(tree)
+            if isinstance(node, kinds) and first_line(node) == code.co_firstlineno
+        ]
+        if len(candidates) > 1:
+            candidates = [
+                node for node in candidates if same_names(node, code)
+            ] or candidates
+        if candidates:
+            return candidates[0]
+
+    # e.g. handlers defined in an exec'd string: getsource may still work
+    try:
+        return ast.parse(textwrap.dedent(inspect.getsource(fn)))
+    except (OSError, TypeError, SyntaxError):
+        return None
+
+
+class DependencyCache:
+    """ references of the handlers by their source hash, kept in a json file
+
+    path: None to keep the cache in memory only
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.handlers = {}
+        self.used = set()
+        self.changed = False
+        self.module_trees = ModuleTrees()
+        self.hits = 0
+        self.misses = 0
+
+        if path and os.path.exists(path):
+            try:
+                with open(path) as f:
+                    stored = json.load(f)
+                if stored.get("version") == cache_version:
+                    self.handlers = stored["handlers"]
+            except (OSError, ValueError, KeyError):
+                self.handlers = {}
+
+    def references(self, fn):
+        """ (references, pushes) of fn, None if its source is not available """
+
+        source = handler_source(fn)
+        key = handler_key(fn, source) if source is not None else None
+
+        if key in self.handlers:
+            self.hits += 1
+            self.used.add(key)
+            entry = self.handlers[key]
+            return entry["references"], entry["pushes"]
+
+        self.misses += 1
+        node = handler_node(fn, self.module_trees)
+        if node is None:
+            return None
+
+        references, pushes = node_references(node)
+        if key is not None:
+            self.handlers[key] = dict(
+                name=fn.__qualname__, references=references, pushes=pushes
+            )
+            self.used.add(key)
+            self.changed = True
+        return references, pushes
+
+    def save(self):
+        """ writes the handlers used in this compile, if anything changed """
+
+        if not self.path or not (self.changed or set(self.handlers) - self.used):
+            return False
+
+        handlers = {key: self.handlers[key] for key in sorted(self.used)}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(dict(version=cache_version, handlers=handlers), f, indent=1)
+        os.replace(tmp_path, self.path)
+        return True
+
+
+class CircularDependency(RuntimeError):
+    """ raised by layer_partition, cycles is a list of lists of the agents involved """
+
+    def __init__(self, cycles):
+        self.cycles = cycles
+        super().__init__(
+            "Failed to compile dependency. Circular dependency between:\n"
+            + "\n".join(
+                " -> ".join(str(agent.name) for agent in cycle + cycle[:1])
+                for cycle in cycles
+            )
+        )
+
+
+def strongly_connected(agents):
+    """ Tarjan's strongly connected components of the infer_ags graph of agents,
+    which are not trivial, i.e. more than one agent or an agent inferring itself.
+    Iterative, so deep graphs don't hit the recursion limit.
+    """
+
+    in_graph = {id(agent) for agent in agents}
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    components = []
+
+    def successors(agent):
+        return [
+            infer_ag[1] for infer_ag in agent.infer_ags if id(infer_ag[1]) in in_graph
+        ]
+
+    for root in agents:
+        if id(root) in index:
+            continue
+
+        index[id(root)] = lowlink[id(root)] = len(index)
+        stack.append(root)
+        on_stack.add(id(root))
+        work = [(root, iter(successors(root)))]
+
+        while work:
+            agent, children = work[-1]
+            for child in children:
+                if id(child) not in index:
+                    index[id(child)] = lowlink[id(child)] = len(index)
+                    stack.append(child)
+                    on_stack.add(id(child))
+                    work.append((child, iter(successors(child))))
+                    break
+                if id(child) in on_stack:
+                    lowlink[id(agent)] = min(lowlink[id(agent)], index[id(child)])
+            else:
+                work.pop()
+                if work:
+                    parent = work[-1][0]
+                    lowlink[id(parent)] = min(lowlink[id(parent)], lowlink[id(agent)])
+
+                if lowlink[id(agent)] == index[id(agent)]:
+                    component = []
+                    while True:
+                        member = stack.pop()
+                        on_stack.discard(id(member))
+                        component.append(member)
+                        if member is agent:
+                            break
+                    if len(component) > 1 or agent in successors(agent):
+                        components.append(component[::-1])
+
+    return components
+
+
+def layer_partition(agents):
+    """ sets agent.layer and returns the agents grouped by layer, in their given order
+
+    layer 0 agents infer from no other agent, and every other agent is one layer
+    above the highest of its infer_ags. Kahn's algorithm, O(agents + infer_ags).
+    Agents referred to but not in agents keep their layer (None counts as 0).
+    Raises CircularDependency naming the agents of each cycle.
+    """
+
+    agents = list(agents)
+    order = {id(agent): k for k, agent in enumerate(agents)}
+    n_infers = [0] * len(agents)
+    inferred_by = [[] for _ in agents]
+    layers = [0] * len(agents)
+
+    for k, agent in enumerate(agents):
+        for infer_ag in agent.infer_ags:
+            _infer_obj = infer_ag[1]
+            j = order.get(id(_infer_obj))
+            if j is None:
+                layers[k] = max(layers[k], (_infer_obj.layer or 0) + 1)
+            else:
+                n_infers[k] += 1
+                inferred_by[j].append(k)
+
+    ready = [k for k in range(len(agents)) if n_infers[k] == 0]
+    n_done = 0
+    while n_done < len(ready):
+        j = ready[n_done]
+        n_done += 1
+        for k in inferred_by[j]:
+            layers[k] = max(layers[k], layers[j] + 1)
+            n_infers[k] -= 1
+            if n_infers[k] == 0:
+                ready.append(k)
+
+    if n_done < len(agents):
+        raise CircularDependency(
+            strongly_connected([agents[k] for k in range(len(agents)) if n_infers[k]])
+        )
+
+    partition = [[] for _ in range(max(layers, default=-1) + 1)]
+    for k, agent in enumerate(agents):
+        agent.layer = layers[k]
+        partition[layers[k]].append(agent)
+    return partition
@@ -57,7 +57,7 @@ def severity_aoa(ag_self: ra.SeverityAg):
     assert isinstance(ag_self.owner, Motor)
 
     if ag_self.action_str.startswith(':') or ag_self.action_str.startswith('.'):
-        ag_self.owner.pv_by_name[ag_self.action_str].value = 1
+        ag_self.put_pv(ag_self.owner.pv_by_name[ag_self.action_str], 1)
         return ra.StateLogics.Done, ag_self.action_str
     elif ag_self.action_str in ['action_home_it', 'homing_unsuccessful']:
         # TODO group action is needed here...
@@ -201,8 +201,8 @@ def tweak_aoi(ag_self: ra.Agent):
     assert isinstance(ag_self.owner, Motor)
 
     if ag_self.saved_value is not None:
-        ag_self.owner.pv_by_name['.TWV'].value = abs(ag_self.saved_value['twv'])
-        ag_self.owner.pv_by_name['.VELO'].value = abs(ag_self.saved_value['velo'])
+        ag_self.put_pv(ag_self.owner.pv_by_name['.TWV'], abs(ag_self.saved_value['twv']))
+        ag_self.put_pv(ag_self.owner.pv_by_name['.VELO'], abs(ag_self.saved_value['velo']))
         ag_self.saved_value = None
         return ra.OutStates.Done, 'reset tweak vals'
 
@@ -222,9 +222,9 @@ def tweak_aov(ag_self: ra.Agent):
         # new value, new command!?
         ag_self.saved_value = {'twv': ag_self.owner.pv_by_name['.TWV'].value, 'velo': ag_self.owner.pv_by_name['.VELO'].value}
 
-        ag_self.owner.pv_by_name['.TWV'].value = abs(ag_self.poll.Var[0])
-        ag_self.owner.pv_by_name['.VELO'].value = abs(ag_self.poll.Var[1])
-        ag_self.owner.pv_by_name['.STOP'].value = 1
+        ag_self.put_pv(ag_self.owner.pv_by_name['.TWV'], abs(ag_self.poll.Var[0]))
+        ag_self.put_pv(ag_self.owner.pv_by_name['.VELO'], abs(ag_self.poll.Var[1]))
+        ag_self.put_pv(ag_self.owner.pv_by_name['.STOP'], 1)
         ag_self.act.hold(for_seconds=1, reset_var=False)
         return ra.StateLogics.Armed, 'set to tweak...'
     else:
@@ -236,9 +236,9 @@ def tweak_aoa(ag_self: ra.Agent):
     assert isinstance(ag_self.owner, Motor)
 
     if ag_self.poll.Var[0] < 0:
-        ag_self.owner.pv_by_name['.TWR'].value = 1
+        ag_self.put_pv(ag_self.owner.pv_by_name['.TWR'], 1)
     else:
-        ag_self.owner.pv_by_name['.TWF'].value = 1
+        ag_self.put_pv(ag_self.owner.pv_by_name['.TWF'], 1)
     # poll.hold until it is forced on
     ag_self.poll.hold(for_cycles=-1, reset_var=True)
     return ra.StateLogics.Done, 'tweak is activated'
@@ -255,8 +255,8 @@ def move_to_aov(ag_self: ra.Agent):
 
     if ag_self.poll.Var[1] > 0:
         # new value, new command!?
-        ag_self.owner.pv_by_name['.VELO'].value = ag_self.poll.Var[1]
-        ag_self.owner.pv_by_name['.STOP'].value = 1
+        ag_self.put_pv(ag_self.owner.pv_by_name['.VELO'], ag_self.poll.Var[1])
+        ag_self.put_pv(ag_self.owner.pv_by_name['.STOP'], 1)
         ag_self.act.hold(for_seconds=1, reset_var=False)
         return ra.StateLogics.Armed, 'set to move'
         # return False to indicate the agent is armed for action, but not done
@@ -269,7 +269,7 @@ def move_to_aoa(ag_self: ra.Agent):
 
     assert isinstance(ag_self.owner, Motor)
 
-    ag_self.owner.pv_by_name['.VAL'].value = ag_self.poll.Var[0]
+    ag_self.put_pv(ag_self.owner.pv_by_name['.VAL'], ag_self.poll.Var[0])
     # poll.hold until it is forced on
     ag_self.poll.hold(for_cycles=-1, reset_var=True)
 
@@ -337,7 +337,7 @@ def pose_for_homing_aov(ag_self: ra.Agent):
 
         ag_self.owner.saved_homing_soft_limit = ag_self.owner.homing_soft_limit.value
         if target * ag_self.owner.homing_direction > ag_self.owner.saved_homing_soft_limit * ag_self.owner.homing_direction:
-            ag_self.owner.homing_soft_limit.value = ag_self.owner.saved_homing_soft_limit + ag_self.owner.homing_direction * 10000
+            ag_self.put_pv(ag_self.owner.homing_soft_limit, ag_self.owner.saved_homing_soft_limit + ag_self.owner.homing_direction * 10000)
 
         ag_self.owner.move_to_ag.poll.force([target, 10])
         return ra.StateLogics.Armed, ''
@@ -354,7 +354,7 @@ def pose_for_homing_aoa(ag_self: ra.Agent):
         ag_self.poll.hold(for_cycles=-1)
 
         # now restore the soft limits
-        ag_self.owner.homing_soft_limit.value = ag_self.owner.saved_homing_soft_limit
+        ag_self.put_pv(ag_self.owner.homing_soft_limit, ag_self.owner.saved_homing_soft_limit)
 
         return ra.StateLogics.Done, 'on homing position'
     else:
@@ -449,10 +449,12 @@ class Motor(ra.Device):
 
         # another method of adding PV's as objects of the motor....
 
-        self.status_ag = ra.Agent(owner=self, first_name='status_ag', poll_in=ra.status_poi, verbose=_VERBOSE_)
+        self.status_ag = ra.Agent(owner=self, first_name='status_ag', poll_in=ra.status_poi, verbose=_VERBOSE_,
+                                  watch_pvs=list(self.status_ref_dict))
 
         self.fault_ag = ra.Agent(owner=self, first_name='fault_ag', poll_in=ra.bit_stat, verbose=_VERBOSE_)
         self.fault_ag.stat_pv = ':FAULT'
+        self.fault_ag.watch_pvs = [self.fault_ag.stat_pv]
         self.fault_ag.ref_list = self.fault_bit_enum
 
         self.can_init_ag = ra.Agent(owner=self, first_name='can_init_ag', poll_in=can_init_poi, verbose=_VERBOSE_)
@@ -464,11 +466,13 @@ class Motor(ra.Device):
 
         """       ----------------------------     """
 
-        self.vel_ag = ra.Agent(owner=self, first_name='vel_ag', poll_in=vel_poi, unit=(self.unit + '/s'))
+        self.vel_ag = ra.Agent(owner=self, first_name='vel_ag', poll_in=vel_poi, unit=(self.unit + '/s'),
+                               watch_pvs=['.MOVN', '.DMOV', '.VELO', '.TDIR'])
 
-        self.rbv_ag = ra.Agent(owner=self, first_name='rbv_ag', poll_in=rbv_poi, unit=self.unit)
+        self.rbv_ag = ra.Agent(owner=self, first_name='rbv_ag', poll_in=rbv_poi, unit=self.unit, watch_pvs=['.RBV'])
 
-        self.tweak_val_ag = ra.Agent(owner=self, first_name='tweak_ag', poll_in=tweak_val_poi, unit=self.unit)
+        self.tweak_val_ag = ra.Agent(owner=self, first_name='tweak_ag', poll_in=tweak_val_poi, unit=self.unit,
+                                     watch_pvs=['.TWV'])
 
         self.max_scan_vel_ag = ra.Agent(owner=self, first_name='max_scan_vel_ag', poll_in=max_scan_vel_poi)
 
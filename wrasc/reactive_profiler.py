@@ -0,0 +1,217 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_profiler.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# per agent profiling of the reactive agents process loop
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+""" per agent timing of _in_proc and _out_proc
+
+AgentProfiler wraps _in_proc and _out_proc on the agent instances it is attached
+to, so the class methods and the agents which are not profiled are untouched and
+there is no cost at all when profiling is off.
+"""
+
+import time
+from collections import deque
+
+
+def handler_name(func):
+    if func is None:
+        return "-"
+    return getattr(func, "__qualname__", None) or getattr(func, "__name__", repr(func))
+
+
+class HandlerStats:
+    """ timing of one handler of one agent
+
+    calls, total and max are kept from the start, recent keeps the last window
+    durations for a rolling percentile estimate.
+    """
+
+    def __init__(self, agent_name, device, phase, handler, window=256):
+        self.agent_name = agent_name
+        self.device = device
+        self.phase = phase
+        self.handler = handler
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=window)
+
+    def add(self, duration):
+        self.calls += 1
+        self.total += duration
+        if duration > self.max:
+            self.max = duration
+        self.recent.append(duration)
+
+    @property
+    def mean(self):
+        return self.total / self.calls if self.calls else 0.0
+
+    def percentile(self, q):
+        """ q-th percentile of the recent window """
+        if not self.recent:
+            return 0.0
+        _sorted = sorted(self.recent)
+        return _sorted[min(len(_sorted) - 1, int(q / 100 * len(_sorted)))]
+
+
+class AgentProfiler:
+    """ collects call counts and wall times of the agent handlers
+
+    usage:
+        profiler = AgentProfiler()
+        process_loop(agents_sorted_by_layer, profiler=profiler, profile_every=100)
+        ...
+        print(profiler.report_str(n=10))
+    """
+
+    def __init__(self, window=256, clock=time.perf_counter):
+        self.window = window
+        self.clock = clock
+        self.stats = {}
+        self.agents = []
+
+    def attach(self, agents):
+        for agent in agents:
+            # instance attributes shadow the class methods for this agent only
+            agent._in_proc = self.wrap_in_proc(agent)
+            agent._out_proc = self.wrap_out_proc(agent)
+            agent._in_proc_async = self.wrap_in_proc_async(agent)
+            agent._out_proc_async = self.wrap_out_proc_async(agent)
+            self.agents.append(agent)
+
+    def detach(self):
+        for agent in self.agents:
+            del agent._in_proc
+            del agent._out_proc
+            del agent._in_proc_async
+            del agent._out_proc_async
+        self.agents = []
+
+    def get_stats(self, agent, phase, func):
+        key = (id(agent), phase, func)
+        stats = self.stats.get(key)
+        if stats is None:
+            stats = HandlerStats(
+                agent.name,
+                agent.owner_name,
+                phase,
+                handler_name(func),
+                window=self.window,
+            )
+            self.stats[key] = stats
+        return stats
+
+    def wrap_in_proc(self, agent):
+        in_proc = agent._in_proc
+        clock = self.clock
+
+        def _in_proc():
+            time_0 = clock()
+            result = in_proc()
+            self.get_stats(agent, "poll", agent.poll_in).add(clock() - time_0)
+            return result
+
+        return _in_proc
+
+    def wrap_out_proc(self, agent):
+        out_proc = agent._out_proc
+        clock = self.clock
+
+        def _out_proc():
+            time_0 = clock()
+            result = out_proc()
+            # act_on is selected by the state inside _out_proc
+            self.get_stats(agent, "act", agent.act_on).add(clock() - time_0)
+            return result
+
+        return _out_proc
+
+    def wrap_in_proc_async(self, agent):
+        # on asyncio the wall time includes the other tasks run while awaiting
+        in_proc_async = agent._in_proc_async
+        clock = self.clock
+
+        async def _in_proc_async():
+            time_0 = clock()
+            result = await in_proc_async()
+            self.get_stats(agent, "poll", agent.poll_in).add(clock() - time_0)
+            return result
+
+        return _in_proc_async
+
+    def wrap_out_proc_async(self, agent):
+        out_proc_async = agent._out_proc_async
+        clock = self.clock
+
+        async def _out_proc_async():
+            time_0 = clock()
+            result = await out_proc_async()
+            self.get_stats(agent, "act", agent.act_on).add(clock() - time_0)
+            return result
+
+        return _out_proc_async
+
+    def clear(self):
+        self.stats = {}
+
+    def top(self, n=10, key="total"):
+        """ the n most expensive handlers, sorted by total, max, mean or p99 """
+        if key == "p99":
+            sort_key = lambda stats: stats.percentile(99)
+        else:
+            sort_key = lambda stats: getattr(stats, key)
+        return sorted(self.stats.values(), key=sort_key, reverse=True)[:n]
+
+    def report(self, n=10, key="total"):
+        return [
+            dict(
+                agent=stats.agent_name,
+                device=stats.device,
+                phase=stats.phase,
+                handler=stats.handler,
+                calls=stats.calls,
+                total=stats.total,
+                mean=stats.mean,
+                p99=stats.percentile(99),
+                max=stats.max,
+            )
+            for stats in self.top(n, key=key)
+        ]
+
+    def report_str(self, n=10, key="total"):
+        _lines = [f"top {n} agent handlers by {key}:"]
+        for row in self.report(n, key=key):
+            _lines.append(
+                "  {agent} [{device}] {phase} {handler}: {calls} calls, "
+                "total {total:.4f}s, mean {mean:.6f}s, p99 {p99:.6f}s, "
+                "max {max:.6f}s".format(**row)
+            )
+        return "\n".join(_lines)
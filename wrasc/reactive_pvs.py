@@ -0,0 +1,346 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_pvs.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# shared registry of the PV channels
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+
+""" one PV object per PV name, for all devices and agents
+
+Devices, agents and prep1 get their PVs from the registry, so a record field
+used by many agents has one channel and one connection. Making a PV only starts
+its connection, and compile_n_install waits for all of them at once:
+
+    pv_registry.pv("SR08ID01:MOT1.RBV")
+    ...
+    pv_registry.wait_for_connections(timeout=5.0)
+    print(pv_registry.report_str())
+
+PutQueue holds back the puts the agents make with Agent.put_pv during the
+action phase, so they go out together with one flush of the CA queue when the
+phase ends. process_loop uses put_queue if defer_puts=True. Puts made any other
+way, e.g. PV.put from another thread, go straight to CA as usual.
+
+Prefetcher reads all the PVs which the agents read synchronously with
+Agent.get_pv in the inference phase, i.e. PVs without a monitor, with one round
+of non-blocking CA gets before the phase, and serves Agent.get_pv from that
+snapshot during the phase. process_loop uses prefetcher if prefetch=True.
+PV.get called directly is not served from the snapshot.
+"""
+
+import threading
+import time
+from collections import deque
+from timeit import default_timer as timer
+
+from epics import PV, ca
+
+
+class PVRegistry:
+    """ PVs by their full name
+
+    factory and poll stand in for epics.PV and epics.ca.poll
+    """
+
+    def __init__(self, factory=PV, poll=None):
+        self.factory = factory
+        self.poll = ca.poll if poll is None else poll
+        self.pvs = {}
+        self.created_at = {}
+        self.connected_at = {}
+        # made since the last wait_for_connections
+        self.new_names = []
+
+    def __len__(self):
+        return len(self.pvs)
+
+    def __contains__(self, pvname):
+        return pvname in self.pvs
+
+    def pv(self, pvname):
+        """ the PV of pvname, made on the first request """
+
+        _pv = self.pvs.get(pvname)
+        if _pv is None:
+            self.created_at[pvname] = timer()
+            self.new_names.append(pvname)
+            _pv = self.factory(
+                pvname, verbose=False, connection_callback=self.on_connection
+            )
+            self.pvs[pvname] = _pv
+        return _pv
+
+    def on_connection(self, pvname=None, conn=None, **kwargs):
+        if conn and pvname not in self.connected_at:
+            self.connected_at[pvname] = timer()
+
+    def pending(self, pvnames=None):
+        """ names of the PVs not connected yet """
+        if pvnames is None:
+            pvnames = self.pvs
+        return [pvname for pvname in pvnames if not self.pvs[pvname].connected]
+
+    def wait_for_connections(self, timeout=5.0, pvnames=None):
+        """ one wait for the connection of all the PVs made since the last wait,
+        or of pvnames. Returns the names of the PVs which didn't connect
+        """
+
+        if pvnames is None:
+            pvnames, self.new_names = self.new_names, []
+
+        pending = self.pending(pvnames)
+        deadline = timer() + timeout
+        while pending and timer() < deadline:
+            self.poll()
+            pending = self.pending(pending)
+            if pending:
+                time.sleep(0.001)
+        return pending
+
+    def latency(self, pvname):
+        """ time from making the PV to its connection [s], None if not connected """
+        if pvname not in self.connected_at:
+            return None
+        return self.connected_at[pvname] - self.created_at[pvname]
+
+    def report(self):
+        latencies = {pvname: self.latency(pvname) for pvname in self.pvs}
+        connected = [latency for latency in latencies.values() if latency is not None]
+        return dict(
+            n_pvs=len(self.pvs),
+            n_connected=len(connected),
+            max_latency=max(connected, default=None),
+            not_connected=sorted(
+                pvname for pvname, latency in latencies.items() if latency is None
+            ),
+            latencies=latencies,
+        )
+
+    def report_str(self, n=10):
+        """ counts and the n slowest connections """
+        report = self.report()
+        _lines = ["{n_connected}/{n_pvs} PVs connected".format(**report)]
+        slowest = sorted(
+            (
+                (latency, pvname)
+                for pvname, latency in report["latencies"].items()
+                if latency is not None
+            ),
+            reverse=True,
+        )[:n]
+        for latency, pvname in slowest:
+            _lines.append(f"  {pvname}: {latency:.3f}s")
+        for pvname in report["not_connected"]:
+            _lines.append(f"  {pvname}: not connected")
+        return "\n".join(_lines)
+
+
+class PutQueue:
+    """ collects the puts of a phase, and sends them at its end with one flush
+
+    Between begin and end, put queues the puts which don't wait for completion.
+    Puts to the same PV are coalesced into the last value, sent in the order of
+    the first put. Completion callbacks are held until deliver, which process_loop
+    calls at the start of the next inference. Outside of a phase, put is PV.put.
+
+    flush_io stands in for epics.ca.flush_io
+    """
+
+    def __init__(self, flush_io=None):
+        self.flush_io = ca.flush_io if flush_io is None else flush_io
+        self.lock = threading.Lock()
+        self.deferring = False
+        self.puts = {}
+        self.completions = deque()
+        self.n_puts = 0
+        self.n_sent = 0
+        self.n_flushes = 0
+
+    def put(
+        self,
+        pv,
+        value,
+        wait=False,
+        timeout=30.0,
+        use_complete=False,
+        callback=None,
+        callback_data=None,
+    ):
+        """ PV.put, queued if called between begin and end """
+
+        with self.lock:
+            if self.deferring and not (wait or use_complete):
+                self.enqueue(pv, value, callback, callback_data)
+                return 1
+        return pv.put(
+            value,
+            wait=wait,
+            timeout=timeout,
+            use_complete=use_complete,
+            callback=callback,
+            callback_data=callback_data,
+        )
+
+    def enqueue(self, pv, value, callback=None, callback_data=None):
+        self.n_puts += 1
+        entry = self.puts.get(pv.pvname)
+        if entry is None:
+            entry = self.puts[pv.pvname] = [pv, value, []]
+        else:
+            entry[1] = value
+        if callable(callback):
+            entry[2].append((callback, callback_data))
+
+    def begin(self):
+        with self.lock:
+            self.deferring = True
+
+    def end(self):
+        """ stops queueing and sends the queued puts """
+        with self.lock:
+            self.deferring = False
+            entries, self.puts = list(self.puts.values()), {}
+        self.flush(entries)
+
+    def flush(self, entries):
+        if not entries:
+            return
+
+        for pv, value, callbacks in entries:
+            if callbacks:
+                pv.put(
+                    value,
+                    callback=self.completed,
+                    callback_data=dict(callbacks=callbacks),
+                )
+            else:
+                pv.put(value)
+            self.n_sent += 1
+        self.flush_io()
+        self.n_flushes += 1
+
+    def completed(self, pvname=None, callbacks=(), **kwargs):
+        # on the CA thread
+        for callback, callback_data in callbacks:
+            self.completions.append((callback, pvname, callback_data))
+
+    def deliver(self):
+        """ calls the completion callbacks of the puts which completed so far """
+        while self.completions:
+            callback, pvname, callback_data = self.completions.popleft()
+            if isinstance(callback_data, dict):
+                callback(pvname=pvname, **callback_data)
+            else:
+                callback(pvname=pvname, data=callback_data)
+
+
+class Prefetcher:
+    """ one round of CA gets for the synchronous reads of a phase
+
+    PVs are told with add, or learned: a get during the phase which is not
+    served from a monitor is passed on to PV.get, and the PV is prefetched from
+    then on. Outside of a phase, and with use_monitor=False, get is PV.get.
+
+        prefetcher.begin()  # gets the snapshot, unless issued already
+        ... get of prefetched PVs return the snapshot
+        prefetcher.end()
+        prefetcher.issue()  # optional, gets for the next phase on their way
+
+    ca_get, get_complete and flush_io stand in for ca.get, ca.get_complete and
+    ca.flush_io
+    """
+
+    def __init__(self, ca_get=None, get_complete=None, flush_io=None, timeout=1.0):
+        self.ca_get = ca.get if ca_get is None else ca_get
+        self.get_complete = ca.get_complete if get_complete is None else get_complete
+        self.flush_io = ca.flush_io if flush_io is None else flush_io
+        self.timeout = timeout
+
+        self.pvs = {}
+        self.requested = []
+        self.snapshot = {}
+        self.active = False
+        self.n_served = 0
+        self.n_passed = 0
+
+    def add(self, pv):
+        self.pvs[pv.pvname] = pv
+
+    def issue(self):
+        """ sends the gets of all the prefetched PVs, without waiting """
+        self.requested = [pv for pv in self.pvs.values() if pv.connected]
+        for pv in self.requested:
+            self.ca_get(pv.chid, wait=False)
+        if self.requested:
+            self.flush_io()
+
+    def collect(self):
+        snapshot = {}
+        for pv in self.requested:
+            value = self.get_complete(pv.chid, timeout=self.timeout)
+            if value is not None:
+                snapshot[pv.pvname] = value
+        self.requested = []
+        return snapshot
+
+    def begin(self):
+        if not self.requested:
+            self.issue()
+        self.snapshot = self.collect()
+        self.active = True
+
+    def end(self):
+        self.active = False
+        self.snapshot = {}
+
+    def get(self, pv, count=None, as_string=False, use_monitor=True, **kwargs):
+        """ PV.get, from the snapshot if the PV is prefetched """
+
+        if not self.active or not use_monitor:
+            # a fresh read asked for
+            return pv.get(count, as_string, use_monitor=use_monitor, **kwargs)
+
+        if (
+            count is None
+            and not as_string
+            and not kwargs
+            and pv.pvname in self.snapshot
+        ):
+            self.n_served += 1
+            return self.snapshot[pv.pvname]
+
+        if not getattr(pv, "auto_monitor", False):
+            # a synchronous read, prefetched from the next phase on
+            self.add(pv)
+        self.n_passed += 1
+        return pv.get(count, as_string, use_monitor=use_monitor, **kwargs)
+
+
+pv_registry = PVRegistry()
+put_queue = PutQueue()
+prefetcher = Prefetcher()
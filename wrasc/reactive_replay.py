@@ -0,0 +1,443 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_replay.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# record and replay of the inputs of the agents
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+
+""" record and replay of the inputs of the agents
+
+Recorder logs what the agents read from the outside world in each cycle: PV
+values read with PV.get or PV.value, the responses of send_receive_raw and
+send_list_receive_dict of the PPMACs found on the agents, the readings of the
+agents clock and, in event driven mode, the monitor updates which woke the
+agents, together with the state transitions of the agents, to a compact binary
+file:
+
+    recorder = Recorder("ra_out/run.rarec")
+    ra.process_loop(agents_sorted_by_layer, recorder=recorder)
+
+replay runs a freshly made copy of the same agent graph on the recorded inputs,
+with no hardware and on virtual time, so it runs as fast as the agents allow,
+and returns the state transitions which differ from the recording:
+
+    differences = replay("ra_out/run.rarec", make_agents_sorted_by_layer)
+
+Given the function which makes the graph, replay makes it with StubPVs in place
+of the PVs, see stub_pvs, so nothing connects to channel access.
+
+Inputs are keyed by their source, e.g. the PV name, and each source is replayed
+in the order it was read. Nothing is put to the PVs during a replay.
+"""
+
+import contextlib
+import os
+import pickle
+import struct
+import threading
+from collections import deque
+
+from epics import PV
+
+from wrasc.reactive_agent import process_loop
+from wrasc.reactive_pvs import pv_registry
+from wrasc.reactive_timer import VirtualClock
+
+magic = b"WRASC-REC 1\n"
+
+# no attribute of that name on the patched object itself
+_missing = object()
+
+# frame kind, key index, followed by the encoded value
+frame_header = struct.Struct("<BI")
+Key, Read, Cycle, State = range(4)
+
+_float = struct.Struct("<d")
+_int = struct.Struct("<q")
+_size = struct.Struct("<I")
+
+
+def encode(value):
+    """ tag byte and data, the plain types are packed, anything else is pickled """
+    if value is None:
+        return b"N"
+    if value is True:
+        return b"T"
+    if value is False:
+        return b"F"
+    if type(value) is float:
+        return b"d" + _float.pack(value)
+    if type(value) is int and -(2 ** 63) <= value < 2 ** 63:
+        return b"q" + _int.pack(value)
+    if type(value) is str:
+        data = value.encode()
+        return b"s" + _size.pack(len(data)) + data
+    data = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+    return b"p" + _size.pack(len(data)) + data
+
+
+def decode(buffer, offset):
+    """ (value, offset of the next frame) """
+    tag = buffer[offset : offset + 1]
+    offset += 1
+    if tag == b"N":
+        return None, offset
+    if tag == b"T":
+        return True, offset
+    if tag == b"F":
+        return False, offset
+    if tag == b"d":
+        return _float.unpack_from(buffer, offset)[0], offset + _float.size
+    if tag == b"q":
+        return _int.unpack_from(buffer, offset)[0], offset + _int.size
+
+    size = _size.unpack_from(buffer, offset)[0]
+    offset += _size.size
+    data = buffer[offset : offset + size]
+    if tag == b"s":
+        return data.decode(), offset + size
+    if tag == b"p":
+        return pickle.loads(data), offset + size
+    raise ValueError(f"unknown tag {tag!r} in the record")
+
+
+def read_frames(path):
+    """ yields (kind, key, value) of each frame of a record file """
+
+    with open(path, "rb") as f:
+        buffer = f.read()
+    if not buffer.startswith(magic):
+        raise ValueError(f"{path} is not an agents record")
+
+    keys = {}
+    offset = len(magic)
+    while offset < len(buffer):
+        kind, index = frame_header.unpack_from(buffer, offset)
+        value, offset = decode(buffer, offset + frame_header.size)
+        if kind == Key:
+            keys[index] = value
+        else:
+            yield kind, keys.get(index), value
+
+
+class StubPV:
+    """ stands in for epics.PV in a replay, connected to nothing """
+
+    def __init__(self, pvname, connection_callback=None, **kwargs):
+        self.pvname = pvname
+        self.connected = True
+        self.auto_monitor = True
+        self.callbacks = {}
+        if connection_callback:
+            connection_callback(pvname=pvname, conn=True)
+
+    def get(self, *args, **kwargs):
+        return None
+
+    def put(self, value, *args, **kwargs):
+        pass
+
+    @property
+    def value(self):
+        return self.get()
+
+    @value.setter
+    def value(self, value):
+        self.put(value)
+
+    def wait_for_connection(self, timeout=None):
+        return True
+
+    def add_callback(self, callback=None, index=None, **kwargs):
+        if index is None:
+            index = 1 + max(self.callbacks, default=0)
+        self.callbacks[index] = (callback, kwargs)
+        return index
+
+    def remove_callback(self, index=None):
+        self.callbacks.pop(index, None)
+
+    def clear_callbacks(self):
+        self.callbacks = {}
+
+
+@contextlib.contextmanager
+def stub_pvs():
+    """ the PVs made through pv_registry in this context are StubPVs """
+
+    saved = pv_registry.factory, pv_registry.poll, pv_registry.pvs
+    pv_registry.factory, pv_registry.poll, pv_registry.pvs = StubPV, lambda: None, {}
+    try:
+        yield
+    finally:
+        pv_registry.factory, pv_registry.poll, pv_registry.pvs = saved
+
+
+def find_ppmacs(sorted_ag_list):
+    """ objects with a send_receive_raw, e.g. PPMAC, held by the agents """
+    ppmacs = []
+    for _agdict in sorted_ag_list.values():
+        for value in getattr(_agdict["agent"], "__dict__", {}).values():
+            if callable(getattr(value, "send_receive_raw", None)) and not any(
+                value is ppmac for ppmac in ppmacs
+            ):
+                ppmacs.append(value)
+    return ppmacs
+
+
+class Recorder:
+    """ records the inputs of the agents while it is attached to a process loop
+
+    ppmacs: PPMACs to record, besides those held by the agents
+    """
+
+    replaying = False
+    # whose reads are recorded
+    pv_classes = (PV,)
+
+    def __init__(self, path, ppmacs=()):
+        self.path = path
+        self.ppmacs = list(ppmacs)
+        self.file = None
+        self.keys = {}
+        self.patches = []
+        self.states = {}
+        self.cycle = 0
+        self.n_cycles = 0
+        self.n_reads = 0
+        self.lock = threading.Lock()
+        # reads made while reading, e.g. PV.value calling PV.get, are not inputs
+        self.local = threading.local()
+
+    def patch(self, obj, name, value):
+        self.patches.append((obj, name, obj.__dict__.get(name, _missing)))
+        setattr(obj, name, value)
+
+    def unpatch(self):
+        for obj, name, value in reversed(self.patches):
+            if value is _missing:
+                delattr(obj, name)
+            else:
+                setattr(obj, name, value)
+        self.patches = []
+
+    def attach(self, sorted_ag_list, clock, active_set=None):
+        """ patches the input sources, clock is the PhaseClock of the agents and
+        active_set the ActiveSet of the event driven loop
+        """
+
+        self.open()
+
+        for pv_class in self.pv_classes:
+            pv_get = pv_class.__dict__["get"]
+            pv_value = pv_class.__dict__["value"]
+            self.patch(pv_class, "get", self.pv_reader(pv_get))
+            self.patch(
+                pv_class,
+                "value",
+                property(self.pv_reader(pv_value.fget), pv_value.fset),
+            )
+            if self.replaying:
+                self.patch(pv_class, "put", self.pv_put)
+
+        ppmacs = self.ppmacs + [
+            ppmac
+            for ppmac in find_ppmacs(sorted_ag_list)
+            if not any(ppmac is known for known in self.ppmacs)
+        ]
+        for k, ppmac in enumerate(ppmacs):
+            key = f"ppmac:{k}:{getattr(ppmac, 'host', '')}"
+            for method in ["send_receive_raw", "send_list_receive_dict"]:
+                if hasattr(ppmac, method):
+                    self.patch(
+                        ppmac,
+                        method,
+                        self.reader(f"{key}:{method}", getattr(ppmac, method)),
+                    )
+
+        self.patch(clock, "source", self.reader("clock", clock.source))
+        if active_set is not None:
+            # the monitor updates, with their timestamps, in the order taken
+            self.patch(
+                active_set, "take_dirty", self.reader("wakeups", active_set.take_dirty)
+            )
+
+    def detach(self):
+        self.unpatch()
+        self.close()
+
+    def open(self):
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        self.file = open(self.path, "wb")
+        self.file.write(magic)
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+
+    def write(self, kind, key, value):
+        with self.lock:
+            index = self.keys.get(key)
+            if index is None:
+                index = self.keys[key] = len(self.keys)
+                self.file.write(frame_header.pack(Key, index) + encode(key))
+            self.file.write(frame_header.pack(kind, index) + encode(value))
+
+    def reader(self, key, fn):
+        def read(*args, **kwargs):
+            return self.read(key, fn, *args, **kwargs)
+
+        return read
+
+    def pv_reader(self, fn):
+        def read(pv, *args, **kwargs):
+            return self.read("pv:" + str(pv.pvname), fn, pv, *args, **kwargs)
+
+        return read
+
+    def read(self, key, fn, *args, **kwargs):
+        if getattr(self.local, "reading", False):
+            return fn(*args, **kwargs)
+
+        self.local.reading = True
+        try:
+            value = fn(*args, **kwargs)
+        finally:
+            self.local.reading = False
+        self.n_reads += 1
+        self.write(Read, key, value)
+        return value
+
+    def begin_cycle(self, cycle):
+        self.cycle = cycle
+        self.n_cycles += 1
+        self.write(Cycle, "cycle", cycle)
+
+    def end_cycle(self, sorted_ag_list):
+        """ the in and out state of each agent which changed in this cycle """
+        for agname, _agdict in sorted_ag_list.items():
+            status = _agdict.get("Status")
+            status = tuple(status[:2]) if status else None
+            if self.states.get(agname) != status:
+                self.states[agname] = status
+                self.transition(agname, status)
+
+    def transition(self, agname, status):
+        self.write(State, agname, status)
+
+
+class Replayer(Recorder):
+    """ feeds the recorded inputs back to the agents, see replay """
+
+    replaying = True
+    pv_classes = (PV, StubPV)
+
+    def __init__(self, path, ppmacs=()):
+        super().__init__(path, ppmacs=ppmacs)
+
+        self.inputs = {}
+        self.recorded = {}
+        self.replayed = {}
+        # reads of a source beyond what was recorded for it
+        self.misses = 0
+        self.n_puts = 0
+        self.last_time = 0.0
+
+        cycle = 0
+        n_cycles = 0
+        for kind, key, value in read_frames(path):
+            if kind == Read:
+                self.inputs.setdefault(key, deque()).append(value)
+            elif kind == Cycle:
+                cycle = value
+                n_cycles += 1
+            elif kind == State:
+                self.recorded[(cycle, key)] = value
+        self.n_recorded_cycles = n_cycles
+
+    def open(self):
+        pass
+
+    def read(self, key, fn, *args, **kwargs):
+        values = self.inputs.get(key)
+        if not values:
+            self.misses += 1
+            if key == "clock":
+                return self.last_time
+            return [] if key == "wakeups" else None
+
+        self.n_reads += 1
+        value = values.popleft()
+        if key == "clock":
+            self.last_time = value
+        return value
+
+    def pv_put(self, pv, *args, **kwargs):
+        self.n_puts += 1
+
+    def begin_cycle(self, cycle):
+        self.cycle = cycle
+        self.n_cycles += 1
+
+    def transition(self, agname, status):
+        self.replayed[(self.cycle, agname)] = status
+
+    def diff(self):
+        """ [(cycle, agent name, recorded, replayed)] of the transitions which differ """
+        differences = []
+        for cycle, agname in sorted(set(self.recorded) | set(self.replayed)):
+            recorded = self.recorded.get((cycle, agname))
+            replayed = self.replayed.get((cycle, agname))
+            if recorded != replayed:
+                differences.append((cycle, agname, recorded, replayed))
+        return differences
+
+
+def replay(path, agents_sorted_by_layer, replayer: Replayer = None, **kwargs):
+    """ runs process_loop on the record at path, as fast as it goes.
+    agents_sorted_by_layer shall be in the state the recorded graph started in,
+    or a function which makes it, called with the PVs stubbed, see stub_pvs.
+    kwargs are passed on to process_loop, e.g. event_driven.
+    Returns Replayer.diff()
+    """
+
+    if replayer is None:
+        replayer = Replayer(path)
+    kwargs.setdefault("html_refresh", None)
+    with stub_pvs():
+        if callable(agents_sorted_by_layer):
+            agents_sorted_by_layer = agents_sorted_by_layer()
+        process_loop(
+            agents_sorted_by_layer,
+            n_loop=replayer.n_recorded_cycles,
+            time_source=VirtualClock(),
+            recorder=replayer,
+            **kwargs,
+        )
+    return replayer.diff()
@@ -0,0 +1,137 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_status.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# html status page of the reactive agents process loop
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+""" background writer for the poll vars status page
+
+The process loop only hands over the list of rows of each cycle, which is a
+reference swap. Rendering and writing the page happen on a thread, at most once
+per refresh_period and only if the rows changed since the last write. Rendered
+rows are cached, so only the rows of agents whose description changed are
+rendered again.
+"""
+
+import os
+import threading
+
+from flask_table.html import element
+
+
+class StatusWriter:
+    def __init__(self, path, table_cls, refresh_period=1.0):
+        self.path = path
+        self.table = table_cls([])
+        self.refresh_period = refresh_period
+
+        self.rows = []
+        self.version = 0
+        self.written_version = 0
+        self.n_writes = 0
+        self.n_rendered = 0
+
+        # (name, description) of each agent and its rendered <tr>
+        self.tr_cache = {}
+        self.thead = self.table.thead()
+
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(
+            target=self.run, name="wrasc_status", daemon=True
+        )
+        self.thread.start()
+        return self
+
+    def update(self, rows):
+        """ called by the process loop, rows must not be changed afterwards """
+        self.rows = rows
+        self.version += 1
+
+    def run(self):
+        while not self.stop_event.wait(self.refresh_period):
+            self.write()
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread:
+            self.thread.join()
+            self.thread = None
+        # last state is always on the page
+        self.write()
+
+    def render_rows(self, rows):
+        tr_cache = {}
+        out = []
+        for item in rows:
+            name = item["name"]
+            cached = self.tr_cache.get(name)
+            if cached and cached[0] == item["description"]:
+                tr = cached[1]
+            else:
+                tr = self.table.tr(item)
+                self.n_rendered += 1
+            tr_cache[name] = (item["description"], tr)
+            out.append(tr)
+        # agents which dropped out of the list are dropped from the cache
+        self.tr_cache = tr_cache
+        return out
+
+    def render(self, rows):
+        out = self.render_rows(rows)
+        if not out:
+            return element("p", content=self.table.no_items)
+
+        tbody = element(
+            "tbody", content="\n{}\n".format("\n".join(out)), escape_content=False
+        )
+        return element(
+            "table",
+            attrs=self.table.get_html_attrs(),
+            content="\n{}\n{}\n".format(self.thead, tbody),
+            escape_content=False,
+        )
+
+    def write(self):
+        version, rows = self.version, self.rows
+        if version == self.written_version:
+            return False
+
+        html = self.render(rows)
+
+        # readers either see the old page or the new one, never a partial write
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(html)
+        os.replace(tmp_path, self.path)
+
+        self.written_version = version
+        self.n_writes += 1
+        return True
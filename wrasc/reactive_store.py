@@ -0,0 +1,200 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_store.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# columnar state store for large agent graphs
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+""" struct of arrays store for the bookkeeping of the agents
+
+StateStore keeps the counters, timers and change flags of the poll and act
+observables of all agents in numpy arrays indexed by the agent order in
+agents_sorted_by_layer, together with the in/out state codes of the last cycle.
+Agents see the usual attribute API through StoredObservable, while inference()
+and action() find the agents on hold, count down their hold and tally the states
+on whole arrays:
+
+    agents_sorted_by_layer = ra.compile_n_install({}, globals().copy(), eprefix)
+    store = StateStore(agents_sorted_by_layer)
+    ra.process_loop(agents_sorted_by_layer, store=store)
+
+Per agent attribute access is slower than on a plain MyObservable, so this is
+only worth it for graphs of many thousands of agents.
+"""
+
+import numpy as np
+
+from wrasc.reactive_agent import MyObservable, StateNames, clock
+
+# name, dtype and python type of each column
+columns = [
+    ("Changed", np.bool_, bool),
+    ("ChangeCount", np.int64, int),
+    ("NoChangeCount", np.int64, int),
+    ("_hold_counter", np.int64, int),
+    ("_force_counter", np.int64, int),
+    ("_hold_timer", np.float64, float),
+    ("_force_timer", np.float64, float),
+    ("_hold_indefinitely", np.bool_, bool),
+    ("_force_indefinitely", np.bool_, bool),
+]
+
+# state names by their code in in_codes and out_codes
+state_names = [
+    StateNames.Invalid,
+    StateNames.Valid,
+    StateNames.Inhibited,
+    StateNames.Idle,
+    StateNames.Armed,
+    StateNames.Done,
+]
+state_codes = {name: code for code, name in enumerate(state_names)}
+
+
+class ObservableColumns:
+    """ one array per column, one row per agent """
+
+    def __init__(self, n):
+        self.n = n
+        for name, dtype, _ in columns:
+            setattr(self, name, np.zeros(n, dtype=dtype))
+        # rows pushed (hold, unhold, force) since begin_inference
+        self.pushed = np.zeros(n, dtype=np.bool_)
+
+    def held(self, now):
+        """ mask of the rows which check_var would find on hold """
+        return (
+            self._hold_indefinitely
+            | (self._hold_counter >= 1)
+            | (self._hold_timer >= now)
+        )
+
+    def forced(self):
+        return self._force_indefinitely | (self._force_counter > 0)
+
+    def countdown(self, mask):
+        """ the counter updates of check_var on hold, for the rows in mask """
+        self._force_counter[mask & self._force_indefinitely] = 1
+        self._hold_counter[mask & self._hold_indefinitely] = 1
+        self._hold_counter[mask] -= 1
+
+
+def column_property(name, to_python):
+    def fget(self):
+        return to_python(getattr(self._columns, name)[self._row])
+
+    def fset(self, value):
+        getattr(self._columns, name)[self._row] = value
+
+    return property(fget, fset)
+
+
+class StoredObservable(MyObservable):
+    """ MyObservable with its counters, timers and flags kept in ObservableColumns """
+
+    __slots__ = ("_columns", "_row")
+
+    def __init__(self, columns_: ObservableColumns, row, observable: MyObservable = None):
+        self._columns = columns_
+        self._row = row
+        super().__init__()
+        if observable is not None:
+            # take over the current state of the observable being replaced
+            for name in MyObservable.__slots__:
+                setattr(self, name, getattr(observable, name))
+
+    def pushed(self):
+        self._columns.pushed[self._row] = True
+        super().pushed()
+
+
+for _name, _, _to_python in columns:
+    setattr(StoredObservable, _name, column_property(_name, _to_python))
+
+
+class StateStore:
+    """ moves the observables of the agents into columns
+
+    index: agent name to row
+    poll, act: ObservableColumns of the poll and act observables
+    in_codes, out_codes: state codes of the last inference and action, see state_codes
+    """
+
+    def __init__(self, sorted_ag_list):
+        self.agnames = list(sorted_ag_list)
+        self.index = {agname: i for i, agname in enumerate(self.agnames)}
+        n = len(self.agnames)
+
+        self.poll = ObservableColumns(n)
+        self.act = ObservableColumns(n)
+        self.in_codes = np.full(n, state_codes[StateNames.Invalid], dtype=np.int8)
+        self.out_codes = np.full(n, state_codes[StateNames.Idle], dtype=np.int8)
+        self.held = np.zeros(n, dtype=np.bool_)
+        self.skipped = np.zeros(n, dtype=np.bool_)
+
+        for i, agname in enumerate(self.agnames):
+            agent = sorted_ag_list[agname]["agent"]
+            agent.poll = StoredObservable(self.poll, i, agent.poll)
+            agent.act = StoredObservable(self.act, i, agent.act)
+
+    def begin_inference(self, now=None):
+        """ finds the agents on hold for this inference, all at once.
+        Agents pushed during the inference are left to their own check_var
+        """
+        self.held = self.poll.held(clock() if now is None else now)
+        self.poll.Changed[self.held] = False
+        self.poll.pushed[:] = False
+        self.skipped[:] = False
+
+    def is_held(self, i):
+        return self.held[i] and not self.poll.pushed[i]
+
+    def held_in_proc(self, i, agent):
+        """ _in_proc of an agent on hold, the countdown is done in end_inference """
+        self.skipped[i] = True
+        agent.poll.last_message = "on hold"
+        return agent.state(), "on hold"
+
+    def end_inference(self, ag_states):
+        self.poll.countdown(self.skipped)
+        self.tally(self.in_codes, ag_states)
+
+    def end_action(self, ag_states):
+        self.tally(self.out_codes, ag_states)
+
+    def set_in_state(self, i, in_state):
+        self.in_codes[i] = state_codes[in_state]
+
+    def set_out_state(self, i, out_state):
+        self.out_codes[i] = state_codes[out_state]
+
+    @staticmethod
+    def tally(codes, ag_states):
+        counts = np.bincount(codes, minlength=len(state_names))
+        for code, name in enumerate(state_names):
+            if counts[code]:
+                ag_states[name] = ag_states.get(name, 0) + int(counts[code])
@@ -0,0 +1,484 @@
+#!/usr/bin/env python
+#
+# $File: //ASP/Personal/afsharn/wrasc/wrasc/reactive_timer.py $
+# $Revision: #1 $
+# $DateTime: 2020/08/09 22:35:08 $
+# Last checked in by: $Author: afsharn $
+#
+# Description
+# cycle scheduling for the reactive agents process loop
+#
+# Copyright (c) 2019 Australian Synchrotron
+#
+# This library is free software; you can redistribute it and/or
+# modify it under the terms of the GNU Lesser General Public
+# Licence as published by the Free Software Foundation; either
+# version 2.1 of the Licence, or (at your option) any later version.
+#
+# This library is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+# Lesser General Public Licence for more details.
+#
+# You should have received a copy of the GNU Lesser General Public
+# Licence along with this library; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin St, Fifth Floor, Boston, MA 02110-1301 USA.
+#
+# Contact details:
+# nadera@ansto.gov.au
+# 800 Blackburn Road, Clayton, Victoria 3168, Australia.
+#
+
+""" cycle timing for process_loop
+
+CycleTimer sleeps to absolute deadlines on a monotonic clock, applies an overrun
+policy when a cycle runs late, and keeps the timing of every cycle in fixed size
+histograms which can be queried while the loop is running.
+
+AdaptivePeriod works out a cycle period between a minimum and a maximum, from
+whether the agents were active in the last cycle.
+
+TimerWheel keeps the deadlines of the agents which are parked by the event driven
+scheduler.
+
+PhaseClock is the clock of the agents, read once per phase so that all the
+timestamps of a phase agree. Its source can be a VirtualClock, which only moves
+when the loop sleeps, to run a whole graph faster than real time.
+"""
+
+import bisect
+import time
+from collections import deque
+from timeit import default_timer
+
+
+class OverrunPolicy:
+    # drop the missed cycles and wait for the next deadline on the grid
+    Skip = "skip"
+    # run the missed cycles back to back until the grid is caught up
+    CatchUp = "catch_up"
+    # start now and move the grid, so the late cycle becomes the new reference
+    Stretch = "stretch"
+
+
+class Histogram:
+    """ fixed size histogram of durations [s]
+
+    bins are log spaced from 1us to 10s, so recording a sample never allocates.
+    count, total, min and max are exact, percentiles are estimated from the bins.
+    """
+
+    bins_per_decade = 10
+    lowest = 1e-6
+    decades = 7
+
+    def __init__(self):
+        n_edges = self.bins_per_decade * self.decades + 1
+        self.edges = [
+            self.lowest * 10 ** (k / self.bins_per_decade) for k in range(n_edges)
+        ]
+        # first bin is everything below lowest, last one everything above the top edge
+        self.counts = [0] * (n_edges + 1)
+        self.clear()
+
+    def clear(self):
+        for k in range(len(self.counts)):
+            self.counts[k] = 0
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.edges, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, q):
+        """ upper edge of the bin holding the q-th percentile, clipped to max """
+        if not self.count:
+            return None
+
+        rank = q / 100 * self.count
+        cumulative = 0
+        for k, count in enumerate(self.counts):
+            cumulative += count
+            if cumulative >= rank and count:
+                edge = self.edges[k] if k < len(self.edges) else self.max
+                return min(edge, self.max)
+        return self.max
+
+    def summary(self):
+        return dict(
+            count=self.count,
+            mean=self.mean,
+            min=self.min,
+            p50=self.percentile(50),
+            p99=self.percentile(99),
+            max=self.max,
+        )
+
+
+class CycleTimer:
+    """ deadline scheduler for the inference and action phases
+
+    Each cycle starts at an absolute deadline on the grid time_0 + k * cycle_period,
+    and the action phase starts act_delay after the cycle deadline. Sleeping stops
+    spin seconds short of a deadline and the rest is busy-waited, which keeps the
+    start jitter well below a millisecond.
+
+    Per cycle records are kept in histograms:
+        jitter: cycle start - deadline
+        inference: duration of the inference phase
+        action: duration of the action phase
+    overruns counts the cycles which finished after the next deadline, and
+    late_cycles keeps (cycle, lateness) of the most recent ones.
+    """
+
+    catch_up_limit = 10
+
+    def __init__(
+        self,
+        cycle_period,
+        act_delay=None,
+        overrun_policy=OverrunPolicy.Skip,
+        spin=0.001,
+        clock=time.monotonic,
+        sleep=time.sleep,
+    ):
+        self.cycle_period = cycle_period
+        # unless given, act_delay follows the cycle period
+        self.act_fraction = 0.2 if act_delay is None else None
+        self.act_delay = cycle_period / 5 if act_delay is None else act_delay
+        self.overrun_policy = overrun_policy
+        self.spin = spin
+        self.clock = clock
+        self.sleep = sleep
+
+        self.jitter = Histogram()
+        self.inference = Histogram()
+        self.action = Histogram()
+
+        self.cycles = 0
+        self.overruns = 0
+        self.skipped = 0
+        self.act_overruns = 0
+        self.late_cycles = deque(maxlen=100)
+
+        self.next_deadline = None
+        self.deadline = None
+        self.act_deadline = None
+        self.cycle_start = None
+        self.act_start = None
+
+    def set_period(self, cycle_period):
+        """ changes the period from the next cycle on, which starts cycle_period
+        after the start of the current one, or now if that is passed already
+        """
+        if cycle_period == self.cycle_period:
+            return
+        self.cycle_period = cycle_period
+        if self.act_fraction is not None:
+            self.act_delay = cycle_period * self.act_fraction
+        if self.deadline is not None:
+            self.next_deadline = max(self.deadline + cycle_period, self.clock())
+
+    def sleep_until(self, deadline):
+        lead_time = deadline - self.clock() - self.spin
+        if lead_time > 0:
+            self.sleep(lead_time)
+        while self.clock() < deadline:
+            if not self.spin:
+                # e.g. a VirtualClock, which doesn't move by itself
+                self.sleep(deadline - self.clock())
+
+    def infer_deadline(self):
+        """ deadline for the next cycle, after applying the overrun policy """
+
+        now = self.clock()
+        if self.next_deadline is None:
+            self.next_deadline = now + self.cycle_period
+
+        deadline = self.next_deadline
+        if deadline < now:
+            missed = int((now - deadline) // self.cycle_period) + 1
+
+            if self.overrun_policy == OverrunPolicy.Stretch:
+                deadline = now
+            elif (
+                self.overrun_policy == OverrunPolicy.CatchUp
+                and missed <= self.catch_up_limit
+            ):
+                # start now, keeping the grid
+                pass
+            else:
+                # skip to the next deadline in the future
+                deadline += missed * self.cycle_period
+                self.skipped += missed
+
+        self.deadline = deadline
+        return deadline
+
+    def started(self):
+        """ marks the start of inference, call after waiting for infer_deadline """
+
+        self.cycle_start = self.clock()
+        self.cycles += 1
+        self.jitter.add(self.cycle_start - self.deadline)
+
+        self.next_deadline = self.deadline + self.cycle_period
+        self.act_deadline = self.deadline + self.act_delay
+        return self.cycle_start
+
+    def wait_infer(self):
+        self.sleep_until(self.infer_deadline())
+        return self.started()
+
+    def end_inference(self):
+        self.inference.add(self.clock() - self.cycle_start)
+
+    def act_lead_time(self):
+        """ time left until the action phase, negative if inference ran past it """
+        lead_time = self.act_deadline - self.clock()
+        if lead_time < 0:
+            self.act_overruns += 1
+        return lead_time
+
+    def act_started(self):
+        self.act_start = self.clock()
+
+    def wait_act(self):
+        if self.act_lead_time() > 0:
+            self.sleep_until(self.act_deadline)
+        self.act_started()
+
+    def end_action(self):
+        now = self.clock()
+        self.action.add(now - self.act_start)
+        if now > self.next_deadline:
+            self.overruns += 1
+            self.late_cycles.append((self.cycles, now - self.next_deadline))
+
+    def report(self):
+        return dict(
+            cycles=self.cycles,
+            overruns=self.overruns,
+            skipped=self.skipped,
+            act_overruns=self.act_overruns,
+            jitter=self.jitter.summary(),
+            inference=self.inference.summary(),
+            action=self.action.summary(),
+        )
+
+    def report_str(self):
+        _fmt = "{:.6f}".format
+        _lines = [
+            "cycles {cycles}, overruns {overruns}, skipped {skipped}, "
+            "late actions {act_overruns}".format(**self.report())
+        ]
+        for name in ["jitter", "inference", "action"]:
+            hist = getattr(self, name)
+            if not hist.count:
+                continue
+            _lines.append(
+                f"{name}: mean {_fmt(hist.mean)}s, p50 {_fmt(hist.percentile(50))}s, "
+                f"p99 {_fmt(hist.percentile(99))}s, max {_fmt(hist.max)}s"
+            )
+        return "\n".join(_lines)
+
+
+class AdaptivePeriod:
+    """ cycle period which follows the activity of the agents
+
+    Any activity brings the period straight down to min_period. After
+    quiet_cycles quiet cycles in a row, the period is stretched by the stretch
+    factor on each further quiet cycle, up to max_period.
+    """
+
+    def __init__(self, min_period, max_period, quiet_cycles=4, stretch=2.0):
+        if not 0 < min_period <= max_period:
+            raise ValueError(
+                f"expected 0 < min_period <= max_period, got {min_period}, {max_period}"
+            )
+        self.min_period = min_period
+        self.max_period = max_period
+        self.quiet_cycles = quiet_cycles
+        self.stretch = stretch
+
+        self.period = min_period
+        self.n_quiet = 0
+
+    def update(self, active):
+        """ returns the period for the next cycle """
+        if active:
+            self.n_quiet = 0
+            self.period = self.min_period
+        else:
+            self.n_quiet += 1
+            if self.n_quiet > self.quiet_cycles:
+                self.period = min(self.period * self.stretch, self.max_period)
+        return self.period
+
+
+class TimerWheel:
+    """ hierarchical timer wheel of keys and their deadlines
+
+    Level 0 has n_slots slots of resolution seconds, and each level above has
+    n_slots slots of a full turn of the level below. A key is placed on the lowest
+    level which spans its deadline and moves down a level as that slot comes up,
+    so insert, cancel and the expiry of each key are O(1), and advancing costs
+    one step per elapsed tick of resolution, or nothing while the wheel is empty.
+
+    Keys expire on the first advance(now) with now >= deadline, rounded up to
+    the resolution. Inserting a key again moves it to the new deadline.
+
+    The wheel starts at start if given, else at the first advance, and until
+    then from just before the earliest deadline inserted.
+    """
+
+    def __init__(self, resolution=0.01, slot_bits=6, levels=4, start=None):
+        self.resolution = resolution
+        self.slot_bits = slot_bits
+        self.n_slots = 1 << slot_bits
+        self.mask = self.n_slots - 1
+        self.levels = [[[] for _ in range(self.n_slots)] for _ in range(levels)]
+        # beyond the top level, cascaded on each turn of the top level
+        self.overflow = []
+        self.deadlines = {}
+        self.current_tick = None if start is None else int(start // resolution)
+        self.started = start is not None
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def __contains__(self, key):
+        return key in self.deadlines
+
+    def tick_of(self, deadline):
+        return -int(-deadline // self.resolution)
+
+    def insert(self, key, deadline):
+        if not self.started and (
+            self.current_tick is None or self.tick_of(deadline) <= self.current_tick
+        ):
+            self.rebase(self.tick_of(deadline) - 1)
+        self.deadlines[key] = deadline
+        self.place(key, deadline, max(self.tick_of(deadline), self.current_tick + 1))
+
+    def rebase(self, tick):
+        """ moves the start of the wheel back to tick, before the first advance """
+
+        self.current_tick = tick
+        self.levels = [[[] for _ in range(self.n_slots)] for _ in self.levels]
+        self.overflow = []
+        for key, deadline in self.deadlines.items():
+            self.place(key, deadline, self.tick_of(deadline))
+
+    def cancel(self, key):
+        # entries left in the slots are dropped when they come up
+        self.deadlines.pop(key, None)
+
+    def place(self, key, deadline, tick):
+        delta = tick - self.current_tick
+        for level, slots in enumerate(self.levels):
+            if delta < 1 << (self.slot_bits * (level + 1)):
+                slots[(tick >> (self.slot_bits * level)) & self.mask].append(
+                    (key, deadline)
+                )
+                return
+        self.overflow.append((key, deadline))
+
+    def cascade(self, level):
+        slot_index = (self.current_tick >> (self.slot_bits * level)) & self.mask
+        entries = self.levels[level][slot_index]
+        self.levels[level][slot_index] = []
+        if level == len(self.levels) - 1:
+            entries, self.overflow = entries + self.overflow, []
+        for key, deadline in entries:
+            if self.deadlines.get(key) == deadline:
+                self.place(key, deadline, max(self.tick_of(deadline), self.current_tick))
+
+    def advance(self, now):
+        """ returns the keys whose deadline is up, in order of expiry """
+
+        target = int(now // self.resolution)
+        self.started = True
+        if not self.deadlines or self.current_tick is None:
+            self.current_tick = target
+            return []
+
+        expired = []
+        while self.current_tick < target and self.deadlines:
+            self.current_tick += 1
+
+            # the levels above move down as the levels below turn over
+            top = 0
+            while (
+                top + 1 < len(self.levels)
+                and self.current_tick & ((1 << (self.slot_bits * (top + 1))) - 1) == 0
+            ):
+                top += 1
+            for level in range(top, 0, -1):
+                self.cascade(level)
+
+            slot_index = self.current_tick & self.mask
+            entries = self.levels[0][slot_index]
+            self.levels[0][slot_index] = []
+            for key, deadline in entries:
+                if self.deadlines.get(key) == deadline:
+                    del self.deadlines[key]
+                    expired.append(key)
+
+        self.current_tick = max(self.current_tick, target)
+        return expired
+
+
+class PhaseClock:
+    """ time of the agents, timer() compatible
+
+    Between begin_phase and end_phase every call returns the time read at the
+    start of the phase, otherwise it reads source.
+    """
+
+    def __init__(self, source=default_timer):
+        self.source = source
+        self.now = None
+
+    def __call__(self):
+        now = self.now
+        return self.source() if now is None else now
+
+    def begin_phase(self):
+        self.now = self.source()
+        return self.now
+
+    def end_phase(self):
+        self.now = None
+
+
+class VirtualClock:
+    """ simulated time, only moves when slept on or advanced
+
+    Pass it as the clock of process_loop, and its cycles, hold timers and waits
+    run back to back at full speed.
+    """
+
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        if seconds > 0:
+            self.now += seconds
+
+    advance = sleep